@@ -1,7 +1,6 @@
 import customtkinter as ctk
 import ctypes
 import logging
-import base64
 from datetime import datetime
 from typing import Optional, Set, List
 import threading
@@ -12,6 +11,11 @@ from .history_manager import HistoryManager
 from .network_handler import NetworkHandler
 from .audio_handler import AudioHandler
 from shared import config
+from shared import tracing
+
+TRACE_SEND = tracing.tracepoint("client.send")  # mỗi chunk audio gửi đi (tắt mặc định)
+
+ACTIVE_SPEAKERS_LIMIT = 3  # số người nói tối đa khi tạo phòng có giới hạn người nói
 
 #  Quan trọng: Đặt phần này ở đầu file để đảm bảo DPI awareness hoạt động
 try:
@@ -45,6 +49,8 @@ class AudioCallApp:
         self.selected_input_device = None
         self.selected_output_device = None
         self.room_users: List[str] = []
+        self.active_speakers: Set[str] = set()  # phòng giới hạn số người nói
+        self.active_speakers_version = 0
 
         # UI setup
         self._configure_dpi()
@@ -218,6 +224,22 @@ class AudioCallApp:
             text_color="#ffffff"
         ).pack(pady=8)
 
+        self.mix_mode_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            create_frame,
+            text="🎛️ Server trộn âm (phòng đông người)",
+            variable=self.mix_mode_var,
+            font=("Arial", 11)
+        ).pack(pady=4)
+
+        self.limit_speakers_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            create_frame,
+            text=f"🔊 Chỉ phát {ACTIVE_SPEAKERS_LIMIT} người nói to nhất",
+            variable=self.limit_speakers_var,
+            font=("Arial", 11)
+        ).pack(pady=4)
+
         self.create_room_button = ctk.CTkButton(
             create_frame, 
             text="🎯 Tạo phòng",
@@ -413,7 +435,17 @@ class AudioCallApp:
             self.user_listbox.insert(ctk.END, "Chưa có thành viên nào\n")
         else:
             for user in users:
-                self.user_listbox.insert(ctk.END, f"👤 {user}\n")
+                icon = "🔊" if user in self.active_speakers else "👤"
+                self.user_listbox.insert(ctk.END, f"{icon} {user}\n")
+
+    def _update_active_speakers(self, message):
+        """Phòng giới hạn số người nói: đánh dấu những người đang được phát"""
+        version = message.get('version', message.get('speakers_version', 0))
+        if version < self.active_speakers_version:
+            return  # bản cũ đến sau bản mới
+        self.active_speakers_version = version
+        self.active_speakers = set(message.get('speakers', message.get('active_speakers', [])))
+        self._update_user_list(self.room_users)
 
     def _share_whatsapp(self):
         """Chia sẻ mã phòng qua WhatsApp"""
@@ -557,6 +589,10 @@ class AudioCallApp:
 
     def _handle_network_message(self, message):
         msg_type = message.get('type')
+        if msg_type in ('ROOM_CREATED', 'JOIN_SUCCESS'):
+            self.active_speakers = set()
+            self.active_speakers_version = 0
+            self.audio_handler.reset_stream_stats()
         if msg_type == 'ROOM_CREATED':
             self.current_room_id = message.get('room_id')
             users = message.get('users', [])
@@ -568,6 +604,8 @@ class AudioCallApp:
             self.current_room_id = message.get('room_id')
             users = message.get('users', [])
             self._update_user_list(users)
+            if 'active_speakers' in message:
+                self._update_active_speakers(message)
             self._update_room_display()
             self.update_status(f"✅ Đã tham gia phòng {self.current_room_id}", "green")
             self._update_call_controls()
@@ -577,6 +615,8 @@ class AudioCallApp:
         elif msg_type == 'USER_LEFT':
             users = message.get('users', [])
             self._update_user_list(users)
+        elif msg_type == 'ACTIVE_SPEAKERS':
+            self._update_active_speakers(message)
         elif msg_type == 'AUDIO_DATA':
             try:
                 self.audio_handler.handle_audio_data(message)
@@ -585,7 +625,9 @@ class AudioCallApp:
 
     def create_room(self):
         self.network_handler.send_message({
-            'type': 'CREATE_ROOM'
+            'type': 'CREATE_ROOM',
+            'mode': 'mix' if self.mix_mode_var.get() else 'forward',
+            'max_speakers': ACTIVE_SPEAKERS_LIMIT if self.limit_speakers_var.get() else 0
         })
         self.update_status("🔄 Đang tạo phòng...", "blue")
 
@@ -604,6 +646,7 @@ class AudioCallApp:
     def leave_room(self):
         if self.current_room_id:
             self.network_handler.send_message({'type': 'LEAVE_ROOM'})
+            self.audio_handler.stop_udp_transport()
             self.current_room_id = None
             self._update_user_list([])
             self.update_status("✅ Đã rời phòng", "blue")
@@ -705,16 +748,12 @@ class AudioCallApp:
                         audio_data = audio_data[:expected_size]
                     logging.info(f"[AudioSend] ✅ Adjusted size to: {len(audio_data)}")
                 
-                # ENCODE VÀ GỬI
-                audio_b64 = base64.b64encode(audio_data).decode('utf-8')
-                
-                success = self.network_handler.send_message({
-                    'type': 'AUDIO_DATA',
-                    'data': audio_b64
-                })
+                # GỬI (UDP nếu có, TCP media frame nhị phân hoặc JSON base64)
+                success = self.audio_handler.send_audio(audio_data)
                 
                 if success:
-                    logging.debug(f"[AudioSend] ✅ Sent: {len(audio_data)} bytes")
+                    if TRACE_SEND.enabled and TRACE_SEND.sampled():
+                        TRACE_SEND.emit(bytes=len(audio_data), room=self.current_room_id)
                 else:
                     logging.warning("[AudioSend] ❌ Failed to send")
                     
@@ -723,15 +762,13 @@ class AudioCallApp:
 
     def _get_audio_data(self):
         try:
-            if not self.audio_handler.audio_queue.empty():
-                return self.audio_handler.audio_queue.get_nowait()
-            else:
-                sample_size = self.audio_handler.audio.get_sample_size(config.AUDIO_FORMAT)
-                return b'\x00' * (config.AUDIO_CHUNK * sample_size * config.AUDIO_CHANNELS)
+            data = self.audio_handler.next_playback_chunk()
+            if data is not None:
+                return data
+            return self.audio_handler.silence
         except Exception as e:
             logging.error(f"[GUI] Get audio data error: {e}")
-            sample_size = self.audio_handler.audio.get_sample_size(config.AUDIO_FORMAT)
-            return b'\x00' * (config.AUDIO_CHUNK * sample_size * config.AUDIO_CHANNELS)
+            return self.audio_handler.silence
 
     def _update_room_display(self):
         if self.current_room_id:
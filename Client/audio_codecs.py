@@ -0,0 +1,230 @@
+import logging
+import struct
+import numpy as np
+from shared import config
+from shared.protocol import CODEC_ADPCM, CODEC_OPUS, CODEC_PCM, CODEC_ULAW, CODEC_NAMES
+
+try:
+    import opuslib  # tuỳ chọn: cần libopus
+except Exception:  # ImportError, hoặc không tìm thấy thư viện libopus
+    opuslib = None
+
+
+class PcmCodec:
+    """PCM int16 thô (không nén) - luôn có, dùng với client cũ"""
+
+    codec_id = CODEC_PCM
+    name = CODEC_NAMES[CODEC_PCM]
+
+    def encode(self, pcm):
+        return pcm
+
+    def decode(self, payload):
+        return payload
+
+
+# --- G.711 μ-law (2:1) ------------------------------------------------------
+
+_ULAW_BIAS = 0x84
+_ULAW_CLIP = 8159  # biên độ tối đa ở miền 14 bit
+
+
+def _build_ulaw_tables():
+    # Bảng mã hóa 65536 phần tử (chỉ số = mẫu int16 xem như uint16): encode chỉ là một phép tra bảng.
+    # Cùng phép tính với bản tham chiếu G.711 (miền 14 bit, bias 0x21)
+    samples = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(samples < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(samples), _ULAW_CLIP) + (_ULAW_BIAS >> 2)
+    exponent = np.floor(np.log2(np.maximum(magnitude >> 5, 1))).astype(np.int32)
+    mantissa = (magnitude >> (exponent + 1)) & 0x0F
+    code = np.where(exponent > 7, 0x7F, (exponent << 4) | mantissa)  # vượt đoạn cuối: giá trị lớn nhất
+    encode = (code ^ mask).astype(np.uint8)
+
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    magnitude = (((codes & 0x0F) << 3) + _ULAW_BIAS) << exponent
+    decode = np.where(codes & 0x80, _ULAW_BIAS - magnitude, magnitude - _ULAW_BIAS).astype(np.int16)
+    return encode, decode
+
+
+_ULAW_ENCODE, _ULAW_DECODE = _build_ulaw_tables()
+
+
+class UlawCodec:
+    """G.711 μ-law: 8 bit mỗi mẫu, mã hóa / giải mã bằng tra bảng NumPy"""
+
+    codec_id = CODEC_ULAW
+    name = CODEC_NAMES[CODEC_ULAW]
+
+    def encode(self, pcm):
+        return _ULAW_ENCODE[np.frombuffer(pcm, dtype=np.uint16)].tobytes()
+
+    def decode(self, payload):
+        return _ULAW_DECODE[np.frombuffer(payload, dtype=np.uint8)].tobytes()
+
+
+# --- IMA-ADPCM (4:1) --------------------------------------------------------
+
+_ADPCM_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767)
+_ADPCM_INDEX_STEP = (-1, -1, -1, -1, 2, 4, 6, 8)
+_ADPCM_HEADER = struct.Struct("!hBx")  # predictor | step index | (pad)
+
+
+def _build_adpcm_tables():
+    # (index, code) -> (chênh lệch có dấu, index kế tiếp): vòng lặp giải mã chỉ còn tra bảng
+    deltas, next_index = [], []
+    for index, step in enumerate(_ADPCM_STEPS):
+        for code in range(16):
+            diff = step >> 3
+            if code & 4:
+                diff += step
+            if code & 2:
+                diff += step >> 1
+            if code & 1:
+                diff += step >> 2
+            deltas.append(-diff if code & 8 else diff)
+            next_index.append(min(88, max(0, index + _ADPCM_INDEX_STEP[code & 7])))
+    return tuple(deltas), tuple(next_index)
+
+
+_ADPCM_DELTAS, _ADPCM_NEXT_INDEX = _build_adpcm_tables()
+
+
+class AdpcmCodec:
+    """IMA-ADPCM: 4 bit mỗi mẫu + header 4 byte mỗi frame.
+
+    Mỗi frame mang trạng thái đầu frame (predictor, step index) nên giải mã
+    được độc lập - mất một gói không làm hỏng các frame sau. Bộ mã hóa giữ
+    trạng thái giữa các frame (mỗi người gửi một instance).
+    Thuật toán ADPCM tuần tự theo từng mẫu nên vòng lặp mẫu chạy bằng Python
+    (dùng bảng tra sẵn); NumPy chỉ dùng để đóng gói / tách các nibble.
+    """
+
+    codec_id = CODEC_ADPCM
+    name = CODEC_NAMES[CODEC_ADPCM]
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    def encode(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.int16).tolist()
+        header = _ADPCM_HEADER.pack(self.predictor, self.index)
+        predictor, index = self.predictor, self.index
+        steps, deltas, next_index = _ADPCM_STEPS, _ADPCM_DELTAS, _ADPCM_NEXT_INDEX
+        codes = []
+        append = codes.append
+        for sample in samples:
+            step = steps[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            if diff >= step:
+                code |= 4
+                diff -= step
+            if diff >= step >> 1:
+                code |= 2
+                diff -= step >> 1
+            if diff >= step >> 2:
+                code |= 1
+            entry = index * 16 + code
+            predictor += deltas[entry]
+            if predictor > 32767:
+                predictor = 32767
+            elif predictor < -32768:
+                predictor = -32768
+            index = next_index[entry]
+            append(code)
+        self.predictor, self.index = predictor, index
+        if len(codes) & 1:
+            append(0)
+        nibbles = np.array(codes, dtype=np.uint8)
+        return header + (nibbles[0::2] | (nibbles[1::2] << 4)).tobytes()
+
+    def decode(self, payload):
+        if len(payload) < _ADPCM_HEADER.size:
+            return b""
+        predictor, index = _ADPCM_HEADER.unpack_from(payload)
+        index = min(88, index)
+        packed = np.frombuffer(payload, dtype=np.uint8, offset=_ADPCM_HEADER.size)
+        codes = np.empty(len(packed) * 2, dtype=np.uint8)
+        codes[0::2] = packed & 0x0F
+        codes[1::2] = packed >> 4
+        deltas, next_index = _ADPCM_DELTAS, _ADPCM_NEXT_INDEX
+        out = []
+        append = out.append
+        for code in codes.tolist():
+            entry = index * 16 + code
+            predictor += deltas[entry]
+            if predictor > 32767:
+                predictor = 32767
+            elif predictor < -32768:
+                predictor = -32768
+            index = next_index[entry]
+            append(predictor)
+        return np.array(out, dtype=np.int16).tobytes()
+
+
+# --- Opus (tuỳ chọn) --------------------------------------------------------
+
+_OPUS_FRAME_MS = (2.5, 5, 10, 20, 40, 60)
+
+
+def _opus_supported():
+    """Opus chỉ nhận frame 2.5/5/10/20/40/60 ms: AUDIO_CHUNK phải khớp một trong số đó"""
+    if opuslib is None:
+        return False
+    return config.AUDIO_CHUNK * 1000 / config.AUDIO_RATE in _OPUS_FRAME_MS
+
+
+class OpusCodec:
+    """Opus qua opuslib (libopus). Mỗi instance chỉ dùng để mã hóa hoặc giải mã một luồng."""
+
+    codec_id = CODEC_OPUS
+    name = CODEC_NAMES[CODEC_OPUS]
+
+    def __init__(self):
+        self.encoder = None
+        self.decoder = None
+
+    def encode(self, pcm):
+        if self.encoder is None:
+            self.encoder = opuslib.Encoder(config.AUDIO_RATE, config.AUDIO_CHANNELS, opuslib.APPLICATION_VOIP)
+            self.encoder.bitrate = config.OPUS_BITRATE
+        return self.encoder.encode(bytes(pcm), config.AUDIO_CHUNK)
+
+    def decode(self, payload):
+        if self.decoder is None:
+            self.decoder = opuslib.Decoder(config.AUDIO_RATE, config.AUDIO_CHANNELS)
+        return self.decoder.decode(bytes(payload), config.AUDIO_CHUNK)
+
+
+_CODECS = {
+    CODEC_PCM: PcmCodec,
+    CODEC_ULAW: UlawCodec,
+    CODEC_ADPCM: AdpcmCodec,
+}
+if _opus_supported():
+    _CODECS[CODEC_OPUS] = OpusCodec
+elif opuslib is not None:
+    logging.info(f"[Codec] Opus disabled: {config.AUDIO_CHUNK} samples at {config.AUDIO_RATE}Hz "
+                 f"is not a valid Opus frame size")
+
+
+def available_codecs():
+    """Tên các codec client này hỗ trợ (gửi kèm REGISTER)"""
+    return [CODEC_NAMES[codec_id] for codec_id in _CODECS]
+
+
+def create_codec(codec_id):
+    """Tạo codec theo id (mỗi luồng gửi / nhận một instance). None nếu không hỗ trợ."""
+    factory = _CODECS.get(codec_id)
+    return factory() if factory else None
@@ -0,0 +1,356 @@
+import collections
+import logging
+import threading
+import time
+import wave
+import numpy as np
+from shared import config
+
+try:
+    import pyaudio  # tuỳ chọn: cần PortAudio, không có trên máy headless / CI
+except Exception:
+    pyaudio = None
+
+PA_CONTINUE = 0   # pyaudio.paContinue: giá trị trả về của stream callback để chạy tiếp
+
+BACKENDS = ("pyaudio", "wav", "loopback", "synthetic")
+
+
+class PyAudioBackend:
+    """Thiết bị âm thanh thật qua PyAudio (PortAudio)"""
+
+    name = "pyaudio"
+
+    def __init__(self):
+        if pyaudio is None:
+            raise RuntimeError("PyAudio is not installed")
+        self.pa = pyaudio.PyAudio()
+
+    def open(self, **kwargs):
+        return self.pa.open(**kwargs)
+
+    def get_sample_size(self, format):
+        return self.pa.get_sample_size(format)
+
+    def list_devices(self):
+        info = self.pa.get_host_api_info_by_index(0)
+        devices = []
+        for i in range(info.get('deviceCount')):
+            device = self.pa.get_device_info_by_host_api_device_index(0, i)
+            devices.append({
+                'index': i,
+                'name': device['name'],
+                'input_channels': device['maxInputChannels'],
+                'output_channels': device['maxOutputChannels']
+            })
+        return devices
+
+    def terminate(self):
+        self.pa.terminate()
+
+
+class VirtualStream:
+    """Stream giả lập có cùng giao diện với stream PyAudio mà AudioHandler dùng.
+
+    - Chặn (read/write): mỗi lời gọi chờ tới hạn chu kỳ tiếp theo của đồng hồ
+      stream, như card âm thanh; realtime=False thì chạy nhanh nhất có thể.
+    - Callback (stream_callback): một thread gọi callback mỗi chu kỳ với cùng
+      tham số như PortAudio; callback trả cờ khác PA_CONTINUE thì stream dừng.
+    """
+
+    def __init__(self, backend, frames, input=False, output=False, stream_callback=None,
+                 start=True, realtime=True):
+        self.backend = backend
+        self.frames = frames
+        self.input = input
+        self.output = output
+        self.callback = stream_callback
+        self.realtime = realtime
+        self.period = frames / config.AUDIO_RATE
+        self.deadline = None
+        self.active = False
+        self.thread = None
+        if start:
+            self.start_stream()
+
+    def _wait_period(self):
+        if not self.realtime:
+            return
+        now = time.monotonic()
+        if self.deadline is None or now - self.deadline > 4 * self.period:
+            self.deadline = now   # bắt đầu hoặc bị trễ quá xa: neo lại đồng hồ, không chạy bù
+        self.deadline += self.period
+        delay = self.deadline - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def read(self, frames, exception_on_overflow=False):
+        self._wait_period()
+        return self.backend.capture(frames)
+
+    def write(self, data):
+        self._wait_period()
+        self.backend.playback(bytes(data))
+
+    def start_stream(self):
+        self.active = True
+        self.deadline = None
+        if self.callback and (self.thread is None or not self.thread.is_alive()):
+            self.thread = threading.Thread(target=self._run_callback, daemon=True)
+            self.thread.start()
+
+    def _run_callback(self):
+        while self.active:
+            self._wait_period()
+            if not self.active:
+                break
+            try:
+                in_data = self.backend.capture(self.frames) if self.input else None
+                out_data, flag = self.callback(in_data, self.frames, {}, 0)
+                if self.output and out_data is not None:
+                    self.backend.playback(bytes(out_data))
+            except Exception as e:
+                logging.error(f"[AudioDevice] Stream callback error: {e}")
+                break
+            if flag != PA_CONTINUE:
+                break
+        self.active = False
+
+    def is_active(self):
+        return self.active
+
+    def stop_stream(self):
+        self.active = False
+        thread = self.thread
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=1.0)
+
+    def close(self):
+        self.stop_stream()
+
+
+class VirtualBackend:
+    """Nền cho các thiết bị không cần phần cứng: lớp con cài capture() / playback()"""
+
+    name = None
+    devices = ({'index': 0, 'name': "virtual", 'input_channels': 1, 'output_channels': 1},)
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.frame_bytes = config.AUDIO_SAMPLE_WIDTH * config.AUDIO_CHANNELS
+        self.stats = {'captured': 0, 'played': 0}
+
+    def open(self, format=None, channels=None, rate=None, input=False, output=False,
+             input_device_index=None, output_device_index=None,
+             frames_per_buffer=config.AUDIO_CHUNK, stream_callback=None, start=True):
+        if rate not in (None, config.AUDIO_RATE) or channels not in (None, config.AUDIO_CHANNELS):
+            raise ValueError(f"{self.name} backend only supports {config.AUDIO_RATE}Hz, "
+                             f"{config.AUDIO_CHANNELS} channel(s)")
+        return VirtualStream(self, frames_per_buffer, input=input, output=output,
+                             stream_callback=stream_callback, start=start, realtime=self.realtime)
+
+    def get_sample_size(self, format):
+        return config.AUDIO_SAMPLE_WIDTH
+
+    def list_devices(self):
+        return [dict(device, name=f"{self.name} ({device['name']})") for device in self.devices]
+
+    def capture(self, frames):
+        """Chunk mic tiếp theo (bytes int16, đúng frames mẫu)"""
+        self.stats['captured'] += 1
+        return bytes(frames * self.frame_bytes)
+
+    def playback(self, data):
+        """Chunk vừa được phát ra loa"""
+        self.stats['played'] += 1
+
+    def terminate(self):
+        pass
+
+
+class WavFileBackend(VirtualBackend):
+    """Mic đọc từ file WAV, loa ghi ra file WAV (PCM 16 bit, đúng AUDIO_RATE / AUDIO_CHANNELS).
+
+    Hết file mic thì trả im lặng, hoặc đọc lại từ đầu nếu loop=True.
+    """
+
+    name = "wav"
+
+    def __init__(self, input_path=None, output_path=None, loop=False, realtime=True):
+        super().__init__(realtime)
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.reader = None
+        self.writer = None
+        if input_path:
+            self.reader = wave.open(input_path, 'rb')
+            if (self.reader.getframerate() != config.AUDIO_RATE
+                    or self.reader.getnchannels() != config.AUDIO_CHANNELS
+                    or self.reader.getsampwidth() != config.AUDIO_SAMPLE_WIDTH):
+                self.reader.close()
+                raise ValueError(f"{input_path}: expected {config.AUDIO_RATE}Hz, "
+                                 f"{config.AUDIO_CHANNELS} channel(s), 16-bit PCM")
+        if output_path:
+            self.writer = wave.open(output_path, 'wb')
+            self.writer.setnchannels(config.AUDIO_CHANNELS)
+            self.writer.setsampwidth(config.AUDIO_SAMPLE_WIDTH)
+            self.writer.setframerate(config.AUDIO_RATE)
+
+    def capture(self, frames):
+        self.stats['captured'] += 1
+        size = frames * self.frame_bytes
+        with self.lock:
+            if self.reader is None:
+                return bytes(size)
+            data = self.reader.readframes(frames)
+            if len(data) < size and self.loop and self.reader.getnframes():
+                self.reader.rewind()
+                data += self.reader.readframes(frames - len(data) // self.frame_bytes)
+        return data + bytes(size - len(data))
+
+    def playback(self, data):
+        self.stats['played'] += 1
+        with self.lock:
+            if self.writer is not None:
+                self.writer.writeframes(data)
+
+    def terminate(self):
+        with self.lock:
+            for f in (self.reader, self.writer):
+                if f is not None:
+                    f.close()
+            self.reader = self.writer = None
+
+
+class LoopbackBackend(VirtualBackend):
+    """Thiết bị trong bộ nhớ cho test / đo tải.
+
+    - Mic: các chunk đưa vào bằng feed(); hết thì im lặng.
+    - Loa: chunk phát ra được giữ lại (tối đa max_frames), lấy ra bằng take_played().
+    - echo_gain > 0: âm thanh phát ra loa quay lại mic sau echo_delay chunk (mô
+      phỏng vọng âm cho AEC).
+    """
+
+    name = "loopback"
+
+    def __init__(self, echo_gain=0.0, echo_delay=2, max_frames=1000, realtime=True):
+        super().__init__(realtime)
+        self.echo_gain = echo_gain
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.played = collections.deque(maxlen=max_frames)
+        self.echo = collections.deque([None] * echo_delay, maxlen=echo_delay + 4)
+
+    def feed(self, pcm):
+        """Thêm âm thanh (bytes int16, độ dài bất kỳ) vào hàng đợi mic"""
+        chunk = config.AUDIO_CHUNK * self.frame_bytes
+        pcm = bytes(pcm)
+        with self.lock:
+            for start in range(0, len(pcm), chunk):
+                self.pending.append(pcm[start:start + chunk])
+
+    def pending_frames(self):
+        with self.lock:
+            return len(self.pending)
+
+    def capture(self, frames):
+        self.stats['captured'] += 1
+        size = frames * self.frame_bytes
+        with self.lock:
+            data = self.pending.popleft() if self.pending else b""
+            echo = self.echo.popleft() if self.echo_gain and self.echo else None
+        data += bytes(size - len(data))
+        if echo is None:
+            return data
+        mixed = np.frombuffer(data, dtype=np.int16).astype(np.int32)
+        mixed += (np.frombuffer(echo, dtype=np.int16)[:frames] * self.echo_gain).astype(np.int32)
+        np.clip(mixed, -32768, 32767, out=mixed)
+        return mixed.astype(np.int16).tobytes()
+
+    def playback(self, data):
+        self.stats['played'] += 1
+        with self.lock:
+            self.played.append(data)
+            if self.echo_gain:
+                self.echo.append(data)
+
+    def take_played(self):
+        """Lấy (và xóa) các chunk đã phát ra loa, cũ nhất trước"""
+        with self.lock:
+            frames = list(self.played)
+            self.played.clear()
+        return frames
+
+
+class SyntheticBackend(VirtualBackend):
+    """Mic là tín hiệu tổng hợp, loa chỉ đếm chunk.
+
+    - kind="tone": sóng sin frequency Hz.
+    - kind="speech": họa âm của cao độ 120-220 Hz với bao biên độ kiểu âm tiết, cộng
+      nhiễu nền; talk/pause > 0 thì xen kẽ talk giây nói, pause giây im lặng.
+    """
+
+    name = "synthetic"
+
+    def __init__(self, kind="speech", frequency=440.0, amplitude=6000.0, noise=60.0,
+                 talk=0.0, pause=0.0, seed=None, realtime=True):
+        super().__init__(realtime)
+        if kind not in ("tone", "speech"):
+            raise ValueError(f"Unknown synthetic signal: {kind}")
+        self.kind = kind
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.noise = noise
+        self.talk = talk
+        self.pause = pause
+        self.rng = np.random.default_rng(seed)
+        self.position = 0   # mẫu đã tạo
+        self.phase = 0.0
+        self.lock = threading.Lock()
+
+    def capture(self, frames):
+        self.stats['captured'] += 1
+        with self.lock:
+            t = (self.position + np.arange(frames)) / config.AUDIO_RATE
+            self.position += frames
+            if self.kind == "tone":
+                signal = np.sin(2 * np.pi * self.frequency * t)
+            else:
+                # Cao độ thay đổi: tích lũy pha liên tục qua các chunk
+                pitch = 170 + 50 * np.sin(2 * np.pi * 0.7 * t)
+                phase = self.phase + 2 * np.pi * np.cumsum(pitch) / config.AUDIO_RATE
+                self.phase = float(phase[-1]) % (2 * np.pi)
+                signal = sum(np.sin(k * phase) / k for k in range(1, 8))
+                signal *= np.clip(np.sin(2 * np.pi * 3.0 * t), 0, None) ** 0.5
+            if self.talk > 0 and self.pause > 0:
+                signal *= (t % (self.talk + self.pause)) < self.talk
+            signal = self.amplitude * signal
+            if self.noise:
+                signal += self.rng.normal(0, self.noise, frames)
+        np.clip(signal, -32768, 32767, out=signal)
+        return np.repeat(signal.astype(np.int16), config.AUDIO_CHANNELS).tobytes()
+
+
+_BACKENDS = {
+    "wav": WavFileBackend,
+    "loopback": LoopbackBackend,
+    "synthetic": SyntheticBackend,
+}
+
+
+def create_backend(name=None, **options):
+    """Tạo thiết bị âm thanh theo tên (mặc định config.AUDIO_BACKEND).
+
+    options được truyền cho lớp thiết bị (vd input_path cho "wav", kind cho "synthetic").
+    Không có PyAudio thì "pyaudio" chuyển sang "loopback" (mic im lặng) để client vẫn chạy.
+    """
+    name = name or config.AUDIO_BACKEND
+    if name == "pyaudio":
+        if pyaudio is not None:
+            return PyAudioBackend()
+        logging.warning("[AudioDevice] PyAudio not available, using loopback (silent) device")
+        name = "loopback"
+    factory = _BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown audio backend: {name} (expected one of {', '.join(BACKENDS)})")
+    return factory(**options)
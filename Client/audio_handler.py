@@ -1,17 +1,50 @@
-import pyaudio # Thư viện làm việc với thiết bị âm thanh (mic, loa)
 import logging
-import queue
 import base64
+import collections
 import threading
 import time
 import numpy as np
 from shared import config
+from shared import tracing
+from shared.protocol import CODEC_CN, CODEC_IDS, CODEC_NAMES, CODEC_PCM, FLAG_CODEC_MASK, media_timestamp
+from .audio_codecs import create_codec
+from .audio_devices import PA_CONTINUE, create_backend
+from .capture_dsp import CaptureDsp
+from .echo_canceller import EchoCanceller
+from .jitter_buffer import JitterBuffer
+from .ring_buffer import FrameRing
+from .stream_stats import StreamStats
+from .udp_media import UdpMediaChannel
+from .vad import ComfortNoiseGenerator, VoiceActivityDetector
 
 logging.basicConfig(level=logging.INFO)
 
+# Trace đường nóng (tắt mặc định, xem shared/tracing.py)
+TRACE_RECEIVE = tracing.tracepoint("client.receive")    # mỗi gói audio nhận được
+TRACE_PLAYBACK = tracing.tracepoint("client.playback")  # mỗi chunk được phát
+
+
+def mix_frames(frames):
+    """Trộn các frame PCM int16 cùng độ dài thành một frame (cộng int32 rồi cắt bão hòa về int16)"""
+    if len(frames) == 1:
+        return frames[0]
+    stacked = np.frombuffer(b"".join(frames), dtype=np.int16).reshape(len(frames), -1)
+    mixed = stacked.sum(axis=0, dtype=np.int32)
+    np.clip(mixed, -32768, 32767, out=mixed)
+    return mixed.astype(np.int16).tobytes()
+
+
+def _codec_id(codec):
+    """codec của AUDIO_DATA: id (media frame) hoặc tên (JSON), bỏ trống = PCM"""
+    if isinstance(codec, str) or codec is None:
+        return CODEC_IDS.get(codec, CODEC_PCM)
+    return codec
+
 class AudioHandler:
-    def __init__(self, network_handler=None):
-        self.audio = pyaudio.PyAudio()
+    def __init__(self, network_handler=None, callback_mode=config.AUDIO_CALLBACK_MODE, backend=None):
+        # Thiết bị âm thanh (Client/audio_devices.py): PyAudio, hoặc file WAV / loopback /
+        # tín hiệu tổng hợp để chạy client không cần card âm thanh
+        self.audio = backend if backend is not None else create_backend()
         self.input_stream = None
         self.output_stream = None
         self.is_recording = False
@@ -20,9 +53,12 @@ class AudioHandler:
         self.network_handler = network_handler
         self.audio_devices = []
 
-        self.audio_queue = queue.Queue(maxsize=10)
-        self.echo_buffer = queue.Queue(maxsize=3)
-        self.echo_threshold = 0.3
+        self.jitter_buffers = {}  # người gửi -> JitterBuffer (thay cho hàng đợi FIFO chung)
+        self.jitter_lock = threading.Lock()
+        # Cổng im lặng theo biên độ chỉ dùng khi tắt VAD; chặn vọng âm chỉ dùng khi tắt AEC
+        self.capture_dsp = CaptureDsp(silence_threshold=0 if config.VAD_ENABLED else config.SILENCE_THRESHOLD)
+        # Khử vọng âm: tham chiếu là mọi chunk thực sự phát ra loa
+        self.echo_canceller = EchoCanceller() if config.AEC_ENABLED else None
 
         self.record_thread = None
         self.playback_thread = None
@@ -31,25 +67,50 @@ class AudioHandler:
         self.record_lock = threading.Lock()
         self.playback_lock = threading.Lock()
 
-        self.audio_stats = {'sent': 0, 'received': 0, 'dropped': 0}
+        self.audio_stats = {'sent': 0, 'received': 0, 'dropped': 0, 'suppressed': 0, 'comfort_noise': 0}
+        self.stream_stats = {}  # người gửi -> StreamStats (loss, jitter, độ trễ)
+        self.stats_lock = threading.Lock()
+
+        # Codec gửi đi do server chọn cho phòng (ROOM_CODEC); mỗi người gửi một bộ giải mã
+        self.encoder = create_codec(CODEC_PCM)
+        self.decoders = {}  # người gửi -> codec (giữ trạng thái giải mã của luồng đó)
+
+        # Đồng hồ mẫu của mic: timestamp (đơn vị mẫu) của chunk vừa thu / đang gửi
+        self.capture_timestamp = None
+        self.capture_clock = None
+
+        # VAD + DTX: không gửi khi không nói; gói comfort noise chỉ gửi khi server báo
+        # mọi người trong phòng nhận được (comfort_noise của ROOM_CODEC)
+        self.vad = VoiceActivityDetector() if config.VAD_ENABLED else None
+        self.preroll = collections.deque(maxlen=config.VAD_PREROLL_FRAMES)  # (timestamp, chunk) chưa gửi
+        self.talking = False
+        self.silent_frames = 0
+        self.comfort_noise_enabled = False
+
+        # Chế độ callback (độ trễ thấp): PortAudio gọi callback mỗi chunk, dữ liệu
+        # đi qua ring buffer cấp phát sẵn tới thread xử lý / mạng
+        self.callback_mode = callback_mode
+        self.bytes_per_chunk = config.AUDIO_CHUNK * config.AUDIO_SAMPLE_WIDTH * config.AUDIO_CHANNELS
+        self.silence = bytes(self.bytes_per_chunk)
+        # Ô nhớ cố định mà các ring buffer chép chunk ra; PortAudio chỉ nhận buffer
+        # chỉ-đọc nên callback phát trả về view chỉ-đọc của ô phát
+        self.capture_chunk = bytearray(self.bytes_per_chunk)
+        self.playback_chunk = bytearray(self.bytes_per_chunk)
+        self.playback_view = memoryview(self.playback_chunk).toreadonly()
+        self.capture_ring = None
+        self.playback_ring = None
+
+        # Kênh UDP tới media relay (None = gửi/nhận audio qua TCP)
+        self.udp_channel = None
 
         self._list_audio_devices()
 
     def _list_audio_devices(self):
         try:
-            info = self.audio.get_host_api_info_by_index(0)
-            num_devices = info.get('deviceCount')
-            self.audio_devices = []
-            for i in range(num_devices):
-                device = self.audio.get_device_info_by_host_api_device_index(0, i)
-                device_info = {
-                    'index': i,
-                    'name': device['name'],
-                    'input_channels': device['maxInputChannels'],
-                    'output_channels': device['maxOutputChannels']
-                }
-                self.audio_devices.append(device_info)
-                logging.info(f"Device {i}: {device['name']}, Input: {device['maxInputChannels']}, Output: {device['maxOutputChannels']}")
+            self.audio_devices = self.audio.list_devices()
+            for device in self.audio_devices:
+                logging.info(f"Device {device['index']}: {device['name']}, Input: {device['input_channels']}, "
+                             f"Output: {device['output_channels']}")
             return self.audio_devices
         except Exception as e:
             logging.error(f"[AudioHandler] Error listing audio devices: {e}")
@@ -60,33 +121,19 @@ class AudioHandler:
         return self.audio_devices
 
     def _process_audio_chunk(self, data, is_input=True):
+        """Mic: khử vọng âm rồi lọc im lặng (None = không gửi). Loa: lưu làm tham chiếu vọng âm."""
         if len(data) == 0:
             return None
         try:
-            audio_data = np.frombuffer(data, dtype=np.int16).astype(np.float32)
-            audio_data = audio_data / 32768.0
-
             if is_input:
-                if np.max(np.abs(audio_data)) < config.SILENCE_THRESHOLD / 32768.0:
-                    return None
-                if not self.echo_buffer.empty():
-                    try:
-                        echo_data = self.echo_buffer.get_nowait()
-                        min_len = min(len(audio_data), len(echo_data))
-                        if min_len > 10:
-                            echo_similarity = np.correlate(
-                                audio_data[:min_len], echo_data[:min_len]
-                            )[0] / (np.linalg.norm(audio_data[:min_len]) * np.linalg.norm(echo_data[:min_len]) + 1e-10)
-                            if echo_similarity > self.echo_threshold:
-                                logging.debug(f"[AudioHandler] Echo detected: {echo_similarity:.2f}")
-                                return None
-                    except (queue.Empty, ValueError):
-                        pass
-                return (audio_data * 32768.0).astype(np.int16).tobytes()
+                if self.echo_canceller:
+                    data = self.echo_canceller.process(data)
+                return self.capture_dsp.process(data)
+            if self.echo_canceller:
+                self.echo_canceller.add_reference(data)
             else:
-                if not self.echo_buffer.full():
-                    self.echo_buffer.put(audio_data.copy())
-                return data
+                self.capture_dsp.add_reference(data)
+            return data
         except Exception as e:
             logging.error(f"[AudioHandler] Audio processing error: {e}")
             return None
@@ -96,13 +143,123 @@ class AudioHandler:
             if self.is_recording:
                 return
             self.is_recording = True
+        self.capture_clock = None
+        self.preroll.clear()
+        self.talking = False
+        if self.vad:
+            self.vad.reset()
         self.record_thread = threading.Thread(
-            target=self._record_loop,
+            target=self._capture_loop if self.callback_mode else self._record_loop,
             args=(send_callback, input_device_index),
             daemon=True
         )
         self.record_thread.start()
 
+    def _capture_callback(self, in_data, frame_count, time_info, status):
+        """Callback của stream mic (thread âm thanh): chỉ chép chunk vào ring buffer"""
+        ring = self.capture_ring
+        if ring is not None and in_data:
+            ring.write(in_data)
+        return None, PA_CONTINUE
+
+    def _capture_loop(self, send_callback, input_device_index):
+        """Chế độ callback: lấy chunk từ ring buffer, xử lý và gửi đi (ngoài thread âm thanh)"""
+        ring = self.capture_ring = FrameRing(config.CAPTURE_RING_FRAMES, self.bytes_per_chunk)
+        chunk = self.capture_chunk
+        try:
+            self.input_stream = self.audio.open(
+                format=config.AUDIO_FORMAT,
+                channels=config.AUDIO_CHANNELS,
+                rate=config.AUDIO_RATE,
+                input=True,
+                input_device_index=input_device_index,
+                frames_per_buffer=config.AUDIO_CHUNK,
+                stream_callback=self._capture_callback
+            )
+            logging.info(f"[AudioHandler] Started recording (callback) at {config.AUDIO_RATE}Hz, "
+                         f"chunk: {config.AUDIO_CHUNK}")
+
+            while self.is_recording and self.running:
+                if not ring.read_into(chunk, timeout=0.5):
+                    continue
+                try:
+                    # chunk bị ghi đè ở vòng sau: CaptureDsp chép ra bytes riêng
+                    # cho những chunk được giữ lại (pre-roll) hoặc gửi đi
+                    self._handle_captured_chunk(chunk, send_callback)
+                except Exception as e:
+                    if self.is_recording:
+                        logging.error(f"[AudioHandler] Capture loop error: {e}")
+                    break
+        except Exception as e:
+            logging.error(f"[AudioHandler] Recording setup error: {e}")
+        finally:
+            if ring.overruns:
+                logging.warning(f"[AudioHandler] Capture ring overruns: {ring.overruns}")
+            self.stop_recording()
+
+    def _handle_captured_chunk(self, data, send_callback):
+        # Timestamp tăng đúng AUDIO_CHUNK mẫu mỗi chunk (kể cả chunk im lặng không gửi),
+        # neo vào giờ hệ thống lúc mẫu đầu tiên của chunk đầu được thu
+        if self.capture_clock is None:
+            self.capture_clock = media_timestamp() - config.AUDIO_CHUNK
+        else:
+            self.capture_clock = (self.capture_clock + config.AUDIO_CHUNK) & 0xFFFFFFFF
+        self.capture_timestamp = self.capture_clock
+        processed_data = self._process_audio_chunk(data, is_input=True)
+        if self.muted:
+            self.preroll.clear()   # không gửi bù âm thanh thu lúc đang tắt mic
+            return
+        if not processed_data:
+            return
+        if self.vad:
+            self._apply_dtx(processed_data, send_callback)
+        else:
+            self._send_captured(processed_data, self.capture_clock, send_callback)
+
+    def _apply_dtx(self, data, send_callback):
+        """VAD + DTX: chỉ gửi khi đang nói. Lúc bắt đầu nói gửi bù các chunk ngay trước
+        (pre-roll, không cắt đầu từ); khi im lặng thỉnh thoảng gửi gói comfort noise."""
+        timestamp = self.capture_clock
+        if self.vad.update(data):
+            while self.preroll:
+                preroll_timestamp, chunk = self.preroll.popleft()
+                self._send_captured(chunk, preroll_timestamp, send_callback)
+            self._send_captured(data, timestamp, send_callback)
+            self.talking = True
+            return
+        self.preroll.append((timestamp, data))
+        self.audio_stats['suppressed'] += 1
+        if self.talking:
+            self.talking = False
+            self.silent_frames = config.DTX_SID_INTERVAL   # gói comfort noise ngay đầu khoảng lặng
+        self.silent_frames += 1
+        if self.comfort_noise_enabled and self.silent_frames >= config.DTX_SID_INTERVAL:
+            descriptor = self.vad.descriptor()
+            if descriptor and self._is_network_ready():
+                self.silent_frames = 0
+                if self._send_payload(descriptor, CODEC_CN, timestamp):
+                    self.audio_stats['comfort_noise'] += 1
+
+    def _is_network_ready(self):
+        return bool(self.network_handler and
+                    hasattr(self.network_handler, 'is_connected') and
+                    self.network_handler.is_connected())
+
+    def _send_captured(self, data, timestamp, send_callback):
+        self.capture_timestamp = timestamp
+        if send_callback:
+            send_callback(data)
+        elif self._is_network_ready():
+            try:
+                success = self.send_audio(data)
+                if success:
+                    self.audio_stats['sent'] += 1
+                else:
+                    self.audio_stats['dropped'] += 1
+            except Exception as e:
+                logging.error(f"[AudioHandler] Network send error: {e}")
+                self.audio_stats['dropped'] += 1
+
     def _record_loop(self, send_callback, input_device_index):
         try:
             self.input_stream = self.audio.open(
@@ -121,26 +278,7 @@ class AudioHandler:
                     if not data or len(data) == 0:
                         time.sleep(0.01)
                         continue
-                    processed_data = self._process_audio_chunk(data, is_input=True)
-                    if processed_data and not self.muted:
-                        if send_callback:
-                            send_callback(processed_data)
-                        elif (self.network_handler and 
-                              hasattr(self.network_handler, 'is_connected') and 
-                              self.network_handler.is_connected()):
-                            try:
-                                audio_b64 = base64.b64encode(processed_data).decode('utf-8')
-                                success = self.network_handler.send_message({
-                                    'type': 'AUDIO_DATA',
-                                    'data': audio_b64
-                                })
-                                if success:
-                                    self.audio_stats['sent'] += 1
-                                else:
-                                    self.audio_stats['dropped'] += 1
-                            except Exception as e:
-                                logging.error(f"[AudioHandler] Network send error: {e}")
-                                self.audio_stats['dropped'] += 1
+                    self._handle_captured_chunk(data, send_callback)
                 except Exception as e:
                     if self.is_recording:
                         logging.error(f"[AudioHandler] Recording loop error: {e}")
@@ -156,16 +294,68 @@ class AudioHandler:
                 return
             self.is_playing = True
         self.playback_thread = threading.Thread(
-            target=self._playback_loop,
+            target=self._playback_feed_loop if self.callback_mode else self._playback_loop,
             args=(get_callback, output_device_index),
             daemon=True
         )
         self.playback_thread.start()
 
+    def _playback_callback(self, in_data, frame_count, time_info, status):
+        """Callback PortAudio: lấy chunk đã chuẩn bị sẵn, rỗng thì phát im lặng (không cấp phát).
+        Chunk được ghi làm tham chiếu AEC tại đây để khớp đúng thứ tự mẫu ra loa."""
+        ring = self.playback_ring
+        if ring is not None and ring.read_into(self.playback_chunk, timeout=0):
+            data = self.playback_view
+        else:
+            data = self.silence
+        self._process_audio_chunk(data, is_input=False)
+        return data, PA_CONTINUE
+
+    def _playback_feed_loop(self, get_callback=None, output_device_index=None):
+        """Chế độ callback: giữ ring buffer phát đầy (jitter buffer + trộn chạy ở đây,
+        không trong callback). Ring chỉ vài chunk nên độ trễ thêm vào rất nhỏ."""
+        ring = self.playback_ring = FrameRing(config.PLAYBACK_RING_FRAMES, self.bytes_per_chunk)
+        try:
+            stream = self.output_stream = self.audio.open(
+                format=config.AUDIO_FORMAT,
+                channels=config.AUDIO_CHANNELS,
+                rate=config.AUDIO_RATE,
+                output=True,
+                output_device_index=output_device_index,
+                frames_per_buffer=config.AUDIO_CHUNK,
+                stream_callback=self._playback_callback,
+                start=False
+            )
+            logging.info("[Playback] Started playback (callback)")
+            started = False
+
+            while self.is_playing and self.running:
+                # Chờ callback lấy bớt một chunk: nhịp vẫn do card âm thanh quyết định
+                if not ring.wait_for_space(timeout=0.5):
+                    continue
+                try:
+                    if get_callback:
+                        data = get_callback()
+                    else:
+                        data = self.next_playback_chunk() or self.silence
+                    ring.write(data)
+                    if not started:
+                        stream.start_stream()   # bắt đầu khi ring đã có dữ liệu
+                        started = True
+                    if TRACE_PLAYBACK.enabled and TRACE_PLAYBACK.sampled():
+                        TRACE_PLAYBACK.emit(bytes=len(data), buffered=self.buffered_frames(),
+                                            ring=len(ring), underruns=ring.underruns)
+                except Exception as e:
+                    logging.error(f"[Playback]  Error: {e}")
+                    break
+        except Exception as e:
+            logging.error(f"[Playback]  Setup error: {e}")
+        finally:
+            self.stop_playback()
+
     def _playback_loop(self, get_callback=None, output_device_index=None):
         try:
-            sample_size = self.audio.get_sample_size(config.AUDIO_FORMAT)
-            bytes_per_chunk = config.AUDIO_CHUNK * sample_size * config.AUDIO_CHANNELS
+            bytes_per_chunk = self.bytes_per_chunk
             logging.info(f"[Playback] Expected chunk size: {bytes_per_chunk} bytes")
 
             self.output_stream = self.audio.open(
@@ -180,15 +370,12 @@ class AudioHandler:
 
             while self.is_playing and self.running:
                 try:
+                    # Mỗi lần write() chặn đến khi thiết bị cần chunk tiếp theo:
+                    # nhịp phát do card âm thanh quyết định, mỗi chu kỳ lấy đúng một chunk
                     if get_callback:
                         data = get_callback()
-                    elif not self.audio_queue.empty():
-                        data = self.audio_queue.get_nowait()
-                        logging.debug(f"[Playback]  Got {len(data)} bytes from queue")
                     else:
-                        data = b'\x00' * bytes_per_chunk
-                        time.sleep(0.01)
-                        continue
+                        data = self.next_playback_chunk() or self.silence
 
                     if len(data) != bytes_per_chunk:
                         logging.warning(f"[Playback]  Size mismatch: {len(data)} vs {bytes_per_chunk}")
@@ -197,12 +384,10 @@ class AudioHandler:
                         else:
                             data = data[:bytes_per_chunk]
 
+                    self._process_audio_chunk(data, is_input=False)
                     self.output_stream.write(data)
-                    logging.debug(f"[Playback]  Playing {len(data)} bytes")
-                except queue.Empty:
-                    silence = b'\x00' * bytes_per_chunk
-                    self.output_stream.write(silence)
-                    time.sleep(0.01)
+                    if TRACE_PLAYBACK.enabled and TRACE_PLAYBACK.sampled():
+                        TRACE_PLAYBACK.emit(bytes=len(data), buffered=self.buffered_frames())
                 except Exception as e:
                     logging.error(f"[Playback]  Error: {e}")
                     break
@@ -216,6 +401,8 @@ class AudioHandler:
             if not self.is_recording:
                 return
             self.is_recording = False
+        if self.capture_ring:
+            self.capture_ring.close()
         if self.input_stream:
             try:
                 if self.input_stream.is_active():
@@ -237,6 +424,8 @@ class AudioHandler:
             if not self.is_playing:
                 return
             self.is_playing = False
+        if self.playback_ring:
+            self.playback_ring.close()
         if self.output_stream:
             try:
                 if self.output_stream.is_active():
@@ -246,11 +435,8 @@ class AudioHandler:
                 logging.error(f"[AudioHandler] Error stopping output stream: {e}")
             finally:
                 self.output_stream = None
-        while not self.audio_queue.empty():
-            try:
-                self.audio_queue.get_nowait()
-            except queue.Empty:
-                break
+        with self.jitter_lock:
+            self.jitter_buffers.clear()
         if self.playback_thread and self.playback_thread.is_alive():
             try:
                 self.playback_thread.join(timeout=1.0)
@@ -258,57 +444,214 @@ class AudioHandler:
                 pass
         logging.info("[AudioHandler] Stopped playback")
 
+    def send_audio(self, pcm_data, timestamp=None):
+        """Gửi chunk audio: UDP nếu kênh đã sẵn sàng, ngược lại qua TCP.
+
+        timestamp mặc định là timestamp lúc thu của chunk đang gửi.
+        """
+        if not self.network_handler:
+            return False
+        encoder = self.encoder
+        return self._send_payload(encoder.encode(pcm_data), encoder.codec_id, timestamp)
+
+    def _send_payload(self, payload, codec_id, timestamp=None):
+        if timestamp is None:
+            timestamp = self.capture_timestamp
+        if timestamp is None:
+            timestamp = media_timestamp()
+        seq = self.network_handler.next_audio_seq()
+        channel = self.udp_channel
+        if channel and channel.is_ready():
+            if channel.send_audio(payload, seq, timestamp, codec_id):
+                return True
+        return self.network_handler.send_audio(payload, seq=seq, timestamp=timestamp, codec_id=codec_id)
+
+    def set_send_codec(self, name):
+        """Đổi codec cho audio gửi đi (tên do server chọn); codec không hỗ trợ -> PCM"""
+        codec_id = CODEC_IDS.get(name, CODEC_PCM)
+        if codec_id == self.encoder.codec_id:
+            return
+        encoder = create_codec(codec_id)
+        if encoder is None:
+            logging.warning(f"[AudioHandler] Codec {name} not available, sending PCM")
+            encoder = create_codec(CODEC_PCM)
+        self.encoder = encoder
+        logging.info(f"[AudioHandler] Send codec: {encoder.name}")
+
+    def set_comfort_noise(self, enabled):
+        """Server báo mọi người trong phòng nhận được gói comfort noise hay không"""
+        self.comfort_noise_enabled = bool(enabled)
+
+    def _decode_payload(self, sender, codec, payload):
+        """Giải mã payload của một người gửi về PCM int16 (None nếu không giải mã được)"""
+        codec_id = _codec_id(codec)
+        if codec_id == CODEC_PCM:
+            return payload
+        decoder = self.decoders.get(sender)
+        if decoder is None or decoder.codec_id != codec_id:
+            decoder = create_codec(codec_id)
+            if decoder is None:
+                logging.warning(f"[AudioReceive] Unsupported codec {CODEC_NAMES.get(codec_id, codec_id)} "
+                                f"from {sender}")
+                return None
+            self.decoders[sender] = decoder
+        return decoder.decode(payload)
+
+    def start_udp_transport(self, host, port, token):
+        """Mở kênh UDP với token được server cấp khi vào phòng"""
+        self.stop_udp_transport()
+        channel = UdpMediaChannel(host, port, token, self._on_udp_frame,
+                                  version=getattr(self.network_handler, 'framing', None) or 1)
+        channel.start()
+        self.udp_channel = channel
+
+    def stop_udp_transport(self):
+        channel, self.udp_channel = self.udp_channel, None
+        if channel:
+            channel.stop()
+
+    def _on_udp_frame(self, frame):
+        peer_names = getattr(self.network_handler, 'peer_names', {})
+        self.handle_audio_data({
+            'type': 'AUDIO_DATA',
+            'from': peer_names.get(frame.sender_id, str(frame.sender_id)),
+            'seq': frame.seq,
+            'timestamp': frame.timestamp,
+            'codec': frame.flags & FLAG_CODEC_MASK,
+            'pcm': frame.payload
+        })
+
     def toggle_mute(self):
         self.muted = not self.muted
         return self.muted
 
     def get_audio_stats(self):
-        return self.audio_stats.copy()
+        """Bộ đếm gửi/nhận và thống kê từng người gửi ('streams': loss, jitter, độ trễ,
+        trạng thái jitter buffer)"""
+        stats = self.audio_stats.copy()
+        with self.stats_lock:
+            streams = {sender: s.summary() for sender, s in self.stream_stats.items()}
+        with self.jitter_lock:
+            buffers = list(self.jitter_buffers.items())
+        for sender, jitter_buffer in buffers:
+            streams.setdefault(sender, {})['buffer'] = jitter_buffer.summary()
+        stats['streams'] = streams
+        if self.echo_canceller:
+            stats['aec'] = self.echo_canceller.summary()
+        if self.vad:
+            stats['vad'] = dict(self.vad.stats)
+        return stats
+
+    def reset_stream_stats(self):
+        """Vào phòng mới: bỏ thống kê và jitter buffer của các người gửi cũ"""
+        with self.stats_lock:
+            self.stream_stats.clear()
+        with self.jitter_lock:
+            self.jitter_buffers.clear()
+        self.decoders = {}
+
+    def buffered_frames(self):
+        with self.jitter_lock:
+            return sum(len(b) for b in self.jitter_buffers.values())
+
+    def next_playback_chunk(self):
+        """Chunk cho chu kỳ phát hiện tại (None = im lặng).
+
+        Mỗi jitter buffer được lấy đúng một frame mỗi chu kỳ để đồng hồ phát của
+        mọi người gửi cùng tiến; frame của những người đang nói được trộn thành
+        một chunk, nên nhiều người nói cùng lúc không làm chậm hay trễ dần âm thanh.
+        """
+        now = time.time()
+        with self.jitter_lock:
+            buffers = list(self.jitter_buffers.items())
+        frames = []
+        for sender, jitter_buffer in buffers:
+            data = jitter_buffer.pop()
+            if data is not None:
+                frames.append(data)
+            elif not len(jitter_buffer) and now - jitter_buffer.last_arrival > config.JITTER_STREAM_TIMEOUT:
+                # Người gửi đã im lặng lâu: bỏ buffer (tạo lại khi có frame mới)
+                with self.jitter_lock:
+                    if self.jitter_buffers.get(sender) is jitter_buffer:
+                        del self.jitter_buffers[sender]
+        return mix_frames(frames) if frames else None
+
+    def _update_stream_stats(self, sender, seq, timestamp):
+        if not isinstance(seq, int):
+            return
+        with self.stats_lock:
+            stats = self.stream_stats.get(sender)
+            if stats is None:
+                stats = self.stream_stats[sender] = StreamStats()
+            stats.update(seq, timestamp if isinstance(timestamp, int) else None)
 
     def cleanup(self):
         self.running = False
+        self.stop_udp_transport()
         self.stop_recording()
         self.stop_playback()
         try:
             self.audio.terminate()
         except Exception as e:
             logging.error(f"[AudioHandler] Error terminating audio: {e}")
-        while not self.echo_buffer.empty():
-            try:
-                self.echo_buffer.get_nowait()
-            except queue.Empty:
-                break
+        self.capture_dsp.clear()
+        if self.echo_canceller:
+            self.echo_canceller.reset()
         logging.info("[AudioHandler] Cleanup completed")
 
+    def _get_jitter_buffer(self, sender):
+        with self.jitter_lock:
+            jitter_buffer = self.jitter_buffers.get(sender)
+            if jitter_buffer is None:
+                jitter_buffer = self.jitter_buffers[sender] = JitterBuffer()
+            return jitter_buffer
+
     def handle_audio_data(self, message):
         try:
-            if 'data' not in message:
+            from_user = message.get('from', 'unknown')
+            if 'pcm' in message:
+                # Media frame nhị phân: payload thô (PCM hoặc đã nén theo 'codec'), không cần base64
+                audio_data = message['pcm']
+            elif 'data' in message:
+                audio_data = base64.b64decode(message['data'])
+            else:
                 logging.warning("[AudioHandler] Message missing 'data' field")
                 return
 
-            data_b64 = message['data']
-            from_user = message.get('from', 'unknown')
-            logging.info(f"[AudioReceive] From {from_user}: {len(data_b64)} chars")
+            seq = message.get('seq')
+            timestamp = message.get('timestamp')
+            seq = seq if isinstance(seq, int) else None
+            timestamp = timestamp if isinstance(timestamp, int) else None
+            # Thống kê mạng tính cả frame mà jitter buffer sẽ bỏ (đến muộn không phải mất trên mạng)
+            self._update_stream_stats(from_user, seq, timestamp)
+
+            codec_id = _codec_id(message.get('codec'))
+            if codec_id == CODEC_CN:
+                # Người gửi đang DTX: phát nhiễu nền theo gói này thay cho im lặng
+                self._get_jitter_buffer(from_user).set_comfort_noise(seq, ComfortNoiseGenerator(audio_data))
+                return
 
-            audio_data = base64.b64decode(data_b64)
-            logging.info(f"[AudioReceive] ✓ Decoded: {len(audio_data)} bytes")
+            audio_data = self._decode_payload(from_user, codec_id, audio_data)
+            if audio_data is None:
+                self.audio_stats['dropped'] += 1
+                return
 
             sample_size = self.audio.get_sample_size(config.AUDIO_FORMAT)
             expected_size = config.AUDIO_CHUNK * sample_size * config.AUDIO_CHANNELS
-            logging.info(f"[AudioReceive] Expected size: {expected_size} bytes")
 
             if len(audio_data) < expected_size:
                 audio_data = audio_data + b'\x00' * (expected_size - len(audio_data))
             elif len(audio_data) > expected_size:
                 audio_data = audio_data[:expected_size]
 
-            if self.audio_queue.full():
-                self.audio_stats['dropped'] += 1
-                logging.warning("[AudioReceive] Queue full, dropping")
+            jitter_buffer = self._get_jitter_buffer(from_user)
+            if not jitter_buffer.push(seq, bytes(audio_data), timestamp):
+                self.audio_stats['dropped'] += 1   # trùng hoặc đến sau thời điểm phát
                 return
-
-            self.audio_queue.put(audio_data)
             self.audio_stats['received'] += 1
-            logging.info(f"[AudioReceive] ✓ Added to queue (size: {self.audio_queue.qsize()})")
+            if TRACE_RECEIVE.enabled and TRACE_RECEIVE.sampled():
+                TRACE_RECEIVE.emit(sender=from_user, seq=seq, bytes=len(audio_data),
+                                   encoding='pcm' if 'pcm' in message else 'base64',
+                                   buffered=len(jitter_buffer))
         except Exception as e:
             logging.error(f"[AudioReceive]  Error: {e}")
@@ -0,0 +1,69 @@
+import numpy as np
+from shared import config
+
+
+class CaptureDsp:
+    """Xử lý chunk mic trước khi gửi, không cấp phát mảng mới cho mỗi chunk.
+
+    - Cổng im lặng: so biên độ đỉnh trực tiếp trên int16 (không đổi sang float).
+    - Chặn vọng âm (chỉ khi tắt AEC_ENABLED): so tương quan chuẩn hóa giữa chunk mic và một chunk loa
+      (tham chiếu) gần nhất; giống nhau quá echo_threshold thì bỏ chunk.
+      Chỉ tính khi có tham chiếu, trên các buffer float32 cấp phát sẵn.
+    Chunk đi qua không bị biến đổi nên trả về nguyên dữ liệu đầu vào.
+    """
+
+    def __init__(self, samples=config.AUDIO_CHUNK, silence_threshold=config.SILENCE_THRESHOLD,
+                 echo_threshold=0.3, reference_frames=3):
+        self.samples = samples
+        self.silence_threshold = silence_threshold
+        self.echo_threshold = echo_threshold
+        self.mic = np.empty(samples, dtype=np.float32)
+        self.references = np.zeros((reference_frames, samples), dtype=np.float32)
+        self.reference_start = 0
+        self.reference_count = 0
+        self.stats = {'silent': 0, 'echo': 0, 'passed': 0}
+
+    def add_reference(self, data):
+        """Ghi nhận một chunk vừa phát ra loa (đầy thì bỏ chunk mới, như hàng đợi cũ)"""
+        if self.reference_count == len(self.references):
+            return
+        slot = (self.reference_start + self.reference_count) % len(self.references)
+        samples = np.frombuffer(data, dtype=np.int16)
+        n = min(len(samples), self.samples)
+        row = self.references[slot]
+        row[:n] = samples[:n]
+        row[n:] = 0
+        self.reference_count += 1
+
+    def clear(self):
+        self.reference_start = 0
+        self.reference_count = 0
+
+    def process(self, data):
+        """Trả về chunk cần gửi (bytes) hoặc None nếu là im lặng / vọng âm"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        if not len(samples):
+            return None
+        # int() trước khi đổi dấu: -(-32768) tràn int16
+        if max(int(samples.max()), -int(samples.min())) < self.silence_threshold:
+            self.stats['silent'] += 1
+            return None
+        if self.reference_count and self._is_echo(samples):
+            self.stats['echo'] += 1
+            return None
+        self.stats['passed'] += 1
+        return data if isinstance(data, bytes) else bytes(data)
+
+    def _is_echo(self, samples):
+        reference = self.references[self.reference_start]
+        self.reference_start = (self.reference_start + 1) % len(self.references)
+        self.reference_count -= 1
+        n = min(len(samples), self.samples)
+        if n <= 10:
+            return False
+        mic = self.mic[:n]
+        mic[:] = samples[:n]            # ép kiểu int16 -> float32 vào buffer có sẵn
+        reference = reference[:n]
+        # Tương quan chuẩn hóa không phụ thuộc tỉ lệ: không cần chia cho 32768
+        denominator = np.sqrt(float(np.dot(mic, mic)) * float(np.dot(reference, reference))) + 1e-10
+        return float(np.dot(mic, reference)) / denominator > self.echo_threshold
@@ -0,0 +1,261 @@
+import threading
+import numpy as np
+from shared import config
+
+_DOUBLE_TALK_HANGOVER = 4   # số block giữ trạng thái double-talk sau khi người gần hết nói
+_FAR_ACTIVE_LEVEL = 30.0    # biên độ đỉnh tối thiểu của tín hiệu loa để coi là đang phát
+_DELAY_MARGIN = 32          # mẫu: đặt đường vọng trực tiếp hơi muộn trong bộ lọc (bộ lọc nhân quả)
+_DELAY_WINDOW = 4096        # mẫu mic dùng cho mỗi lần ước lượng độ trễ
+_CONVERGED_ERLE = 10.0      # dB: từ mức này bước cập nhật được giảm khi sai số lớn bất thường
+_DIVERGENCE_BLOCKS = 8      # số block liền bộ lọc làm tệ hơn tín hiệu mic thì đặt lại bộ lọc
+
+
+class EchoCanceller:
+    """Khử vọng âm (AEC) bằng bộ lọc thích nghi NLMS khối, miền tần số, chia đoạn (PBFDAF).
+
+    - Tham chiếu: mọi chunk phát ra loa (add_reference, từ thread phát) được ghi
+      vào lịch sử tín hiệu loa theo vị trí mẫu. Ghi không khóa (một thread ghi,
+      far_pos chỉ tăng sau khi mẫu đã ghi xong) để callback phát không phải chờ
+      thread thu đang ước lượng độ trễ.
+    - Căn chỉnh: định kỳ ước lượng độ lệch giữa lịch sử loa và mic bằng GCC-PHAT;
+      bộ lọc chỉ chạy khi đã có độ trễ tin cậy, và được đặt lại khi độ trễ đổi.
+    - Bộ lọc: AEC_PARTITIONS đoạn x AUDIO_CHUNK mẫu (overlap-save, FFT 2N), bước
+      NLMS chuẩn hóa theo công suất từng tần số; mỗi block ràng buộc gradient
+      cho một đoạn (xoay vòng) để giữ chi phí thấp.
+    - Double-talk (Geigel): mic lớn hơn AEC_DOUBLE_TALK_THRESHOLD x đỉnh loa gần
+      đây -> người gần đang nói, ngừng cập nhật bộ lọc (vẫn trừ vọng âm ước lượng).
+    - Bộ lọc phân kỳ (sai số lớn hơn hẳn tín hiệu mic) thì được đặt lại.
+    """
+
+    def __init__(self, block=config.AUDIO_CHUNK, partitions=config.AEC_PARTITIONS,
+                 step_size=config.AEC_STEP_SIZE, rate=config.AUDIO_RATE,
+                 max_delay=config.AEC_MAX_DELAY, delay_interval=config.AEC_DELAY_INTERVAL,
+                 double_talk_threshold=config.AEC_DOUBLE_TALK_THRESHOLD):
+        self.block = block
+        self.partitions = partitions
+        self.step_size = step_size
+        self.max_delay = int(max_delay * rate)
+        self.delay_blocks = max(1, int(delay_interval * rate / block))
+        self.double_talk_threshold = double_talk_threshold
+        self.lock = threading.Lock()
+
+        bins = block + 1
+        self.weights = np.zeros((partitions, bins), dtype=np.complex128)
+        self.spectra = np.zeros((partitions, bins), dtype=np.complex128)  # phổ tham chiếu gần nhất
+        self.power = np.zeros(bins)   # công suất tham chiếu từng tần số (làm mượt)
+        self.power_ready = False
+        self.head = 0
+        self.far_peaks = np.zeros(partitions + 1)   # đỉnh |loa| của các block tham chiếu gần nhất
+
+        # Lịch sử loa (vị trí mẫu tuyệt đối far_pos) và mic (mic_pos) cho ước lượng độ trễ
+        history = 1 << int(np.ceil(np.log2(_DELAY_WINDOW + self.max_delay + 4 * block)))
+        self.far = np.zeros(history)
+        self.far_pos = 0          # số mẫu loa đã ghi xong (bên đọc chỉ đọc mẫu < far_pos)
+        self.far_guard = 2 * block  # mỗi lần ghi tối đa far_guard mẫu: bên đọc bỏ vùng cũ nhất này
+        self.mic = np.zeros(_DELAY_WINDOW)
+        self.mic_pos = 0
+        self.lag = None   # mẫu mic m <-> mẫu loa m + lag
+        self.delay = None  # độ trễ loa -> mic ước lượng (mẫu), chỉ để thống kê
+
+        # Buffer cấp phát sẵn cho mỗi block
+        self.near = np.empty(block)
+        self.reference = np.empty(2 * block)
+        self.error_block = np.zeros(2 * block)
+        self.out = np.empty(block, dtype=np.int16)
+
+        self.double_talk = 0
+        self.diverging = 0
+        self.candidate_lag = None   # độ trễ mới chỉ được nhận khi hai lần ước lượng liền nhau khớp
+        self.erle = 0.0
+        self.stats = {'blocks': 0, 'adapted': 0, 'double_talk': 0, 'delay_updates': 0, 'resets': 0}
+
+    # --- tham chiếu (thread phát) -------------------------------------------
+
+    def add_reference(self, data):
+        """Ghi chunk loa vào lịch sử, không khóa (chỉ một thread phát gọi)"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        size = len(self.far)
+        for offset in range(0, len(samples), self.far_guard):
+            piece = samples[offset:offset + self.far_guard]
+            start = self.far_pos % size
+            first = min(len(piece), size - start)
+            self.far[start:start + first] = piece[:first]
+            self.far[:len(piece) - first] = piece[first:]
+            self.far_pos += len(piece)   # công bố sau khi mẫu đã ghi xong
+
+    def _read_far(self, start, out):
+        """Chép mẫu loa [start, start + len(out)) vào out; mẫu ngoài lịch sử là 0.
+        Chạy song song với add_reference: mẫu có thể bị ghi đè trong lúc chép cũng là 0."""
+        n = len(out)
+        size = len(self.far)
+        end = self.far_pos
+        lo = max(start, end - size + self.far_guard, 0)
+        hi = min(start + n, end)
+        out[:] = 0
+        if lo >= hi:
+            return
+        a = lo % size
+        first = min(hi - lo, size - a)
+        out[lo - start:lo - start + first] = self.far[a:a + first]
+        out[lo - start + first:hi - start] = self.far[:hi - lo - first]
+        # Thread phát đã ghi tiếp trong lúc chép: bỏ các mẫu cũ nhất có thể đã bị ghi đè
+        overwritten = self.far_pos - size + self.far_guard
+        if overwritten > lo:
+            out[lo - start:min(overwritten, hi) - start] = 0
+
+    # --- mic (thread thu) ---------------------------------------------------
+
+    def process(self, data):
+        """Trả về chunk mic (bytes int16) đã trừ vọng âm ước lượng"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        if len(samples) != self.block:
+            return data
+        near = self.near
+        near[:] = samples
+        a = self.mic_pos % len(self.mic)
+        self.mic[a:a + self.block] = near   # _DELAY_WINDOW là bội của block
+        m = self.mic_pos
+        self.mic_pos += self.block
+        self.stats['blocks'] += 1
+
+        with self.lock:
+            if self.stats['blocks'] % self.delay_blocks == 0 and not self.double_talk:
+                self._estimate_delay()
+            if self.lag is None:
+                return data
+            self._read_far(m + self.lag - self.block, self.reference)
+
+        block, partitions = self.block, self.partitions
+        reference_spectrum = np.fft.rfft(self.reference)
+        self.head = (self.head + 1) % partitions
+        self.spectra[self.head] = reference_spectrum
+        order = (self.head - np.arange(partitions)) % partitions
+        spectra = self.spectra[order]
+
+        echo = np.fft.irfft((self.weights * spectra).sum(axis=0), 2 * block)[block:]
+        error = self.error_block[block:]
+        np.subtract(near, echo, out=error)
+
+        far_peak = float(np.abs(self.reference[block:]).max())
+        self.far_peaks[self.stats['blocks'] % len(self.far_peaks)] = far_peak
+        recent_far = float(self.far_peaks.max())
+        near_peak = float(np.abs(near).max())
+        if near_peak > self.double_talk_threshold * recent_far:
+            self.double_talk = _DOUBLE_TALK_HANGOVER
+        elif self.double_talk:
+            self.double_talk -= 1
+
+        near_energy = float(np.dot(near, near))
+        error_energy = float(np.dot(error, error))
+        worse = error_energy > near_energy
+        if worse and not self.double_talk:
+            # Ước lượng vọng âm làm tín hiệu tệ hơn: block này gửi mic gốc.
+            # Lặp lại nhiều block liền (vd đường vọng vừa đổi) -> bộ lọc phân kỳ, đặt lại.
+            # Khi double-talk, giọng người gần làm phép so này nhiễu nên không đếm.
+            self.diverging += 1
+            if self.diverging >= _DIVERGENCE_BLOCKS:
+                self._reset_filter()
+                self.stats['resets'] += 1
+        else:
+            self.diverging = 0
+
+        if recent_far > _FAR_ACTIVE_LEVEL:
+            spectrum_power = reference_spectrum.real ** 2 + reference_spectrum.imag ** 2
+            if self.power_ready:
+                self.power *= 0.9
+                self.power += 0.1 * spectrum_power
+            else:
+                self.power[:] = spectrum_power   # lần đầu: tránh bước quá lớn khi ước lượng còn 0
+                self.power_ready = True
+            if self.double_talk:
+                self.stats['double_talk'] += 1
+            else:
+                step = self.step_size
+                if self.erle > _CONVERGED_ERLE:
+                    # Đã hội tụ mà sai số lớn hơn vọng âm ước lượng: có thể người gần bắt đầu nói
+                    # mà Geigel chưa nhận ra -> giảm bước để không làm hỏng bộ lọc
+                    echo_energy = float(np.dot(echo, echo))
+                    if error_energy > echo_energy:
+                        step *= echo_energy / error_energy
+                self._adapt(spectra, step)
+                if near_energy > 0 and error_energy > 0:
+                    self.erle += 0.05 * (10 * np.log10(near_energy / error_energy) - self.erle)
+
+        if worse:
+            return data
+        np.clip(error, -32768, 32767, out=error)
+        self.out[:] = error
+        return self.out.tobytes()
+
+    def _adapt(self, spectra, step):
+        block = self.block
+        error_spectrum = np.fft.rfft(self.error_block)   # [0...0, e]: nửa đầu luôn là 0
+        # Chuẩn hóa theo công suất từng tần số; sàn tương đối cho các tần số gần như không có năng lượng
+        floor = 0.01 * float(self.power.mean()) + 2 * block * _FAR_ACTIVE_LEVEL ** 2
+        gain = error_spectrum * (step / (self.partitions * (self.power + floor)))
+        self.weights += np.conj(spectra) * gain
+        # Ràng buộc gradient (bỏ phần tương quan vòng) cho một đoạn mỗi block
+        p = self.stats['adapted'] % self.partitions
+        taps = np.fft.irfft(self.weights[p], 2 * block)
+        taps[block:] = 0
+        self.weights[p] = np.fft.rfft(taps)
+        self.stats['adapted'] += 1
+
+    def _reset_filter(self):
+        self.weights[:] = 0
+        self.spectra[:] = 0
+        self.diverging = 0
+        self.erle = 0.0
+
+    def _estimate_delay(self):
+        """GCC-PHAT giữa _DELAY_WINDOW mẫu mic gần nhất và lịch sử loa (giữ self.lock)"""
+        window = len(self.mic)
+        if self.mic_pos < window:
+            return
+        # Mẫu loa khớp với mic không thể mới hơn mẫu loa vừa ghi (cộng một block do lệch thread)
+        lag_hi = self.far_pos - self.mic_pos + self.block
+        lag_lo = lag_hi - self.max_delay - self.block
+        span = lag_hi - lag_lo
+        far = np.empty(window + span)
+        self._read_far(self.mic_pos - window + lag_lo, far)
+        if np.abs(far).max() < _FAR_ACTIVE_LEVEL:
+            return
+        a = self.mic_pos % window
+        mic = np.concatenate((self.mic[a:], self.mic[:a]))
+
+        n = 1 << int(np.ceil(np.log2(len(far) + window)))
+        cross = np.fft.rfft(far, n) * np.conj(np.fft.rfft(mic, n))
+        cross /= np.abs(cross) + 1e-9
+        correlation = np.fft.irfft(cross, n)[:span + 1]
+        k = int(np.argmax(correlation))
+        if correlation[k] < config.AEC_DELAY_CONFIDENCE * (np.abs(correlation).mean() + 1e-12):
+            return
+        lag = lag_lo + k + _DELAY_MARGIN
+        if self.lag is not None and abs(lag - self.lag) <= self.block // 4:
+            self.candidate_lag = None
+            return
+        # Lần đầu nhận ngay; đổi độ trễ (đặt lại bộ lọc) cần hai lần ước lượng liền nhau khớp
+        if self.lag is None or (self.candidate_lag is not None
+                                and abs(lag - self.candidate_lag) <= self.block // 4):
+            self.lag = lag
+            self.candidate_lag = None
+            self.delay = lag_hi - self.block - (lag - _DELAY_MARGIN)
+            self._reset_filter()
+            self.stats['delay_updates'] += 1
+        else:
+            self.candidate_lag = lag
+
+    def reset(self):
+        with self.lock:
+            self._reset_filter()
+            self.lag = None
+            self.delay = None
+            self.candidate_lag = None
+            self.far[:] = 0
+            self.mic[:] = 0
+
+    def summary(self):
+        stats = dict(self.stats)
+        stats['delay_ms'] = None if self.delay is None else round(self.delay * 1000.0 / config.AUDIO_RATE, 1)
+        stats['erle_db'] = round(float(self.erle), 1)
+        return stats
@@ -0,0 +1,177 @@
+import math
+import threading
+import time
+import numpy as np
+from shared import config
+from shared.protocol import media_timestamp, seq_delta, signed32
+
+_RESYNC_FRAMES = 100   # seq lệch quá N frame so với vị trí phát: người gửi đã khởi động lại
+# Gói comfort noise đến mỗi DTX_SID_INTERVAL frame; quá 3 lần khoảng đó không nhận được thì ngừng phát
+_COMFORT_NOISE_TIMEOUT = 3 * config.DTX_SID_INTERVAL * config.AUDIO_CHUNK / config.AUDIO_RATE
+
+
+class JitterBuffer:
+    """Jitter buffer thích ứng cho audio của một người gửi.
+
+    - Frame được sắp theo seq; frame trùng hoặc đến sau thời điểm phát của nó bị bỏ (late).
+    - Độ sâu mục tiêu (số frame giữ trước khi phát) = jitter ước lượng * JITTER_FACTOR,
+      làm tròn lên và giới hạn trong [JITTER_MIN_FRAMES, JITTER_MAX_FRAMES].
+    - Mỗi chu kỳ phát gọi pop() đúng một lần. Frame bị thiếu được che (PLC): lặp
+      lại frame trước với âm lượng giảm dần, sau PLC_MAX_FRAMES thì trả im lặng (None).
+    - Hết frame (người gửi ngừng nói, hoặc mạng nghẽn): dừng phát và đệm lại tới
+      độ sâu mục tiêu; độ sâu mới (theo jitter hiện tại) chỉ được áp dụng lúc này
+      nên việc thay đổi độ trễ rơi vào khoảng lặng giữa các câu nói.
+    - Đệm nhiều hơn mục tiêu quá JITTER_DRAIN_MARGIN frame: bỏ frame cũ nhất để giảm trễ.
+    - Người gửi đang DTX (gói comfort noise): hết PLC thì phát comfort noise thay vì
+      im lặng, đến khi phát frame audio có seq sau gói comfort noise.
+    """
+
+    def __init__(self, frame_samples=config.AUDIO_CHUNK, rate=config.AUDIO_RATE,
+                 min_frames=config.JITTER_MIN_FRAMES, max_frames=config.JITTER_MAX_FRAMES,
+                 initial_frames=config.JITTER_INITIAL_FRAMES):
+        self.frame_samples = frame_samples
+        self.rate = rate
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.target = max(min_frames, min(max_frames, initial_frames))
+        self.lock = threading.Lock()
+        self.frames = {}          # seq -> pcm bytes
+        self.next_seq = None      # seq sẽ phát ở lần pop() tới, None = đang đệm
+        self.last_frame = None    # frame phát gần nhất (dùng cho PLC)
+        self.concealed_run = 0    # số frame che liên tiếp
+        self.auto_seq = 0         # seq tự đánh cho client cũ không gửi seq
+        self.jitter = 0.0         # mẫu, như RFC 3550
+        self.last_transit = None
+        self.last_arrival = 0.0
+        self.comfort_noise = None   # bộ tạo comfort noise của lần DTX hiện tại
+        self.comfort_seq = None
+        self.comfort_arrival = 0.0
+        self.stats = {'pushed': 0, 'played': 0, 'late': 0, 'duplicates': 0, 'concealed': 0,
+                      'underruns': 0, 'overflow_drops': 0, 'comfort_noise': 0}
+
+    def push(self, seq, pcm, timestamp=None, now=None):
+        """Thêm một frame. Trả về False nếu frame bị bỏ (trùng / đến muộn).
+
+        seq=None (client JSON cũ): frame được coi là đến đúng thứ tự.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            if seq is None:
+                seq = self.auto_seq = (self.auto_seq + 1) & 0xFFFFFFFF
+            self.last_arrival = now
+            self._update_jitter(seq, timestamp, now)
+            if self.next_seq is not None:
+                delta = seq_delta(seq, self.next_seq)
+                if delta < -_RESYNC_FRAMES:
+                    self.frames.clear()
+                    self.next_seq = None
+                elif delta < 0:
+                    self.stats['late'] += 1
+                    return False
+            if seq in self.frames:
+                self.stats['duplicates'] += 1
+                return False
+            self.frames[seq] = pcm
+            self.stats['pushed'] += 1
+            if len(self.frames) > self.max_frames * 2:
+                # Người nhận không gọi pop() kịp: giữ giới hạn bộ nhớ, bỏ frame cũ nhất
+                oldest = self._oldest_seq()
+                del self.frames[oldest]
+                self.stats['overflow_drops'] += 1
+                if self.next_seq is not None and oldest == self.next_seq:
+                    self.next_seq = (oldest + 1) & 0xFFFFFFFF
+            return True
+
+    def set_comfort_noise(self, seq, generator, now=None):
+        """Gói comfort noise: người gửi ngừng gửi audio sau frame có seq trước seq này"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.last_arrival = self.comfort_arrival = now
+            self.comfort_noise = generator
+            self.comfort_seq = seq
+
+    def _update_jitter(self, seq, timestamp, now):
+        # Không có timestamp (header v1 / JSON cũ): suy ra từ seq, giả định frame liên tục
+        if timestamp is None:
+            timestamp = seq * self.frame_samples
+        transit = signed32(media_timestamp(now) - timestamp)
+        if self.last_transit is not None:
+            d = abs(signed32(transit - self.last_transit))
+            if d < self.rate:  # bước nhảy > 1s (khởi động lại, đổi đồng hồ) không phải jitter
+                self.jitter += (d - self.jitter) / 16.0
+        self.last_transit = transit
+
+    def _target_frames(self):
+        frames = math.ceil(self.jitter * config.JITTER_FACTOR / self.frame_samples)
+        return max(self.min_frames, min(self.max_frames, frames))
+
+    def _oldest_seq(self):
+        ref = self.next_seq if self.next_seq is not None else next(iter(self.frames))
+        return min(self.frames, key=lambda s: seq_delta(s, ref))
+
+    def pop(self):
+        """Frame cho chu kỳ phát hiện tại: PCM, PCM che mất gói, hoặc None (im lặng)."""
+        with self.lock:
+            if self.next_seq is None:
+                # Đang đệm: chỉ bắt đầu phát khi đủ độ sâu mục tiêu
+                self.target = self._target_frames()
+                if not self.frames or len(self.frames) < self.target:
+                    return self._conceal()
+                self.next_seq = self._oldest_seq()
+            elif self.next_seq not in self.frames and self.frames:
+                oldest = self._oldest_seq()
+                if seq_delta(oldest, self.next_seq) > _RESYNC_FRAMES:
+                    self.next_seq = oldest
+
+            while len(self.frames) > self.target + config.JITTER_DRAIN_MARGIN:
+                oldest = self._oldest_seq()
+                del self.frames[oldest]
+                self.stats['overflow_drops'] += 1
+                self.next_seq = (oldest + 1) & 0xFFFFFFFF
+
+            seq = self.next_seq
+            self.next_seq = (seq + 1) & 0xFFFFFFFF
+            pcm = self.frames.pop(seq, None)
+            if pcm is not None:
+                if self.comfort_noise is not None and (self.comfort_seq is None
+                                                       or seq_delta(seq, self.comfort_seq) > 0):
+                    self.comfort_noise = None   # người gửi nói lại
+                self.last_frame = pcm
+                self.concealed_run = 0
+                self.stats['played'] += 1
+                return pcm
+
+            if not self.frames:
+                # Không còn frame nào phía sau: người gửi ngừng hoặc mạng chậm -> đệm lại
+                self.next_seq = None
+                self.stats['underruns'] += 1
+            return self._conceal()
+
+    def _conceal(self):
+        if self.last_frame is None or self.concealed_run >= config.PLC_MAX_FRAMES:
+            return self._comfort_noise()
+        self.concealed_run += 1
+        self.stats['concealed'] += 1
+        gain = config.PLC_FADE ** self.concealed_run
+        samples = np.frombuffer(self.last_frame, dtype=np.int16)
+        return (samples * gain).astype(np.int16).tobytes()
+
+    def _comfort_noise(self):
+        if self.comfort_noise is None:
+            return None
+        if time.time() - self.comfort_arrival > _COMFORT_NOISE_TIMEOUT:
+            self.comfort_noise = None   # không còn nhận gói comfort noise (người gửi đã rời đi)
+            return None
+        self.stats['comfort_noise'] += 1
+        return self.comfort_noise.frame()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def summary(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['depth'] = len(self.frames)
+            stats['target_frames'] = self.target
+            stats['jitter_ms'] = round(self.jitter * 1000.0 / self.rate, 2)
+            return stats
@@ -2,8 +2,12 @@ import socket
 import threading
 import json
 import logging
-import time
+import base64
 from shared import config
+from shared.protocol import (CODEC_CN, CODEC_NAMES, CODEC_PCM, FLAG_CODEC_MASK, FRAME_AUDIO, MIXER_NAME,
+                             MIXER_SENDER_ID, SUPPORTED_FRAME_VERSIONS, FrameDecoder, MediaFrame, encode_frame,
+                             encode_json, media_timestamp)
+from .audio_codecs import available_codecs
 
 logging.basicConfig(level=logging.INFO)
 
@@ -16,11 +20,20 @@ class NetworkHandler:
         self.callback = None
         self.receive_thread = None
         self.connected = False
+        self.username = None
         self.audio_handler = None  # để xử lý AUDIO_DATA
         self.keep_alive_timer = None  # Theo dõi timer keep-alive
+        self.send_lock = threading.Lock()  # audio thread và GUI cùng gửi trên một socket
+
+        # Binary framing (thỏa thuận khi REGISTER)
+        self.framing = None     # phiên bản media frame, None = JSON + base64
+        self.user_id = None
+        self.peer_names = {}    # sender_id -> username
+        self.audio_seq = 0
 
     def connect(self, username):
         """Kết nối đến signaling server"""
+        self.username = username
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.settimeout(config.SOCKET_TIMEOUT)
@@ -29,9 +42,11 @@ class NetworkHandler:
             # Gửi thông tin đăng ký (thêm \n để phân tách JSON)
             register_msg = {
                 'type': 'REGISTER',
-                'username': username
+                'username': username,
+                'frame_versions': list(SUPPORTED_FRAME_VERSIONS),
+                'codecs': available_codecs() + [CODEC_NAMES[CODEC_CN]]   # cn: phát được comfort noise (DTX)
             }
-            self.sock.sendall((json.dumps(register_msg) + "\n").encode(config.ENCODING))
+            self.sock.sendall(encode_json(register_msg))
             
             # Nhận phản hồi với timeout
             self.sock.settimeout(5.0)
@@ -48,6 +63,9 @@ class NetworkHandler:
                     try:
                         response_data = json.loads(line)
                         if response_data.get('type') == 'REGISTER_SUCCESS':
+                            self.framing = response_data.get('framing')
+                            self.user_id = response_data.get('user_id')
+                            self.audio_seq = 0
                             self.running = True
                             self.connected = True
                             self.sock.settimeout(None)
@@ -102,9 +120,45 @@ class NetworkHandler:
             return False
             
         try:
-            message_str = json.dumps(message) + "\n"   # Thêm \n ở cuối
+            return self._send_bytes(encode_json(message))   # Thêm \n ở cuối
+        except Exception as e:
+            logging.error(f"[NetworkHandler] Send error: {e}")
+            return False
+
+    def next_audio_seq(self):
+        self.audio_seq = (self.audio_seq + 1) & 0xFFFFFFFF
+        return self.audio_seq
+
+    def send_audio(self, pcm_data, seq=None, timestamp=None, codec_id=CODEC_PCM):
+        """Gửi một chunk audio (pcm_data đã được mã hóa theo codec_id):
+        media frame nhị phân nếu server hỗ trợ, ngược lại JSON base64"""
+        if not self.connected or not self.sock:
+            return False
+        try:
+            if seq is None:
+                seq = self.next_audio_seq()
+            if timestamp is None:
+                timestamp = media_timestamp()
+            if self.framing:
+                return self._send_bytes(encode_frame(pcm_data, seq=seq, flags=codec_id, timestamp=timestamp,
+                                                     version=self.framing))
+            message = {
+                'type': 'AUDIO_DATA',
+                'data': base64.b64encode(pcm_data).decode('utf-8'),
+                'seq': seq,
+                'timestamp': timestamp
+            }
+            if codec_id != CODEC_PCM:
+                message['codec'] = CODEC_NAMES[codec_id]
+            return self._send_bytes(encode_json(message))
+        except Exception as e:
+            logging.error(f"[NetworkHandler] Audio send error: {e}")
+            return False
+
+    def _send_bytes(self, encoded_msg):
+        """Gửi toàn bộ dữ liệu, giữ send_lock để các message không bị xen kẽ"""
+        with self.send_lock:
             total_sent = 0
-            encoded_msg = message_str.encode(config.ENCODING)
             while total_sent < len(encoded_msg):
                 try:
                     sent = self.sock.send(encoded_msg[total_sent:])
@@ -116,48 +170,40 @@ class NetworkHandler:
                 except Exception as e:
                     logging.error(f"[NetworkHandler] Send loop error: {e}")
                     return False
-            return True
-        except Exception as e:
-            logging.error(f"[NetworkHandler] Send error: {e}")
-            return False
+        return True
     
     def _receive_loop(self):
         """Vòng lặp nhận message từ server"""
-        buffer = ""
+        decoder = FrameDecoder()
+        sock = self.sock
         try:
-            while self.running:
+            while self.running and sock is self.sock:
                 try:
-                    data = self.sock.recv(config.BUFFER_SIZE)
-                    if not data:
+                    if not decoder.recv_into(sock):
                         break
 
-                    # Cập nhật thời gian hoạt động
-                    if hasattr(self, 'client_timeouts') and hasattr(self, 'sock'):
-                        with threading.Lock():
-                            if self.sock in self.client_timeouts:
-                                self.client_timeouts[self.sock] = time.time()
-
-                    # Ghép buffer và tách theo delimiter \n
-                    buffer += data.decode(config.ENCODING)
-                    while "\n" in buffer:
-                        line, buffer = buffer.split("\n", 1)
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            message = json.loads(line)
-                            msg_type = message.get('type')
-                            if msg_type == 'AUDIO_DATA' and self.audio_handler:
-                                try:
-                                    # LUÔN gửi cả message object để audio_handler tự xử lý
-                                    self.audio_handler.handle_audio_data(message)
-                                except Exception as e:
-                                    logging.error(f"[NetworkHandler] Error handling audio: {e}")
-                            elif self.callback:
-                                self.callback(message)
-                        except json.JSONDecodeError as e:
-                            logging.warning(f"[NetworkHandler] Invalid JSON received: {e}")
+                    for message in decoder.messages():
+                        if isinstance(message, MediaFrame):
+                            self._handle_media_frame(message)
                             continue
+                        if 'user_ids' in message:
+                            self._update_peer_names(message['user_ids'])
+                        if 'media_token' in message:
+                            self._start_udp_media(message)
+                        msg_type = message.get('type')
+                        if msg_type in ('ROOM_CREATED', 'JOIN_SUCCESS', 'ROOM_CODEC'):
+                            self._set_room_codec(message)
+                        if msg_type == 'REDIRECT':
+                            self._handle_redirect(message)
+                            break
+                        if msg_type == 'AUDIO_DATA' and self.audio_handler:
+                            try:
+                                # LUÔN gửi cả message object để audio_handler tự xử lý
+                                self.audio_handler.handle_audio_data(message)
+                            except Exception as e:
+                                logging.error(f"[NetworkHandler] Error handling audio: {e}")
+                        elif self.callback:
+                            self.callback(message)
                         
                 except socket.timeout:
                     continue
@@ -171,9 +217,91 @@ class NetworkHandler:
         except Exception as e:
             logging.error(f"[NetworkHandler] Receive loop error: {e}")
         finally:
-            self.connected = False
+            # Sau REDIRECT, self.sock đã là kết nối mới: không đánh dấu mất kết nối
+            if sock is self.sock:
+                self.connected = False
             logging.info("[NetworkHandler] Receive loop ended")
 
+    def _handle_redirect(self, message):
+        """Server nhiều worker: phòng thuộc worker khác -> kết nối lại tới worker đó và gửi lại yêu cầu"""
+        try:
+            port = int(message['port'])
+        except (KeyError, TypeError, ValueError):
+            logging.warning(f"[NetworkHandler] Invalid REDIRECT: {message}")
+            return
+        retry = message.get('retry')
+        logging.info(f"[NetworkHandler] Redirected to {self.host}:{port} (shard {message.get('shard')})")
+
+        if self.keep_alive_timer:
+            self.keep_alive_timer.cancel()
+            self.keep_alive_timer = None
+        if self.audio_handler and hasattr(self.audio_handler, 'stop_udp_transport'):
+            self.audio_handler.stop_udp_transport()
+
+        old_sock = self.sock
+        self.connected = False
+        try:
+            with self.send_lock:
+                old_sock.sendall(encode_json({'type': 'GOODBYE'}))
+        except Exception:
+            pass
+        try:
+            old_sock.close()
+        except Exception:
+            pass
+
+        self.sock = None
+        self.port = port
+        success, status = self.connect(self.username)
+        if success and retry:
+            self.send_message(retry)
+        elif not success and self.callback:
+            self.callback({'type': 'ERROR', 'message': f"Redirect failed: {status}"})
+
+    def _handle_media_frame(self, frame):
+        """Chuyển media frame thành message AUDIO_DATA cho audio_handler"""
+        if frame.type != FRAME_AUDIO or not self.audio_handler:
+            return
+        try:
+            self.audio_handler.handle_audio_data({
+                'type': 'AUDIO_DATA',
+                'from': self.peer_names.get(frame.sender_id, str(frame.sender_id)),
+                'seq': frame.seq,
+                'timestamp': frame.timestamp,
+                'codec': frame.flags & FLAG_CODEC_MASK,
+                'pcm': frame.payload
+            })
+        except Exception as e:
+            logging.error(f"[NetworkHandler] Error handling audio: {e}")
+
+    def _set_room_codec(self, message):
+        """Codec chung của phòng (ROOM_CREATED / JOIN_SUCCESS / ROOM_CODEC): dùng cho audio gửi đi,
+        kèm cờ comfort_noise (được gửi gói comfort noise khi DTX)"""
+        if self.audio_handler and hasattr(self.audio_handler, 'set_send_codec'):
+            self.audio_handler.set_send_codec(message.get('codec'))
+        if self.audio_handler and hasattr(self.audio_handler, 'set_comfort_noise'):
+            self.audio_handler.set_comfort_noise(message.get('comfort_noise', False))
+
+    def _start_udp_media(self, message):
+        """Server cấp media token (ROOM_CREATED / JOIN_SUCCESS): bật kênh UDP cho audio"""
+        if not config.UDP_MEDIA_ENABLED or not self.audio_handler:
+            return
+        if not hasattr(self.audio_handler, 'start_udp_transport'):
+            return
+        try:
+            self.audio_handler.start_udp_transport(self.host, int(message['media_port']), message['media_token'])
+        except Exception as e:
+            logging.warning(f"[NetworkHandler] UDP media unavailable, using TCP: {e}")
+
+    def _update_peer_names(self, user_ids):
+        """Cập nhật bảng sender_id -> username từ JOIN_SUCCESS / USER_JOINED / USER_LEFT"""
+        try:
+            peer_names = {int(uid): name for name, uid in user_ids.items()}
+            peer_names[MIXER_SENDER_ID] = MIXER_NAME  # phòng mix: audio đã trộn từ server
+            self.peer_names = peer_names
+        except (AttributeError, TypeError, ValueError):
+            logging.warning(f"[NetworkHandler] Invalid user_ids: {user_ids}")
+
     def _start_keep_alive(self):
         """Gửi ping định kỳ để giữ kết nối"""
         # Dừng timer cũ nếu có
@@ -207,6 +335,9 @@ class NetworkHandler:
         if self.keep_alive_timer:
             self.keep_alive_timer.cancel()
             self.keep_alive_timer = None
+
+        if self.audio_handler and hasattr(self.audio_handler, 'stop_udp_transport'):
+            self.audio_handler.stop_udp_transport()
         
         if self.sock:
             # CHỈ gửi GOODBYE nếu socket có khả năng gửi được
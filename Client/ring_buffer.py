@@ -0,0 +1,76 @@
+import threading
+
+
+class FrameRing:
+    """Ring buffer cấp phát trước cho các chunk audio kích thước cố định.
+
+    Nối callback PortAudio (không được chặn lâu, không nên cấp phát) với các
+    thread mạng / xử lý: dữ liệu được chép vào ô nhớ có sẵn, không tạo
+    bytes mới khi ghi. Đầy thì ghi đè chunk cũ nhất (overrun), rỗng thì
+    bên đọc tự chọn im lặng (underrun).
+    """
+
+    def __init__(self, frames, frame_bytes):
+        self.frames = frames
+        self.frame_bytes = frame_bytes
+        self.buffer = bytearray(frames * frame_bytes)
+        self.view = memoryview(self.buffer)
+        self.read_index = 0
+        self.count = 0
+        self.overruns = 0
+        self.underruns = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def write(self, data):
+        """Chép một chunk vào ô trống tiếp theo (thiếu thì đệm 0, thừa thì cắt)"""
+        size = min(len(data), self.frame_bytes)
+        with self.cond:
+            if self.count == self.frames:
+                self.read_index = (self.read_index + 1) % self.frames
+                self.count -= 1
+                self.overruns += 1
+            start = ((self.read_index + self.count) % self.frames) * self.frame_bytes
+            self.view[start:start + size] = memoryview(data)[:size]
+            if size < self.frame_bytes:
+                self.view[start + size:start + self.frame_bytes] = bytes(self.frame_bytes - size)
+            self.count += 1
+            self.cond.notify_all()
+
+    def read_into(self, out, timeout=None):
+        """Chép chunk cũ nhất vào buffer của bên gọi (ghi được, dài frame_bytes), chờ tối đa
+        timeout giây. Không cấp phát. Trả về False nếu rỗng / đã đóng."""
+        with self.cond:
+            if not self.count and not self.closed and timeout != 0:
+                self.cond.wait_for(lambda: self.count or self.closed, timeout)
+            if not self.count:
+                if timeout == 0:
+                    self.underruns += 1
+                return False
+            start = self.read_index * self.frame_bytes
+            out[:self.frame_bytes] = self.view[start:start + self.frame_bytes]
+            self.read_index = (self.read_index + 1) % self.frames
+            self.count -= 1
+            self.cond.notify_all()
+            return True
+
+    def wait_for_space(self, timeout=None):
+        """Chờ đến khi còn ô trống. Trả về False nếu hết thời gian hoặc đã đóng."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.count < self.frames or self.closed, timeout)
+            return self.count < self.frames and not self.closed
+
+    def clear(self):
+        with self.cond:
+            self.read_index = 0
+            self.count = 0
+            self.cond.notify_all()
+
+    def close(self):
+        """Đánh thức mọi thread đang chờ (khi dừng stream)"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        return self.count
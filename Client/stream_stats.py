@@ -0,0 +1,106 @@
+import time
+from shared import config
+from shared.protocol import SEQ_MOD, media_timestamp, seq_delta, signed32
+
+_MAX_DROPOUT = 3000    # seq nhảy tới quá xa: coi như nguồn khởi động lại
+_MAX_MISORDER = 100    # seq lùi quá xa: cũng coi như khởi động lại
+_DUPLICATE_WINDOW = 64
+
+
+class StreamStats:
+    """Thống kê nhận audio của một người gửi, theo RFC 3550 (phụ lục A.1, A.3, A.8).
+
+    - loss: số frame mong đợi (theo seq lớn nhất - seq đầu tiên) trừ số frame
+      khác nhau đã nhận; frame trùng được đếm riêng, frame đến trễ vẫn tính là nhận.
+    - jitter: ước lượng trượt J += (|D| - J) / 16 của độ lệch thời gian truyền
+      giữa hai frame liên tiếp (đơn vị mẫu, xuất ra ms).
+    - delay: giờ nhận - timestamp lúc thu; chỉ có nghĩa khi đồng hồ hai máy
+      được đồng bộ (NTP), dùng để so sánh xu hướng hơn là giá trị tuyệt đối.
+    Frame không có timestamp (JSON / header v1) chỉ được tính loss.
+    """
+
+    def __init__(self, rate=config.AUDIO_RATE):
+        self.rate = rate
+        self.base_seq = None
+        self.max_seq = None
+        self.received = 0        # frame khác nhau đã nhận
+        self.duplicates = 0
+        self.reordered = 0       # frame đến sau một frame có seq lớn hơn
+        self.resets = 0
+        self.recent = set()      # seq gần đây để nhận ra frame trùng
+        self.jitter = 0.0        # đơn vị mẫu
+        self.last_transit = None
+        self.delay = None        # ms, giá trị gần nhất
+        self.delay_sum = 0.0
+        self.delay_count = 0
+        self.last_arrival = 0.0
+
+    def update(self, seq, timestamp=None, now=None):
+        now = time.time() if now is None else now
+        self.last_arrival = now
+        if not self._update_seq(seq):
+            return
+        if timestamp is None:
+            return
+
+        arrival = media_timestamp(now)
+        transit = signed32(arrival - timestamp)
+        if self.last_transit is not None:
+            d = abs(signed32(transit - self.last_transit))
+            self.jitter += (d - self.jitter) / 16.0
+        self.last_transit = transit
+
+        self.delay = transit * 1000.0 / self.rate
+        self.delay_sum += self.delay
+        self.delay_count += 1
+
+    def _update_seq(self, seq):
+        """Cập nhật bộ đếm seq. Trả về False nếu frame bị trùng."""
+        if self.max_seq is None:
+            self._restart(seq)
+            return True
+        delta = seq_delta(seq, self.max_seq)
+        if delta > _MAX_DROPOUT or delta < -_MAX_MISORDER:
+            self.resets += 1
+            self._restart(seq)
+            return True
+        if seq in self.recent:
+            self.duplicates += 1
+            return False
+        if delta > 0:
+            self.max_seq = seq
+        else:
+            self.reordered += 1
+        self.received += 1
+        self.recent.add(seq)
+        if len(self.recent) > _DUPLICATE_WINDOW:
+            self.recent = {s for s in self.recent if seq_delta(self.max_seq, s) < _DUPLICATE_WINDOW}
+        return True
+
+    def _restart(self, seq):
+        self.base_seq = self.max_seq = seq
+        self.received = 1
+        self.recent = {seq}
+        self.last_transit = None
+
+    @property
+    def expected(self):
+        if self.max_seq is None:
+            return 0
+        return (self.max_seq - self.base_seq) % SEQ_MOD + 1
+
+    def summary(self):
+        expected = self.expected
+        lost = max(0, expected - self.received)
+        return {
+            'received': self.received,
+            'expected': expected,
+            'lost': lost,
+            'loss_rate': round(lost / expected, 4) if expected else 0.0,
+            'duplicates': self.duplicates,
+            'reordered': self.reordered,
+            'resets': self.resets,
+            'jitter_ms': round(self.jitter * 1000.0 / self.rate, 2),
+            'delay_ms': round(self.delay, 1) if self.delay is not None else None,
+            'avg_delay_ms': round(self.delay_sum / self.delay_count, 1) if self.delay_count else None,
+        }
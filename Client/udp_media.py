@@ -0,0 +1,103 @@
+import socket
+import threading
+import logging
+import time
+from shared import config
+from shared.protocol import FRAME_AUDIO, FRAME_BIND, FRAME_VERSION, decode_frame, encode_frame
+
+
+class UdpMediaChannel:
+    """Gửi/nhận media frame qua UDP relay của server.
+
+    Kênh chỉ được coi là sẵn sàng (is_ready) khi server đã xác nhận BIND gần đây;
+    khi UDP bị chặn hoặc mất gói liên tục, AudioHandler quay về gửi qua TCP.
+    """
+
+    def __init__(self, host, port, token, on_frame, version=FRAME_VERSION):
+        self.server_addr = (host, port)
+        self.version = version     # phiên bản header đã thỏa thuận qua TCP
+        self.token = bytes.fromhex(token)
+        self.on_frame = on_frame   # callback(MediaFrame) cho audio nhận được
+        self.sock = None
+        self.running = False
+        self.receive_thread = None
+        self.last_ack = 0.0
+        self.last_bind = 0.0
+        self.bind_seq = 0
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(config.UDP_KEEPALIVE_INTERVAL)
+        self.sock.connect(self.server_addr)
+        self.running = True
+        self.receive_thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self.receive_thread.start()
+        self._send_bind()
+        logging.info(f"[UdpMedia] Started, relay {self.server_addr[0]}:{self.server_addr[1]}")
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+            self.sock = None
+        logging.info("[UdpMedia] Stopped")
+
+    def is_ready(self):
+        return self.running and time.time() - self.last_ack < config.UDP_SESSION_TIMEOUT
+
+    def send_audio(self, pcm_data, seq, timestamp=None, codec_id=0):
+        """Gửi một chunk audio (đã mã hóa theo codec_id) qua UDP, trả về False nếu nên dùng TCP"""
+        if not self.is_ready():
+            return False
+        try:
+            self.sock.send(self.token + encode_frame(pcm_data, seq=seq, flags=codec_id, timestamp=timestamp,
+                                                     version=self.version))
+        except (OSError, AttributeError) as e:
+            logging.debug(f"[UdpMedia] Send error: {e}")
+            return False
+        return True
+
+    def _send_bind(self):
+        """BIND định kỳ: giữ NAT mapping và kiểm tra relay còn trả lời"""
+        self.bind_seq += 1
+        self.last_bind = time.time()
+        sock = self.sock
+        if sock is None:
+            return
+        try:
+            sock.send(self.token + encode_frame(b"", seq=self.bind_seq, frame_type=FRAME_BIND,
+                                                version=self.version))
+        except OSError as e:
+            logging.debug(f"[UdpMedia] BIND error: {e}")
+
+    def _receive_loop(self):
+        sock = self.sock
+        while self.running:
+            if time.time() - self.last_bind >= config.UDP_KEEPALIVE_INTERVAL:
+                self._send_bind()
+            try:
+                data = sock.recv(config.BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self.running:
+                    logging.info(f"[UdpMedia] Receive error: {e}")
+                    time.sleep(config.UDP_KEEPALIVE_INTERVAL)
+                    continue
+                break
+
+            frame = decode_frame(data)
+            if frame is None:
+                continue
+            if frame.type == FRAME_BIND:
+                self.last_ack = time.time()
+            elif frame.type == FRAME_AUDIO:
+                self.last_ack = time.time()
+                try:
+                    self.on_frame(frame)
+                except Exception as e:
+                    logging.error(f"[UdpMedia] Error handling audio: {e}")
+        logging.info("[UdpMedia] Receive loop ended")
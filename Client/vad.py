@@ -0,0 +1,160 @@
+import collections
+import math
+import numpy as np
+from shared import config
+
+_BANDS = 8              # số dải tần trong gói comfort noise
+_SPEECH_BINS = (3, 65)  # bin FFT dùng tính độ phẳng phổ (~190-4000 Hz với chunk 256 mẫu @ 16 kHz)
+_FULL_SCALE = 32768.0 ** 2
+_NOISE_SMOOTHING = 0.1  # hệ số làm mượt phổ nhiễu cho comfort noise
+_NOISE_FRAME_DB = 3.0   # chỉ chunk cách nền nhiễu không quá N dB mới dùng để đo phổ nhiễu
+
+
+def _dbfs(power):
+    return 10.0 * math.log10(power / _FULL_SCALE + 1e-12)
+
+
+class VoiceActivityDetector:
+    """Phát hiện giọng nói (VAD) cho từng chunk mic.
+
+    - Năng lượng: chunk phải cao hơn nền nhiễu VAD_ENERGY_MARGIN_DB. Nền nhiễu thích
+      nghi theo thống kê cực tiểu: năng lượng nhỏ nhất trong VAD_NOISE_WINDOW chunk
+      gần nhất (luôn có khoảng nghỉ giữa các từ), không thấp hơn VAD_MIN_NOISE_DB.
+    - Độ phẳng phổ: giọng hữu thanh có họa âm (phổ không phẳng), gõ phím / nhiễu
+      nền có phổ phẳng.
+    - Bắt đầu nói: VAD_ONSET_FRAMES chunk đủ năng lượng liên tiếp và chunk hiện tại có
+      họa âm, hoặc VAD_ONSET_UNVOICED_FRAMES chunk liên tiếp (phụ âm xát). Tiếng click
+      một chunk không kích hoạt; các chunk bị "chờ xác nhận" được gửi bù (pre-roll,
+      do bên gọi giữ).
+    - Kết thúc: giữ trạng thái nói thêm VAD_HANGOVER_FRAMES chunk sau chunk cuối thỏa
+      điều kiện trên, để không cắt âm cuối từ.
+    Phổ nhiễu (các chunk không có giọng) được làm mượt để tạo gói comfort noise.
+    """
+
+    def __init__(self, samples=config.AUDIO_CHUNK, energy_margin=config.VAD_ENERGY_MARGIN_DB,
+                 flatness_max=config.VAD_FLATNESS_MAX, onset_frames=config.VAD_ONSET_FRAMES,
+                 onset_unvoiced_frames=config.VAD_ONSET_UNVOICED_FRAMES,
+                 hangover_frames=config.VAD_HANGOVER_FRAMES, noise_window=config.VAD_NOISE_WINDOW,
+                 min_noise_db=config.VAD_MIN_NOISE_DB):
+        self.samples = samples
+        self.energy_margin = energy_margin
+        self.flatness_max = flatness_max
+        self.onset_frames = onset_frames
+        self.onset_unvoiced_frames = onset_unvoiced_frames
+        self.hangover_frames = hangover_frames
+        self.min_noise_db = min_noise_db
+        self.window = np.hanning(samples).astype(np.float32)
+        self.buffer = np.empty(samples, dtype=np.float32)
+        self.history = collections.deque(maxlen=noise_window)   # năng lượng (dBFS) các chunk gần nhất
+        bins = samples // 2 + 1
+        edges = np.linspace(1, bins, _BANDS + 1).astype(int)
+        self.band_edges = list(zip(edges[:-1], edges[1:]))
+        self.noise_bands = None   # công suất nhiễu từng dải (làm mượt)
+        self.noise_power = None   # công suất nhiễu trung bình mỗi mẫu
+        self.active = False
+        self.run = 0              # số chunk đủ năng lượng liên tiếp
+        self.hangover = 0
+        self.noise_db = min_noise_db
+        self.stats = {'speech': 0, 'silence': 0, 'onsets': 0}
+
+    def update(self, data):
+        """True nếu chunk (bytes int16) thuộc đoạn đang nói"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        if len(samples) != self.samples:
+            return self.active
+        x = self.buffer
+        x[:] = samples
+        power = float(np.dot(x, x)) / self.samples
+        energy_db = _dbfs(power)
+        self.history.append(energy_db)
+        self.noise_db = max(min(self.history), self.min_noise_db)
+
+        x *= self.window
+        spectrum = np.fft.rfft(x)
+        bin_power = spectrum.real ** 2 + spectrum.imag ** 2
+        lo, hi = _SPEECH_BINS
+        band = bin_power[lo:hi] + 1e-3
+        flatness = float(np.exp(np.mean(np.log(band))) / np.mean(band))
+
+        if energy_db > self.noise_db + self.energy_margin:
+            self.run += 1
+        else:
+            self.run = 0
+        # Cùng một điều kiện cho bắt đầu nói và gia hạn hangover: tiếng click lẻ không kéo dài đoạn nói
+        speech = ((self.run >= self.onset_frames and flatness < self.flatness_max)
+                  or self.run >= self.onset_unvoiced_frames)
+        if speech:
+            if not self.active:
+                self.active = True
+                self.stats['onsets'] += 1
+            self.hangover = self.hangover_frames
+        elif self.active and not self.run:
+            self.hangover -= 1
+            if self.hangover <= 0:
+                self.active = False
+
+        if self.active:
+            self.stats['speech'] += 1
+        else:
+            self.stats['silence'] += 1
+            if energy_db < self.noise_db + _NOISE_FRAME_DB:
+                self._update_noise(power, bin_power)
+        return self.active
+
+    def _update_noise(self, power, bin_power):
+        bands = [float(bin_power[a:b].mean()) for a, b in self.band_edges]
+        if self.noise_bands is None:
+            self.noise_bands, self.noise_power = bands, power
+            return
+        # Giảm nhanh, tăng chậm: ước lượng lúc đầu (khi nền nhiễu chưa rõ) không kéo dài
+        a = _NOISE_SMOOTHING if power > self.noise_power else 0.5
+        self.noise_bands = [n + a * (b - n) for n, b in zip(self.noise_bands, bands)]
+        self.noise_power += a * (power - self.noise_power)
+
+    def descriptor(self):
+        """Gói comfort noise (kiểu RFC 3389): byte mức nhiễu (-dBov) + hình dạng phổ
+        theo _BANDS dải (-dB so với dải mạnh nhất). None nếu chưa đo được nhiễu."""
+        if self.noise_bands is None:
+            return None
+        level = min(127, max(0, round(-_dbfs(self.noise_power))))
+        peak = max(self.noise_bands) + 1e-12
+        shape = [min(127, max(0, round(-10.0 * math.log10(b / peak + 1e-12)))) for b in self.noise_bands]
+        return bytes([level] + shape)
+
+    def reset(self):
+        self.history.clear()
+        self.active = False
+        self.run = 0
+        self.hangover = 0
+
+
+class ComfortNoiseGenerator:
+    """Tạo nhiễu nền (comfort noise) phía người nghe từ một gói descriptor().
+
+    Mỗi frame: phổ biên độ theo hình dạng các dải, pha ngẫu nhiên, IFFT, rồi chỉnh
+    về đúng mức nhiễu. Dùng thay cho im lặng tuyệt đối khi người gửi đang DTX.
+    """
+
+    def __init__(self, payload, samples=config.AUDIO_CHUNK):
+        self.samples = samples
+        self.rng = np.random.default_rng()
+        payload = bytes(payload)
+        level = payload[0] if payload else 127
+        self.rms = math.sqrt(_FULL_SCALE) * 10.0 ** (-level / 20.0)
+        bins = samples // 2 + 1
+        self.magnitude = np.ones(bins)
+        shape = payload[1:1 + _BANDS]
+        if len(shape) == _BANDS:
+            edges = np.linspace(1, bins, _BANDS + 1).astype(int)
+            for (a, b), db in zip(zip(edges[:-1], edges[1:]), shape):
+                self.magnitude[a:b] = 10.0 ** (-db / 20.0)
+        self.magnitude[0] = 0.0   # không có thành phần DC
+
+    def frame(self):
+        """Một chunk comfort noise (bytes int16)"""
+        phase = self.rng.uniform(0, 2 * np.pi, len(self.magnitude))
+        noise = np.fft.irfft(self.magnitude * np.exp(1j * phase), self.samples)
+        rms = float(np.sqrt(np.mean(noise ** 2))) + 1e-12
+        noise *= self.rms / rms
+        np.clip(noise, -32768, 32767, out=noise)
+        return noise.astype(np.int16).tobytes()
@@ -0,0 +1,98 @@
+import threading
+import time
+from shared import config
+
+_SAMPLE_STRIDE = 8  # chỉ đọc 1/8 số mẫu: đủ để ước lượng năng lượng giọng nói
+
+
+def frame_level(pcm):
+    """Ước lượng mức âm lượng của một frame PCM int16 (trung bình |mẫu| trên các mẫu lấy thưa)"""
+    usable = len(pcm) & ~1
+    if not usable:
+        return 0.0
+    samples = memoryview(pcm)[:usable].cast('h')[::_SAMPLE_STRIDE]
+    return sum(map(abs, samples)) / len(samples)
+
+
+class ActiveSpeakerSelector:
+    """Chọn K người nói to nhất trong phòng, có hysteresis để tập người nói không nhấp nháy.
+
+    - Mỗi người nói có một mức năng lượng làm mượt (EMA) từ các frame gần đây.
+    - Còn chỗ trống: người nói vượt ngưỡng im lặng được thêm ngay.
+    - Hết chỗ: người mới chỉ thay người nhỏ nhất trong tập khi to hơn HYSTERESIS
+      lần và người bị thay đã giữ chỗ ít nhất HOLD giây.
+    - Người trong tập im lặng (hoặc không gửi frame) quá HANGOVER giây bị bỏ ra.
+    """
+
+    def __init__(self, max_speakers,
+                 smoothing=config.ACTIVE_SPEAKER_SMOOTHING,
+                 threshold=config.SILENCE_THRESHOLD,
+                 hysteresis=config.ACTIVE_SPEAKER_HYSTERESIS,
+                 hold=config.ACTIVE_SPEAKER_HOLD,
+                 hangover=config.ACTIVE_SPEAKER_HANGOVER):
+        self.max_speakers = max_speakers
+        self.smoothing = smoothing
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.hold = hold
+        self.hangover = hangover
+        self.lock = threading.Lock()
+        self.levels = {}      # sock -> mức năng lượng đã làm mượt
+        self.last_voice = {}  # sock -> lần cuối vượt ngưỡng im lặng
+        self.active = {}      # sock -> thời điểm được chọn
+        self.version = 0      # tăng mỗi lần tập người nói thay đổi
+
+    def update(self, sock, pcm, now=None):
+        """Ghi nhận một frame. Trả về (forward, snapshot): có chuyển tiếp frame này không,
+        và (version, [sock]) nếu tập người nói vừa thay đổi (cần gửi ACTIVE_SPEAKERS)."""
+        now = time.monotonic() if now is None else now
+        level = frame_level(pcm)
+        with self.lock:
+            smoothed = self.levels.get(sock, level)
+            smoothed += self.smoothing * (level - smoothed)
+            self.levels[sock] = smoothed
+            if smoothed >= self.threshold:
+                self.last_voice[sock] = now
+
+            changed = self._expire_silent(now)
+            if sock not in self.active and smoothed >= self.threshold:
+                if len(self.active) < self.max_speakers:
+                    self.active[sock] = now
+                    changed = True
+                else:
+                    quietest = min(self.active, key=lambda s: self.levels.get(s, 0.0))
+                    if (smoothed > self.levels.get(quietest, 0.0) * self.hysteresis
+                            and now - self.active[quietest] >= self.hold):
+                        del self.active[quietest]
+                        self.active[sock] = now
+                        changed = True
+            return sock in self.active, self._changed() if changed else None
+
+    def expire(self, now=None):
+        """Bỏ người nói đã ngừng gửi frame (gọi định kỳ). Trả về snapshot nếu có thay đổi."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return self._changed() if self._expire_silent(now) else None
+
+    def _changed(self):
+        self.version += 1
+        return self.version, list(self.active)
+
+    def _expire_silent(self, now):
+        silent = [s for s in self.active if now - self.last_voice.get(s, 0.0) > self.hangover]
+        for s in silent:
+            del self.active[s]
+        return bool(silent)
+
+    def remove(self, sock):
+        """Người nói rời phòng. Trả về snapshot nếu tập người nói thay đổi."""
+        with self.lock:
+            self.levels.pop(sock, None)
+            self.last_voice.pop(sock, None)
+            if self.active.pop(sock, None) is None:
+                return None
+            return self._changed()
+
+    def snapshot(self):
+        with self.lock:
+            return self.version, list(self.active)
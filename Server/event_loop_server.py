@@ -0,0 +1,225 @@
+import socket
+import selectors
+import logging
+import time
+from shared import config
+from shared.protocol import FrameDecoder, ProtocolError
+
+from .send_queue import SendQueue, advance_buffers, send_buffers
+from .signaling_server import SignalingServer
+
+
+class _Connection:
+    """Trạng thái của một kết nối trong event loop"""
+    __slots__ = ('sock', 'decoder', 'queue', 'pending', 'events')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.decoder = FrameDecoder(copy_payload=False)  # buffer nhận dùng lại (recv_into)
+        self.queue = SendQueue()
+        self.pending = []    # các buffer đang gửi dở (sendmsg gửi một phần)
+        self.events = selectors.EVENT_READ
+
+
+class EventLoopSignalingServer(SignalingServer):
+    """Signaling server chạy trên một thread duy nhất (selectors / epoll).
+
+    Dùng lại toàn bộ logic xử lý message của SignalingServer, chỉ thay phần I/O:
+    socket non-blocking, không tạo thread cho mỗi client, dữ liệu gửi đi nằm
+    trong SendQueue của client và được ghi khi socket sẵn sàng.
+    """
+
+    def __init__(self, host=config.HOST_SERVER_BIND, port=config.PORT_SIGNALING, media_port=config.PORT_AUDIO,
+                 shard=None, metrics_port=config.METRICS_PORT):
+        super().__init__(host, port, media_port, shard, metrics_port)
+        self.selector = None
+        self.connections = {}  # sock -> _Connection
+        self.dirty = {}        # _Connection -> thời điểm có dữ liệu mới chờ gom (chưa flush)
+        self._last_timeout_check = 0.0
+
+    def start(self):
+        self.running = True
+        self.selector = selectors.DefaultSelector()
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(config.EVENT_LOOP_BACKLOG)
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ, None)
+
+        # UDP relay dùng chung selector, không cần thread riêng
+        self._start_media_relay(threaded=False)
+        if self.media_relay:
+            self.media_relay.sock.setblocking(False)
+            self.selector.register(self.media_relay.sock, selectors.EVENT_READ, self.media_relay)
+        self._last_timeout_check = time.monotonic()
+        self._start_metrics()
+
+        logging.info(f"[EventLoopServer] Listening on {self.host}:{self.port} ({type(self.selector).__name__})")
+        logging.info(f"[EventLoopServer] Clients will connect to: {config.HOST_CLIENT_CONNECT}:{config.PORT_SIGNALING}")
+
+        try:
+            while self.running:
+                timeout = self.idle_tracker.tick
+                if self.mix_rooms:
+                    timeout = min(timeout, self.mixer_clock.time_until_next())
+                if self.dirty:
+                    timeout = min(timeout, self._coalesce_timeout())
+                try:
+                    events = self.selector.select(timeout=timeout)
+                except OSError as e:
+                    if self.running:
+                        logging.error(f"[EventLoopServer] Select error: {e}")
+                    break
+
+                for key, mask in events:
+                    if key.data is None:
+                        self._accept()
+                        continue
+                    if key.data is self.media_relay:
+                        self.media_relay.on_readable()
+                        continue
+                    conn = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._on_readable(conn)
+                    if mask & selectors.EVENT_WRITE and conn.sock in self.connections:
+                        self._flush(conn)
+
+                if self.mix_rooms:
+                    self.mixer_clock.run_due()
+
+                # Mỗi vòng lặp: một sendmsg cho tất cả frame đang chờ của mỗi socket
+                if self.dirty:
+                    self._flush_dirty()
+
+                now = time.monotonic()
+                if now - self._last_timeout_check >= self.idle_tracker.tick:
+                    self._last_timeout_check = now
+                    try:
+                        self._run_periodic_checks()
+                    except Exception as e:
+                        logging.error(f"[EventLoopServer] Timeout check error: {e}")
+        finally:
+            self._close_all()
+
+    def _accept(self):
+        # Nhận hết các kết nối đang chờ trong một lần
+        while True:
+            try:
+                client_socket, addr = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.running:
+                    logging.error(f"[EventLoopServer] Accept error: {e}")
+                return
+
+            client_socket.setblocking(False)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Connection(client_socket)
+            self.connections[client_socket] = conn
+            self.idle_tracker.add(client_socket)
+            self.send_queues[client_socket] = conn.queue
+            self.selector.register(client_socket, selectors.EVENT_READ, conn)
+            logging.info(f"[EventLoopServer] New connection from {addr}")
+            self.metrics.connections_total.inc()
+
+    def _on_readable(self, conn):
+        sock = conn.sock
+        try:
+            received = conn.decoder.recv_into(sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logging.info(f"[EventLoopServer] Connection error: {e}")
+            self.remove_client(sock)
+            return
+        except ProtocolError as e:
+            logging.error(f"[EventLoopServer] Client error: {e}")
+            self.remove_client(sock)
+            return
+
+        if not received:
+            self.remove_client(sock)
+            return
+
+        self.idle_tracker.touch(sock)
+        try:
+            self._process_data(sock, conn.decoder, received)
+        except Exception as e:
+            logging.error(f"[EventLoopServer] Client error: {e}")
+            self.remove_client(sock)
+
+    def _send_bytes(self, sock, data, media=False):
+        """Đưa dữ liệu vào hàng đợi gửi của client; được ghi ở cuối vòng lặp (gom nhiều frame)"""
+        conn = self.connections.get(sock)
+        if conn is None:
+            return
+        super()._send_bytes(sock, data, media)
+        if sock in self.connections and conn not in self.dirty and not conn.events & selectors.EVENT_WRITE:
+            self.dirty[conn] = time.monotonic()
+
+    def _coalesce_timeout(self):
+        oldest = min(self.dirty.values())
+        return max(0.0, oldest + config.SEND_COALESCE_DELAY - time.monotonic())
+
+    def _flush_dirty(self):
+        """Flush các kết nối đã chờ đủ SEND_COALESCE_DELAY (hoặc đã gom đủ một batch)"""
+        now = time.monotonic()
+        for conn, since in list(self.dirty.items()):
+            if (now - since >= config.SEND_COALESCE_DELAY
+                    or len(conn.queue) >= config.SEND_COALESCE_MAX_FRAMES):
+                del self.dirty[conn]
+                if conn.sock in self.connections:
+                    self._flush(conn)
+
+    def _flush(self, conn):
+        sock = conn.sock
+        self.dirty.pop(conn, None)
+        try:
+            while True:
+                if not conn.pending:
+                    conn.pending = conn.queue.get_batch_nowait(config.SEND_COALESCE_MAX_FRAMES)
+                    if not conn.pending:
+                        break
+                sent = send_buffers(sock, conn.pending)
+                self.metrics.send_calls.inc()
+                if sent == 0:
+                    break
+                conn.pending = advance_buffers(conn.pending, sent)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            logging.error(f"[EventLoopServer] Send error: {e}")
+            self.metrics.send_errors.inc()
+            self.remove_client(sock)
+            return
+
+        has_more = bool(conn.pending) or len(conn.queue) > 0
+        wanted = selectors.EVENT_READ | (selectors.EVENT_WRITE if has_more else 0)
+        if wanted != conn.events and sock in self.connections:
+            conn.events = wanted
+            self.selector.modify(sock, wanted, conn)
+
+    def _ensure_mixer_clock(self):
+        # Nhịp trộn chạy ngay trong event loop (run_due), không cần thread riêng
+        pass
+
+    def remove_client(self, sock):
+        conn = self.connections.pop(sock, None)
+        if conn is not None:
+            self.dirty.pop(conn, None)
+            try:
+                self.selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+        super().remove_client(sock)
+
+    def _close_all(self):
+        for sock in list(self.connections):
+            self.remove_client(sock)
+        if self.selector:
+            try:
+                self.selector.close()
+            except Exception:
+                pass
@@ -0,0 +1,72 @@
+import math
+import threading
+import time
+from shared import config
+
+
+class IdleTracker:
+    """Phát hiện client không hoạt động bằng hashed timing wheel.
+
+    - touch() chỉ ghi thời điểm hoạt động cuối (một phép gán dict, không lock),
+      được gọi cho mỗi gói tin.
+    - Mỗi client nằm trong đúng một ô của bánh xe, ứng với hạn kiểm tra tiếp theo.
+      expire() chỉ duyệt các ô đã đến hạn; client còn hoạt động được dời sang ô
+      mới theo last_seen + timeout, client quá hạn được trả về để xóa.
+    """
+
+    def __init__(self, timeout=config.CLIENT_IDLE_TIMEOUT, tick=config.IDLE_CHECK_INTERVAL):
+        self.timeout = timeout
+        self.tick = tick
+        self.slots = [set() for _ in range(int(math.ceil(timeout / tick)) + 1)]
+        self.last_seen = {}  # key -> time.monotonic() của lần hoạt động cuối
+        self.lock = threading.Lock()  # chỉ bảo vệ các ô của bánh xe
+        self.current_tick = int(time.monotonic() / tick)
+
+    def _schedule(self, key, deadline):
+        tick_index = max(int(deadline / self.tick), self.current_tick + 1)
+        self.slots[tick_index % len(self.slots)].add(key)
+
+    def add(self, key):
+        now = time.monotonic()
+        self.last_seen[key] = now
+        with self.lock:
+            self._schedule(key, now + self.timeout)
+
+    def touch(self, key):
+        """Ghi nhận hoạt động - gọi cho mỗi gói tin, không lấy lock"""
+        if key in self.last_seen:
+            self.last_seen[key] = time.monotonic()
+
+    def remove(self, key):
+        # Phần tử trong ô sẽ bị bỏ qua khi ô đó đến hạn
+        self.last_seen.pop(key, None)
+
+    def expire(self, now=None):
+        """Trả về các key đã quá timeout kể từ lần hoạt động cuối"""
+        now = time.monotonic() if now is None else now
+        target_tick = int(now / self.tick)
+        expired = []
+        with self.lock:
+            # Trễ hơn một vòng bánh xe thì chỉ cần duyệt mỗi ô một lần
+            start = max(self.current_tick + 1, target_tick - len(self.slots) + 1)
+            for tick_index in range(start, target_tick + 1):
+                slot = self.slots[tick_index % len(self.slots)]
+                if not slot:
+                    continue
+                due = list(slot)
+                slot.clear()
+                for key in due:
+                    last_seen = self.last_seen.get(key)
+                    if last_seen is None:
+                        continue  # đã bị remove()
+                    deadline = last_seen + self.timeout
+                    if deadline <= now:
+                        expired.append(key)
+                    else:
+                        self.current_tick = tick_index
+                        self._schedule(key, deadline)
+            self.current_tick = max(self.current_tick, target_tick)
+        return expired
+
+    def __len__(self):
+        return len(self.last_seen)
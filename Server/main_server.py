@@ -1,11 +1,16 @@
 # Server/main_server.py
+import argparse
+import os
 import signal
 import sys
 import time
 import logging
 
 from .signaling_server import SignalingServer
+from .event_loop_server import EventLoopSignalingServer
+from .sharding import ShardSupervisor
 from shared import config
+from shared import tracing
 
 # Cấu hình logging
 logging.basicConfig(
@@ -16,6 +21,43 @@ logging.basicConfig(
 
 server = None
 
+SERVER_ENGINES = {
+    'threaded': SignalingServer,          # 1 thread cho mỗi client
+    'eventloop': EventLoopSignalingServer,  # selectors, 1 thread cho tất cả client
+}
+
+def _trace_spec(value):
+    """Kiểm tra --trace khi parse tham số: spec sai bị từ chối trước khi được đưa cho worker"""
+    try:
+        tracing.parse_spec(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid trace spec {value!r}: {e}")
+    return value
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="VoiceChat signaling server")
+    parser.add_argument('--engine', choices=sorted(SERVER_ENGINES), default=config.SERVER_ENGINE,
+                        help="Kiểu server: threaded hoặc eventloop (mặc định: %(default)s)")
+    parser.add_argument('--host', default=config.HOST_SERVER_BIND, help="Địa chỉ bind")
+    parser.add_argument('--port', type=int, default=config.PORT_SIGNALING, help="Cổng signaling")
+    parser.add_argument('--media-port', type=int, default=config.PORT_AUDIO, help="Cổng UDP media relay")
+    parser.add_argument('--workers', type=int, default=config.SERVER_WORKERS,
+                        help="Số tiến trình worker (>1: chia phòng theo shard, worker i dùng port+i)")
+    parser.add_argument('--metrics-port', type=int, default=config.METRICS_PORT,
+                        help="Mở endpoint HTTP /metrics (Prometheus) trên cổng này, chỉ localhost "
+                             "(worker i dùng cổng + i)")
+    parser.add_argument('--trace', type=_trace_spec, default=None,
+                        help="Bật trace đường nóng, vd 'server.forward=100,server.*=5/s' (mặc định: tắt)")
+    return parser.parse_args(argv)
+
+def create_server(args):
+    """Tạo server instance theo engine được chọn (hoặc supervisor nếu có nhiều worker)"""
+    if args.workers > 1:
+        return ShardSupervisor(args.workers, args.engine, host=args.host, port=args.port,
+                               media_port=args.media_port, metrics_port=args.metrics_port)
+    return SERVER_ENGINES[args.engine](host=args.host, port=args.port, media_port=args.media_port,
+                                       metrics_port=args.metrics_port)
+
 def signal_handler(sig, frame):
     """Xử lý khi nhấn Ctrl+C hoặc dừng tiến trình"""
     global server
@@ -27,21 +69,23 @@ def signal_handler(sig, frame):
             logging.error(f"Error stopping server: {e}")
     sys.exit(0)
 
-def main():
+def main(argv=None):
     global server
+    args = parse_args(argv)
+    if args.trace is not None:
+        # Qua biến môi trường để các worker (--workers > 1) cũng nhận cấu hình
+        os.environ[tracing.ENV_VAR] = args.trace
+        tracing.configure(args.trace)
     
     # Khởi động signaling server
-    server = SignalingServer(
-        host=config.HOST_SERVER_BIND,
-        port=config.PORT_SIGNALING
-    )
+    server = create_server(args)
 
     # Đăng ký signal handler
     signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C
     signal.signal(signal.SIGTERM, signal_handler)  # Kill process
 
-    logging.info("🚀 Starting Signaling Server...")
-    logging.info(f"📡 Server Address: {config.HOST_SERVER_BIND}:{config.PORT_SIGNALING}")
+    logging.info(f"🚀 Starting Signaling Server (engine: {args.engine}, workers: {args.workers})...")
+    logging.info(f"📡 Server Address: {args.host}:{args.port}")
     logging.info("Press Ctrl+C to stop the server")
 
     # Biến để theo dõi trạng thái server
@@ -72,10 +116,7 @@ def main():
                 except:
                     pass
                     
-                server = SignalingServer(
-                    host=config.HOST_SERVER_BIND,
-                    port=config.PORT_SIGNALING
-                )
+                server = create_server(args)
             else:
                 logging.error("🚨 Maximum restart attempts reached. Server stopped.")
                 break
@@ -0,0 +1,150 @@
+import socket
+import threading
+import logging
+import secrets
+import time
+from shared import config
+from shared.protocol import (FRAME_AUDIO, FRAME_BIND, MEDIA_TOKEN_SIZE, decode_frame,
+                             encode_frame)
+
+
+class UdpMediaRelay:
+    """Media relay qua UDP trên PORT_AUDIO.
+
+    Mỗi client trong phòng được cấp một media token (gửi kèm ROOM_CREATED /
+    JOIN_SUCCESS). Datagram từ client có dạng token | media frame; token gắn
+    datagram với kết nối signaling tương ứng. Relay chỉ gửi UDP cho client đã
+    BIND gần đây, những client còn lại vẫn nhận audio qua TCP.
+    """
+
+    def __init__(self, server, host=config.HOST_SERVER_BIND, port=config.PORT_AUDIO):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.running = False
+        self.thread = None
+
+        self.recv_buffer = bytearray(config.BUFFER_SIZE)  # dùng lại cho mỗi datagram (recvfrom_into)
+        self.recv_view = memoryview(self.recv_buffer)
+
+        self.tokens = {}    # token (bytes) -> signaling socket
+        self.sessions = {}  # signaling socket -> {'token': bytes, 'addr': (ip, port), 'last_seen': float}
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Bind socket UDP (không tạo thread - dùng cho event loop)"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.port = self.sock.getsockname()[1]
+        self.running = True
+        logging.info(f"[MediaRelay] UDP listening on {self.host}:{self.port}")
+
+    def start(self):
+        """Bind và chạy vòng lặp nhận trên thread riêng (server threaded)"""
+        self.open()
+        self.thread = threading.Thread(target=self._serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+        logging.info("[MediaRelay] Stopped")
+
+    def _serve_forever(self):
+        while self.running:
+            try:
+                size, addr = self.sock.recvfrom_into(self.recv_buffer)
+            except OSError as e:
+                if self.running:
+                    logging.error(f"[MediaRelay] Receive error: {e}")
+                break
+            self.handle_datagram(self.recv_view[:size], addr)
+
+    def on_readable(self, max_datagrams=64):
+        """Đọc các datagram đang chờ (socket non-blocking, gọi từ event loop)"""
+        for _ in range(max_datagrams):
+            try:
+                size, addr = self.sock.recvfrom_into(self.recv_buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.running:
+                    logging.error(f"[MediaRelay] Receive error: {e}")
+                return
+            self.handle_datagram(self.recv_view[:size], addr)
+
+    def handle_datagram(self, data, addr):
+        """Xử lý một datagram; payload là memoryview của data, chỉ dùng trong lần gọi này"""
+        token = bytes(data[:MEDIA_TOKEN_SIZE])
+        frame = decode_frame(memoryview(data)[MEDIA_TOKEN_SIZE:], copy=False)
+        if frame is None:
+            return
+
+        with self.lock:
+            client_sock = self.tokens.get(token)
+            if client_sock is None:
+                return
+            session = self.sessions[client_sock]
+            if session['addr'] != addr:
+                logging.info(f"[MediaRelay] Session bound to {addr}")
+            session['addr'] = addr
+            session['last_seen'] = time.time()
+
+        # Mỗi datagram cũng là hoạt động của client (không bị timeout)
+        self.server.idle_tracker.touch(client_sock)
+        self.server.metrics.bytes_in.inc(len(data), 'udp')
+
+        if frame.type == FRAME_BIND:
+            client_info = self.server.clients.get(client_sock) or {}
+            self.send_to(addr, encode_frame(b"", seq=frame.seq, frame_type=FRAME_BIND,
+                                            version=client_info.get('framing') or 1))
+        elif frame.type == FRAME_AUDIO:
+            self.server.metrics.frames_in.inc(1, 'udp')
+            self.server._forward_audio(client_sock, pcm=frame.payload, seq=frame.seq,
+                                      timestamp=frame.timestamp, flags=frame.flags)
+
+    def issue_token(self, client_sock):
+        """Cấp media token mới cho kết nối signaling (thay token cũ nếu có)"""
+        token = secrets.token_bytes(MEDIA_TOKEN_SIZE)
+        with self.lock:
+            old = self.sessions.get(client_sock)
+            if old:
+                self.tokens.pop(old['token'], None)
+            self.tokens[token] = client_sock
+            self.sessions[client_sock] = {'token': token, 'addr': None, 'last_seen': 0.0}
+        return token.hex()
+
+    def revoke(self, client_sock):
+        with self.lock:
+            session = self.sessions.pop(client_sock, None)
+            if session:
+                self.tokens.pop(session['token'], None)
+
+    def address_of(self, client_sock):
+        """Địa chỉ UDP còn sống của client, None nếu phải dùng TCP"""
+        session = self.sessions.get(client_sock)
+        if not session or not session['addr']:
+            return None
+        if time.time() - session['last_seen'] > config.UDP_SESSION_TIMEOUT:
+            return None
+        return session['addr']
+
+    def send_to(self, addr, data):
+        metrics = self.server.metrics
+        try:
+            self.sock.sendto(data, addr)
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError as e:
+            logging.debug(f"[MediaRelay] Send error to {addr}: {e}")
+            metrics.send_errors.inc()
+            return False
+        metrics.frames_out.inc(1, 'udp')
+        metrics.bytes_out.inc(len(data), 'udp')
+        return True
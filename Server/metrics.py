@@ -0,0 +1,177 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from shared import config
+
+# Mốc histogram (giây) cho thời gian fan-out một frame
+FANOUT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+ROOM_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 32, 64)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    """Bộ đếm tăng dần, có thể chia theo một label.
+
+    inc() không lấy lock (một phép cộng trên dict): đủ rẻ để gọi cho mỗi gói tin.
+    Trên server threaded hai thread cùng tăng một lúc có thể làm mất vài lần
+    đếm - chấp nhận được cho metrics.
+    """
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = {None: 0} if label is None else {}
+
+    def inc(self, amount=1, label_value=None):
+        values = self.values
+        values[label_value] = values.get(label_value, 0) + amount
+
+    def value(self, label_value=None):
+        return self.values.get(label_value, 0)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            labels = () if label_value is None else ((self.label, label_value),)
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histogram với các mốc cố định (bucket đếm riêng, cộng dồn khi xuất)"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # ô cuối: > mốc lớn nhất
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def expose(self):
+        return _expose_histogram(self.name, self.help, self.buckets, self.counts, self.sum, self.count)
+
+
+def _expose_histogram(name, help_text, buckets, counts, total, count):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{le="+Inf"}} {count}')
+    lines.append(f"{name}_sum {total}")
+    lines.append(f"{name}_count {count}")
+    return lines
+
+
+def _gauge(name, help_text, value):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+
+class ServerMetrics:
+    """Metrics của một SignalingServer (định dạng text của Prometheus).
+
+    Bộ đếm được tăng trực tiếp trên đường xử lý; các giá trị trạng thái
+    (kết nối, phòng, độ sâu hàng đợi) chỉ được đọc khi có request /metrics.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.connections_total = Counter("voicechat_connections_total", "TCP connections accepted")
+        self.disconnects_total = Counter("voicechat_disconnects_total", "Clients removed")
+        self.messages_in = Counter("voicechat_messages_in_total", "Control messages received", label="type")
+        self.messages_out = Counter("voicechat_messages_out_total", "Control messages queued for sending")
+        self.frames_in = Counter("voicechat_frames_in_total", "Audio frames received", label="transport")
+        self.frames_out = Counter("voicechat_frames_out_total", "Audio frames sent", label="transport")
+        self.bytes_in = Counter("voicechat_bytes_in_total", "Bytes received", label="transport")
+        self.bytes_out = Counter("voicechat_bytes_out_total", "Bytes queued or sent", label="transport")
+        self.send_errors = Counter("voicechat_send_errors_total", "Socket send errors")
+        self.send_calls = Counter("voicechat_send_calls_total", "TCP send system calls (sendmsg batches)")
+        self.overflow_disconnects = Counter("voicechat_overflow_disconnects_total",
+                                            "Clients disconnected because their send queue overflowed")
+        self.timeout_evictions = Counter("voicechat_timeout_evictions_total", "Clients removed for inactivity")
+        self.closed_queue_drops = 0  # frame bị bỏ của các client đã ngắt kết nối
+        self.fanout_seconds = Histogram("voicechat_fanout_seconds", "Time to fan out one audio frame",
+                                        FANOUT_BUCKETS)
+        self.http_server = None
+
+    def record_queue_closed(self, send_queue):
+        self.closed_queue_drops += send_queue.dropped
+
+    def expose(self):
+        server = self.server
+        rooms = list(server.rooms.values())
+        queues = list(server.send_queues.values())
+        depths = [len(send_queue) for send_queue in queues]
+
+        room_counts = [0] * (len(ROOM_SIZE_BUCKETS) + 1)
+        members = 0
+        for room in rooms:
+            size = len(room)
+            members += size
+            room_counts[bisect.bisect_left(ROOM_SIZE_BUCKETS, size)] += 1
+
+        lines = []
+        lines += _gauge("voicechat_active_connections", "Open client connections", len(queues))
+        lines += _gauge("voicechat_registered_clients", "Registered users",
+                        sum(1 for info in list(server.clients.values()) if info))
+        lines += _gauge("voicechat_rooms", "Active rooms", len(rooms))
+        lines += _expose_histogram("voicechat_room_size", "Members per active room", ROOM_SIZE_BUCKETS,
+                                   room_counts, members, len(rooms))
+        lines += _gauge("voicechat_send_queue_depth", "Messages waiting in all send queues", sum(depths))
+        lines += _gauge("voicechat_send_queue_depth_max", "Deepest client send queue", max(depths, default=0))
+        lines += ["# HELP voicechat_send_queue_dropped_total Media frames dropped from full send queues",
+                  "# TYPE voicechat_send_queue_dropped_total counter",
+                  f"voicechat_send_queue_dropped_total "
+                  f"{self.closed_queue_drops + sum(send_queue.dropped for send_queue in queues)}"]
+        for metric in (self.connections_total, self.disconnects_total, self.messages_in, self.messages_out,
+                       self.frames_in, self.frames_out, self.bytes_in, self.bytes_out, self.send_errors,
+                       self.send_calls, self.overflow_disconnects, self.timeout_evictions, self.fanout_seconds):
+            lines += metric.expose()
+        return "\n".join(lines) + "\n"
+
+    def start_http(self, host=config.METRICS_HOST, port=config.METRICS_PORT):
+        """Mở endpoint HTTP /metrics trên thread riêng (chỉ nên bind localhost)"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.expose().encode(config.ENCODING)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # không ghi log cho mỗi lần scrape
+
+        try:
+            self.http_server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            logging.warning(f"[Metrics] Cannot listen on {host}:{port}: {e}")
+            return
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        logging.info(f"[Metrics] Serving http://{host}:{self.http_server.server_port}/metrics")
+
+    def stop_http(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
@@ -0,0 +1,131 @@
+import threading
+import logging
+import time
+from collections import deque
+from shared import config
+
+try:
+    import numpy as np
+except ImportError:  # numpy chỉ cần cho phòng chế độ mix
+    np = None
+
+MIXER_AVAILABLE = np is not None
+
+
+class RoomMixer:
+    """Trộn âm phía server (MCU) cho một phòng.
+
+    Mỗi người nói có một hàng đợi frame PCM ngắn. Mỗi tick (AUDIO_CHUNK mẫu)
+    lấy tối đa một frame của mỗi người nói, cộng tất cả lại một lần rồi trừ đi
+    phần của chính người nghe -> mỗi người nghe nhận đúng một frame mỗi tick
+    ("mọi người trừ tôi"), downlink O(N) thay vì O(N²).
+    """
+
+    def __init__(self, samples=config.AUDIO_CHUNK, max_buffered=config.MIXER_MAX_BUFFERED):
+        if not MIXER_AVAILABLE:
+            raise RuntimeError("numpy is required for mix mode")
+        self.samples = samples
+        self.max_buffered = max_buffered
+        self.inputs = {}  # sock -> deque[np.ndarray int16]
+        self.lock = threading.Lock()
+        self.seq = 0
+
+    def push(self, sock, pcm):
+        """Nhận một frame PCM int16 từ người nói"""
+        # pcm có thể là memoryview trỏ vào buffer nhận (được dùng lại): phải sao chép khi lưu
+        frame = np.frombuffer(pcm, dtype=np.int16).copy()
+        if len(frame) != self.samples:
+            fixed = np.zeros(self.samples, dtype=np.int16)
+            n = min(len(frame), self.samples)
+            fixed[:n] = frame[:n]
+            frame = fixed
+        with self.lock:
+            queue = self.inputs.get(sock)
+            if queue is None:
+                queue = self.inputs[sock] = deque(maxlen=self.max_buffered)
+            queue.append(frame)  # đầy thì deque tự bỏ frame cũ nhất
+
+    def remove(self, sock):
+        with self.lock:
+            self.inputs.pop(sock, None)
+
+    def mix(self, listeners):
+        """Trộn một tick. Trả về list (sock, pcm_bytes) cho từng người nghe cần gửi."""
+        with self.lock:
+            speakers = []
+            frames = []
+            for sock, queue in self.inputs.items():
+                if queue:
+                    speakers.append(sock)
+                    frames.append(queue.popleft())
+        if not speakers:
+            return []
+
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        stacked = np.stack(frames).astype(np.int32)      # (speakers, samples)
+        total = stacked.sum(axis=0)                        # tổng của mọi người nói
+
+        listeners = list(listeners)
+        out = np.broadcast_to(total, (len(listeners), self.samples)).copy()
+        index = {sock: i for i, sock in enumerate(listeners)}
+        rows = [index[s] for s in speakers if s in index]
+        own = [k for k, s in enumerate(speakers) if s in index]
+        if rows:
+            out[rows] -= stacked[own]                      # bỏ tiếng của chính người nghe
+        np.clip(out, -32768, 32767, out=out)
+        mixed = out.astype(np.int16)
+
+        results = []
+        lone_speaker = speakers[0] if len(speakers) == 1 else None
+        for i, sock in enumerate(listeners):
+            if sock is lone_speaker:
+                continue  # chỉ có mình đang nói: không có gì để nghe
+            results.append((sock, mixed[i].tobytes()))
+        return results
+
+
+class MixerClock:
+    """Nhịp cố định AUDIO_CHUNK / AUDIO_RATE (16 ms) cho tất cả phòng mix.
+
+    Server threaded chạy clock trên thread riêng (start()); event loop gọi
+    run_due() trong vòng lặp và dùng time_until_next() làm timeout của select.
+    """
+
+    def __init__(self, on_tick, period=config.AUDIO_CHUNK / config.AUDIO_RATE):
+        self.on_tick = on_tick
+        self.period = period
+        self.next_tick = time.monotonic() + period
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.next_tick = time.monotonic() + self.period
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        while self.running:
+            delay = self.time_until_next()
+            if delay > 0:
+                time.sleep(delay)
+            self.run_due()
+
+    def time_until_next(self):
+        return max(0.0, self.next_tick - time.monotonic())
+
+    def run_due(self):
+        """Chạy các tick đã đến hạn; nếu trễ quá xa thì đặt lại nhịp thay vì chạy bù"""
+        now = time.monotonic()
+        if now < self.next_tick:
+            return
+        if now - self.next_tick > 5 * self.period:
+            self.next_tick = now
+        self.next_tick += self.period
+        try:
+            self.on_tick()
+        except Exception as e:
+            logging.error(f"[Mixer] Tick error: {e}")
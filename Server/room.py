@@ -0,0 +1,50 @@
+import threading
+
+
+class Room:
+    """Trạng thái của một phòng, có lock riêng.
+
+    sockets / users là tuple bất biến, được thay mới mỗi lần JOIN/LEAVE (giữ
+    room.lock). Luồng chuyển tiếp audio chỉ đọc snapshot hiện tại nên không cần
+    lock nào, và phòng này không phải chờ phòng khác.
+    """
+
+    def __init__(self, room_id, password='', mode='forward', mixer=None, speaker_selector=None):
+        self.room_id = room_id
+        self.password = password
+        self.mode = mode      # 'forward': chuyển tiếp từng người nói, 'mix': server trộn âm
+        self.mixer = mixer    # RoomMixer khi mode == 'mix'
+        self.speaker_selector = speaker_selector  # ActiveSpeakerSelector khi giới hạn số người nói
+        self.codec = 'pcm'    # codec audio chung của phòng (ROOM_CODEC)
+        self.comfort_noise = False  # mọi thành viên nhận được gói comfort noise (DTX)
+        self.lock = threading.Lock()
+        self.sockets = ()
+        self.users = ()
+        self.closed = False  # phòng đã rỗng và đang bị xóa, không nhận thêm ai
+
+    def add(self, sock, username):
+        """Thêm thành viên, trả về False nếu phòng đã đóng"""
+        with self.lock:
+            if self.closed:
+                return False
+            if sock not in self.sockets:
+                self.sockets = self.sockets + (sock,)
+                self.users = self.users + (username,)
+            return True
+
+    def remove(self, sock, username):
+        """Xóa thành viên, trả về True nếu sock có trong phòng. Phòng rỗng sẽ bị đóng."""
+        with self.lock:
+            if sock not in self.sockets:
+                return False
+            self.sockets = tuple(s for s in self.sockets if s is not sock)
+            users = list(self.users)
+            if username in users:
+                users.remove(username)
+            self.users = tuple(users)
+            if not self.sockets:
+                self.closed = True
+            return True
+
+    def __len__(self):
+        return len(self.sockets)
@@ -0,0 +1,162 @@
+import socket
+import threading
+import time
+from collections import deque
+from shared import config
+
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')  # Windows không có sendmsg / writev
+
+
+def send_buffers(sock, buffers):
+    """Một lần gọi hệ thống cho cả danh sách buffer, trả về số byte đã gửi"""
+    if HAS_SENDMSG:
+        return sock.sendmsg(buffers)
+    return sock.send(b"".join(buffers))
+
+
+def advance_buffers(buffers, sent):
+    """Bỏ sent byte đầu của danh sách buffer (gửi dở), trả về phần còn lại (memoryview)"""
+    for i, buffer in enumerate(buffers):
+        size = len(buffer)
+        if sent < size:
+            rest = [memoryview(buffer)[sent:]] if sent else [buffer]
+            return rest + buffers[i + 1:]
+        sent -= size
+    return []
+
+
+def sendall_buffers(sock, buffers):
+    """Gửi hết danh sách buffer (socket blocking), trả về số lần gọi hệ thống"""
+    calls = 0
+    while buffers:
+        sent = send_buffers(sock, buffers)
+        calls += 1
+        buffers = advance_buffers(buffers, sent)
+    return calls
+
+
+class SendQueue:
+    """Hàng đợi gửi có giới hạn cho một client.
+
+    - Control message (JSON) không bao giờ bị bỏ và luôn được gửi trước.
+    - Media frame: khi đầy thì bỏ frame cũ nhất (drop-oldest).
+    - Nếu tràn kéo dài quá overflow_disconnect giây (hoặc control vượt giới hạn),
+      put() trả về False để server ngắt kết nối client chậm.
+    """
+
+    def __init__(self, max_media=config.SEND_QUEUE_MAX_MEDIA,
+                 max_control=config.SEND_QUEUE_MAX_CONTROL,
+                 overflow_disconnect=config.SEND_QUEUE_OVERFLOW_DISCONNECT):
+        self.max_media = max_media
+        self.max_control = max_control
+        self.overflow_disconnect = overflow_disconnect
+
+        self.control = deque()
+        self.media = deque()
+        self.cond = threading.Condition(threading.Lock())
+        self.closed = False
+
+        self.dropped = 0            # tổng số frame media bị bỏ
+        self.sent = 0               # tổng số message đã lấy ra để gửi
+        self.overflow_since = None  # thời điểm bắt đầu đợt tràn hiện tại
+
+    def put(self, data, media=False):
+        """Thêm dữ liệu vào hàng đợi. Trả về False nếu client nên bị ngắt kết nối."""
+        with self.cond:
+            if self.closed:
+                return True
+            if media:
+                if len(self.media) >= self.max_media:
+                    self.media.popleft()
+                    self.dropped += 1
+                    if self.overflow_since is None:
+                        self.overflow_since = time.time()
+                    elif time.time() - self.overflow_since > self.overflow_disconnect:
+                        return False
+                self.media.append(data)
+            else:
+                if len(self.control) >= self.max_control:
+                    return False
+                self.control.append(data)
+            # Chỉ đánh thức writer khi có message đầu tiên hoặc đã đủ một batch:
+            # trong lúc writer đang gom (linger) không cần đánh thức cho từng frame
+            queued = len(self.control) + len(self.media)
+            if queued == 1 or queued >= config.SEND_COALESCE_MAX_FRAMES:
+                self.cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        """Lấy message tiếp theo (chặn tối đa timeout giây), None nếu hết hạn hoặc đã đóng"""
+        with self.cond:
+            if not self.control and not self.media and not self.closed:
+                self.cond.wait(timeout)
+            return self._pop()
+
+    def get_nowait(self):
+        with self.cond:
+            return self._pop()
+
+    def get_batch(self, max_items, timeout=None, linger=0.0):
+        """Lấy tối đa max_items message để gửi bằng một sendmsg.
+
+        Chờ tối đa timeout giây cho message đầu tiên, sau đó chờ thêm tối đa
+        linger giây (độ trễ thêm tối đa) để gom các frame đến ngay sau đó.
+        Trả về list rỗng nếu hết hạn hoặc đã đóng.
+        """
+        with self.cond:
+            if not self.control and not self.media and not self.closed:
+                self.cond.wait(timeout)
+            if linger > 0 and 0 < len(self) < max_items:
+                deadline = time.monotonic() + linger
+                while not self.closed and len(self) < max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+            return self._pop_batch(max_items)
+
+    def get_batch_nowait(self, max_items):
+        with self.cond:
+            return self._pop_batch(max_items)
+
+    def _pop_batch(self, max_items):
+        batch = []
+        while len(batch) < max_items:
+            data = self._pop()
+            if data is None:
+                break
+            batch.append(data)
+        return batch
+
+    def _pop(self):
+        if self.control:
+            data = self.control.popleft()
+        elif self.media:
+            data = self.media.popleft()
+        else:
+            return None
+        self.sent += 1
+        # Đã xả bớt xuống dưới một nửa: kết thúc đợt tràn
+        if self.overflow_since is not None and len(self.media) <= self.max_media // 2:
+            self.overflow_since = None
+        return data
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.control.clear()
+            self.media.clear()
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.control) + len(self.media)
+
+    def stats(self):
+        return {
+            'queue_depth': len(self),
+            'media_depth': len(self.media),
+            'control_depth': len(self.control),
+            'dropped': self.dropped,
+            'sent': self.sent,
+            'overflowing': self.overflow_since is not None,
+        }
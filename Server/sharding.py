@@ -0,0 +1,121 @@
+import itertools
+import logging
+import multiprocessing
+import re
+import signal
+import time
+from collections import namedtuple
+from shared import config
+
+# Worker i lắng nghe TCP trên port + i và UDP media trên media_port + i
+# (TCP và UDP là hai không gian cổng riêng nên không đụng nhau).
+ShardInfo = namedtuple('ShardInfo', ['index', 'count', 'base_port', 'base_media_port'])
+
+_ROOM_SHARD_RE = re.compile(r"^room_s(\d+)_")
+
+
+def make_room_id(shard, counter):
+    """Mã phòng có ghi shard sở hữu (room_s<shard>_<time>_<n>)"""
+    if shard is None:
+        return f"room_{int(time.time())}_{counter}"
+    return f"room_s{shard.index}_{int(time.time())}_{counter}"
+
+
+def shard_of_room(room_id):
+    """Shard sở hữu phòng theo mã phòng, None nếu mã phòng không có shard"""
+    match = _ROOM_SHARD_RE.match(room_id or "")
+    return int(match.group(1)) if match else None
+
+
+def shard_port(shard, index):
+    return shard.base_port + index
+
+
+class ShardRouter:
+    """Chọn shard cho phòng mới (round-robin) trong một worker"""
+
+    def __init__(self, shard):
+        self.shard = shard
+        self._counter = itertools.cycle(range(shard.count))
+
+    def pick_shard_for_new_room(self):
+        return next(self._counter)
+
+
+def _run_worker(index, count, engine, host, port, media_port, metrics_port=None):
+    """Tiến trình worker: một SignalingServer sở hữu các phòng của shard index"""
+    from .main_server import SERVER_ENGINES
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'[%(asctime)s] [shard {index}] [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        force=True
+    )
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # supervisor xử lý Ctrl+C
+
+    shard = ShardInfo(index, count, port, media_port)
+    server = SERVER_ENGINES[engine](host=host, port=port + index, media_port=media_port + index, shard=shard,
+                                    metrics_port=None if metrics_port is None else metrics_port + index)
+    signal.signal(signal.SIGTERM, lambda *_: server.stop())
+    try:
+        server.start()
+    finally:
+        server.stop()
+
+
+class ShardSupervisor:
+    """Chạy N tiến trình worker, mỗi phòng được gắn cố định vào một worker.
+
+    Client kết nối tới worker 0 (cổng signaling mặc định). CREATE_ROOM được chia
+    round-robin giữa các worker, JOIN_ROOM đi tới worker ghi trong mã phòng; khi
+    worker hiện tại không sở hữu phòng, nó trả REDIRECT để client kết nối lại.
+    """
+
+    def __init__(self, workers, engine, host=config.HOST_SERVER_BIND,
+                 port=config.PORT_SIGNALING, media_port=config.PORT_AUDIO, metrics_port=config.METRICS_PORT):
+        self.workers = workers
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.media_port = media_port
+        self.metrics_port = metrics_port  # worker i: metrics_port + i
+        self.processes = {}
+        self.running = False
+
+    def _spawn(self, index):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(index, self.workers, self.engine, self.host, self.port, self.media_port, self.metrics_port),
+            name=f"shard-{index}",
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        logging.info(f"[Supervisor] Shard {index} started (pid {process.pid}, "
+                     f"tcp {self.port + index}, udp {self.media_port + index})")
+
+    def start(self):
+        self.running = True
+        for index in range(self.workers):
+            self._spawn(index)
+
+        # Theo dõi và khởi động lại worker bị crash
+        while self.running:
+            time.sleep(1.0)
+            for index, process in list(self.processes.items()):
+                if not process.is_alive() and self.running:
+                    logging.error(f"[Supervisor] Shard {index} exited ({process.exitcode}), restarting")
+                    self._spawn(index)
+
+    def stop(self):
+        self.running = False
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=5.0)
+        logging.info("[Supervisor] Stopped")
+
+    def is_running(self):
+        return self.running
@@ -1,27 +1,71 @@
 import socket
 import threading
-import json
 import logging
 import base64
 import time
 from shared import config
+from .media_relay import UdpMediaRelay
+from .room import Room
+from .mixer import MIXER_AVAILABLE, MixerClock, RoomMixer
+from .sharding import ShardRouter, make_room_id, shard_of_room, shard_port
+from .send_queue import SendQueue, sendall_buffers
+from .idle_tracker import IdleTracker
+from .metrics import ServerMetrics
+from .active_speakers import ActiveSpeakerSelector
+from shared.protocol import (CODEC_CN, CODEC_IDS, CODEC_NAMES, CODEC_PCM, FLAG_CODEC_MASK, FRAME_AUDIO,
+                             MIXER_NAME, MIXER_SENDER_ID, FrameDecoder, MediaFrame, encode_frame, encode_json,
+                             media_timestamp, negotiate_codec, negotiate_frame_version, parse_codecs)
+from shared import tracing
 
 logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(message)s")
 
+# Trace đường nóng (tắt mặc định, xem shared/tracing.py)
+TRACE_MESSAGE = tracing.tracepoint("server.message")   # mỗi control message nhận được
+TRACE_FORWARD = tracing.tracepoint("server.forward")   # mỗi gói audio được chuyển tiếp
+
+# Loại message được đếm riêng trong metrics (còn lại gộp vào 'other' để số label có giới hạn)
+KNOWN_MESSAGE_TYPES = frozenset({'REGISTER', 'CREATE_ROOM', 'JOIN_ROOM', 'AUDIO_DATA', 'LEAVE_ROOM',
+                                 'GOODBYE', 'PING'})
+
 class SignalingServer:
-    def __init__(self, host=config.HOST_SERVER_BIND, port=config.PORT_SIGNALING):
+    def __init__(self, host=config.HOST_SERVER_BIND, port=config.PORT_SIGNALING, media_port=config.PORT_AUDIO,
+                 shard=None, metrics_port=config.METRICS_PORT):
         self.host = host
         self.port = port
+
+        # Chế độ nhiều tiến trình: worker này chỉ sở hữu các phòng của shard.index
+        self.shard = shard
+        self.shard_router = ShardRouter(shard) if shard else None
         self.server_socket = None
         self.running = False
         
         # Quản lý clients và rooms
-        self.clients = {}  # sock -> {'username': '', 'room': ''}
-        self.rooms = {}    # room_id -> {'sockets': [], 'password': '', 'users': []}
-        self.lock = threading.Lock()
+        self.clients = {}  # sock -> {'username': '', 'room': '', 'user_id': 0, 'framing': None}
+        self.rooms = {}    # room_id -> Room (mỗi phòng có lock riêng)
+        # Lock toàn cục chỉ bảo vệ bảng clients / rooms, không giữ khi gửi dữ liệu.
+        # RLock: _allocate_user_id() được gọi khi REGISTER đang giữ lock
+        self.lock = threading.RLock()
         
         # Client timeout management
-        self.client_timeouts = {}  # sock -> last activity time
+        self.idle_tracker = IdleTracker()  # sock -> lần hoạt động cuối (timing wheel)
+        self._last_stats_log = time.monotonic()
+
+        # Hàng đợi gửi có giới hạn của từng client (drop-oldest cho audio)
+        self.send_queues = {}  # sock -> SendQueue
+
+        # user_id dùng làm sender_id trong media frame (1..65535, 0 = server)
+        self._next_user_id = 1
+
+        # UDP media relay (None = chỉ dùng TCP)
+        self.media_relay = UdpMediaRelay(self, host, media_port) if config.UDP_MEDIA_ENABLED else None
+
+        # Phòng chế độ mix và nhịp trộn 16 ms dùng chung
+        self.mix_rooms = {}  # room_id -> Room
+        self.mixer_clock = MixerClock(self._on_mix_tick) if MIXER_AVAILABLE else None
+
+        # Bộ đếm luôn bật (rẻ); endpoint HTTP chỉ mở khi có metrics_port
+        self.metrics = ServerMetrics(self)
+        self.metrics_port = metrics_port
 
     def start(self):
         self.running = True
@@ -33,6 +77,9 @@ class SignalingServer:
         # Bắt đầu thread quản lý timeout
         timeout_thread = threading.Thread(target=self._check_timeouts, daemon=True)
         timeout_thread.start()
+
+        self._start_media_relay(threaded=True)
+        self._start_metrics()
         
         logging.info(f"[SignalingServer] Listening on {self.host}:{self.port}")
         logging.info(f"[SignalingServer] Clients will connect to: {config.HOST_CLIENT_CONNECT}:{config.PORT_SIGNALING}")
@@ -42,36 +89,84 @@ class SignalingServer:
                 client_socket, addr = self.server_socket.accept()
                 client_socket.settimeout(config.SOCKET_TIMEOUT)
                 logging.info(f"[SignalingServer] New connection from {addr}")
+                self.metrics.connections_total.inc()
                 
                 # Lưu thời gian kết nối
+                send_queue = SendQueue()
                 with self.lock:
-                    self.client_timeouts[client_socket] = time.time()
+                    self.send_queues[client_socket] = send_queue
+                self.idle_tracker.add(client_socket)
                 
                 threading.Thread(target=self.handle_client, args=(client_socket,), daemon=True).start()
+                threading.Thread(target=self._writer_loop, args=(client_socket, send_queue), daemon=True).start()
             except Exception as e:
                 if self.running:
                     logging.error(f"[SignalingServer] Accept error: {e}")
 
     def _check_timeouts(self):
-        """Kiểm tra timeout của clients"""
+        """Kiểm tra timeout của clients mỗi tick của timing wheel"""
         while self.running:
             try:
-                time.sleep(30)
-                current_time = time.time()
-                clients_to_remove = []
-                
-                with self.lock:
-                    for sock, last_activity in list(self.client_timeouts.items()):
-                        if current_time - last_activity > 120:  # 2 phút không hoạt động
-                            clients_to_remove.append(sock)
-                    
-                    for sock in clients_to_remove:
-                        logging.info(f"[SignalingServer] Client timeout, removing")
-                        self.remove_client(sock)
-                        
+                time.sleep(self.idle_tracker.tick)
+                self._run_periodic_checks()
             except Exception as e:
                 logging.error(f"[SignalingServer] Timeout check error: {e}")
 
+    def _run_periodic_checks(self):
+        self._evict_idle_clients()
+        self._expire_active_speakers()
+        now = time.monotonic()
+        if now - self._last_stats_log >= config.QUEUE_STATS_LOG_INTERVAL:
+            self._last_stats_log = now
+            self._log_queue_stats()
+
+    def _evict_idle_clients(self):
+        """Xóa các client không hoạt động quá CLIENT_IDLE_TIMEOUT (chỉ duyệt các ô đến hạn)"""
+        for sock in self.idle_tracker.expire():
+            logging.info("[SignalingServer] Client timeout, removing")
+            self.metrics.timeout_evictions.inc()
+            self.remove_client(sock)
+
+    def _expire_active_speakers(self):
+        """Cập nhật tập người nói của các phòng mà người nói đã ngừng gửi audio"""
+        for room in list(self.rooms.values()):
+            if room.speaker_selector:
+                snapshot = room.speaker_selector.expire()
+                if snapshot:
+                    self._broadcast_active_speakers(room, snapshot)
+
+    def _log_queue_stats(self):
+        """Ghi log các client có hàng đợi gửi bị tràn"""
+        for stats in self.get_client_stats():
+            if stats['dropped'] or stats['overflowing']:
+                logging.warning(f"[SignalingServer] Slow client {stats['username']}: "
+                                f"queue {stats['queue_depth']}, dropped {stats['dropped']}")
+
+    def get_client_stats(self):
+        """Độ sâu hàng đợi gửi và số frame bị bỏ của từng client"""
+        stats = []
+        for sock, send_queue in list(self.send_queues.items()):
+            info = self.clients.get(sock) or {}
+            stats.append({'username': info.get('username'), 'room': info.get('room'), **send_queue.stats()})
+        return stats
+
+    def _start_media_relay(self, threaded):
+        """Mở UDP relay; nếu không bind được thì chạy tiếp chỉ với TCP"""
+        if not self.media_relay:
+            return
+        try:
+            if threaded:
+                self.media_relay.start()
+            else:
+                self.media_relay.open()
+        except OSError as e:
+            logging.warning(f"[SignalingServer] UDP media relay disabled, using TCP only: {e}")
+            self.media_relay = None
+
+    def _start_metrics(self):
+        if self.metrics_port is not None:
+            self.metrics.start_http(config.METRICS_HOST, self.metrics_port)
+
     def stop(self):
         self.running = False
         if self.server_socket:
@@ -79,39 +174,27 @@ class SignalingServer:
                 self.server_socket.close()
             except Exception:
                 pass
+        if self.media_relay:
+            self.media_relay.stop()
+        if self.mixer_clock:
+            self.mixer_clock.stop()
+        self.metrics.stop_http()
         logging.info("[SignalingServer] Stopped")
 
     def handle_client(self, sock):
-        buffer = ""
+        # Buffer nhận dùng lại; payload audio là memoryview trỏ vào buffer (không sao chép)
+        decoder = FrameDecoder(copy_payload=False)
         try:
             while self.running:
                 try:
-                    data = sock.recv(config.BUFFER_SIZE)
-                    if not data:
+                    received = decoder.recv_into(sock)
+                    if not received:
                         break
 
-                    # Cập nhật thời gian hoạt động
-                    with self.lock:
-                        self.client_timeouts[sock] = time.time()
+                    # Cập nhật thời gian hoạt động (không lấy lock)
+                    self.idle_tracker.touch(sock)
 
-                    # Ghép buffer và tách theo delimiter \n
-                    buffer += data.decode(config.ENCODING)
-                    lines = buffer.split("\n")
-                    
-                    # Giữ lại phần chưa xử lý cho lần sau
-                    buffer = lines.pop() if lines else ""
-                    
-                    for line in lines:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            message = json.loads(line)
-                            logging.info(f"[ServerDebug] Received: {message.get('type')} from socket {sock.fileno()}")
-                            self.process_message(sock, message)
-                        except json.JSONDecodeError as e:
-                            logging.warning(f"[SignalingServer] Invalid JSON: {e}, data: {line}")
-                            continue
+                    self._process_data(sock, decoder, received)
 
                 except socket.timeout:
                     continue
@@ -121,33 +204,79 @@ class SignalingServer:
         finally:
             self.remove_client(sock)
 
+    def _process_data(self, sock, decoder, received):
+        """Tách dữ liệu vừa nhận vào buffer của decoder thành control message (JSON) / media frame và xử lý.
+
+        Payload của media frame chỉ hợp lệ trong lần gọi này (buffer được dùng lại).
+        """
+        self.metrics.bytes_in.inc(received, 'tcp')
+        for message in decoder.messages():
+            if isinstance(message, MediaFrame):
+                self.process_media_frame(sock, message)
+            else:
+                if TRACE_MESSAGE.enabled and TRACE_MESSAGE.sampled():
+                    TRACE_MESSAGE.emit(type=message.get('type'), fd=sock.fileno())
+                self.process_message(sock, message)
+
     def process_message(self, sock, message):
         """Xử lý message từ client"""
         msg_type = message.get('type')
-        with self.lock:
-            client_info = self.clients.get(sock, {'username': None, 'room': None})
+        client_info = self.clients.get(sock, {'username': None, 'room': None})
+        self.metrics.messages_in.inc(1, msg_type if msg_type in KNOWN_MESSAGE_TYPES else 'other')
 
         if msg_type == 'REGISTER':
             username = message.get('username')
             logging.info(f"[ServerDebug] REGISTER attempt: {username}")
             
-            if username and username not in [info['username'] for info in self.clients.values() if info]:
-                self.clients[sock] = {'username': username, 'room': None}
-                self.send_response(sock, {'type': 'REGISTER_SUCCESS'})
-                logging.info(f"[SignalingServer] Registered user: {username}")
+            with self.lock:
+                registered = bool(username) and username not in [info['username'] for info in self.clients.values() if info]
+                if registered:
+                    framing = negotiate_frame_version(message.get('frame_versions'))
+                    # Client cũ (JSON, hoặc không khai báo codecs) chỉ hiểu PCM
+                    codecs = parse_codecs(message.get('codecs') if framing else None)
+                    user_id = self._allocate_user_id()
+                    self.clients[sock] = {'username': username, 'room': None, 'user_id': user_id, 'framing': framing,
+                                          'codecs': codecs}
+
+            if registered:
+                self.send_response(sock, {'type': 'REGISTER_SUCCESS', 'user_id': user_id, 'framing': framing,
+                                          'codecs': sorted(codecs)})
+                logging.info(f"[SignalingServer] Registered user: {username} (id {user_id}, framing {framing}, "
+                             f"codecs {sorted(codecs)})")
             else:
                 self.send_response(sock, {'type': 'REGISTER_FAIL', 'message': 'Username already taken or invalid'})
                 logging.warning(f"[SignalingServer] Registration failed for: {username}")
 
         elif msg_type == 'CREATE_ROOM':
-            if not client_info['room']:
-                room_id = f"room_{int(time.time())}_{len(self.rooms)}"
+            target_shard = self._shard_for_new_room(message)
+            if target_shard is not None and client_info['username'] and not client_info['room']:
+                self._redirect(sock, target_shard, {**message, 'shard': target_shard})
+            elif client_info['username'] and not client_info['room']:
                 password = message.get('password', '')
-                self.rooms[room_id] = {'sockets': [sock], 'password': password, 'users': [client_info['username']]}
-                self.clients[sock]['room'] = room_id
-                self.send_response(sock, {'type': 'ROOM_CREATED', 'room_id': room_id})
-                logging.info(f"[SignalingServer] Created room {room_id} by {client_info['username']}")
-                logging.info(f"[ServerDebug] Room {room_id} users: {self.rooms[room_id]['users']}")
+                mode = message.get('mode', 'forward')
+                if mode == 'mix' and not MIXER_AVAILABLE:
+                    logging.warning("[SignalingServer] Mix mode requires numpy, creating forward room")
+                    mode = 'forward'
+                elif mode not in ('forward', 'mix'):
+                    mode = 'forward'
+                max_speakers = self._parse_max_speakers(message) if mode == 'forward' else 0
+                with self.lock:
+                    room_id = make_room_id(self.shard, len(self.rooms))
+                    room = Room(room_id, password, mode, RoomMixer() if mode == 'mix' else None,
+                                ActiveSpeakerSelector(max_speakers) if max_speakers else None)
+                    room.add(sock, client_info['username'])
+                    self._update_room_codec(room)
+                    self.rooms[room_id] = room
+                    if room.mixer:
+                        self.mix_rooms[room_id] = room
+                    self.clients[sock]['room'] = room_id
+                if room.mixer:
+                    self._ensure_mixer_clock()
+                self.send_response(sock, {'type': 'ROOM_CREATED', 'room_id': room_id, 'mode': mode,
+                                          'max_speakers': max_speakers, **self._codec_fields(room),
+                                          **self._media_session_fields(sock)})
+                logging.info(f"[SignalingServer] Created room {room_id} ({mode}) by {client_info['username']}")
+                logging.info(f"[ServerDebug] Room {room_id} users: {list(room.users)}")
             else:
                 self.send_response(sock, {'type': 'ERROR', 'message': 'Already in a room'})
                 logging.warning(f"[ServerDebug] User {client_info['username']} already in room {client_info['room']}")
@@ -156,32 +285,49 @@ class SignalingServer:
             room_id = message.get('room_id')
             password = message.get('password', '')
             logging.info(f"[ServerDebug] JOIN_ROOM attempt: {client_info['username']} -> {room_id}")
+
+            target_shard = self._shard_for_room(room_id)
+            if target_shard is not None:
+                self._redirect(sock, target_shard, message)
+                return
             
-            if room_id in self.rooms and self.rooms[room_id]['password'] == password:
-                if client_info['room'] is None:
-                    self.rooms[room_id]['sockets'].append(sock)
-                    self.rooms[room_id]['users'].append(client_info['username'])
+            with self.lock:
+                room = self.rooms.get(room_id)
+            if room and room.password == password and client_info['username']:
+                if client_info['room'] is None and room.add(sock, client_info['username']):
                     self.clients[sock]['room'] = room_id
+                    user_ids = self._room_user_ids(room)
+                    codec_changed = self._update_room_codec(room)
                     
                     # Gửi phản hồi cho client vừa join
                     self.send_response(sock, {
                         'type': 'JOIN_SUCCESS',
                         'room_id': room_id,
-                        'users': self.rooms[room_id]['users']
+                        'mode': room.mode,
+                        'users': room.users,
+                        'user_ids': user_ids,
+                        **self._codec_fields(room),
+                        **self._speaker_fields(room),
+                        **self._media_session_fields(sock)
                     })
                     
-                    # Thông báo cho các user khác
-                    for client_sock in list(self.rooms[room_id]['sockets']):
-                        if client_sock != sock:
-                            self.send_response(client_sock, {
-                                'type': 'USER_JOINED',
-                                'room_id': room_id,
-                                'username': client_info['username'],
-                                'users': self.rooms[room_id]['users']
-                            })
+                    # Thông báo cho các user khác (snapshot, không giữ lock khi gửi)
+                    joined_msg = {
+                        'type': 'USER_JOINED',
+                        'room_id': room_id,
+                        'username': client_info['username'],
+                        'users': room.users,
+                        'user_ids': user_ids
+                    }
+                    self.broadcast(room.sockets, joined_msg, exclude=sock)
+                    if codec_changed:
+                        self._broadcast_room_codec(room, exclude=sock)
                     
                     logging.info(f"[SignalingServer] {client_info['username']} joined room {room_id}")
-                    logging.info(f"[ServerDebug] Room {room_id} now has users: {self.rooms[room_id]['users']}")
+                    logging.info(f"[ServerDebug] Room {room_id} now has users: {list(room.users)}")
+                elif client_info['room'] is None:
+                    self.send_response(sock, {'type': 'ERROR', 'message': 'Invalid room ID or password'})
+                    logging.warning(f"[ServerDebug] Join failed: room {room_id} was just closed")
                 else:
                     self.send_response(sock, {'type': 'ERROR', 'message': 'Already in a room'})
                     logging.warning(f"[ServerDebug] User {client_info['username']} already in room {client_info['room']}")
@@ -190,46 +336,17 @@ class SignalingServer:
                 logging.warning(f"[ServerDebug] Join failed: invalid room {room_id} or password")
 
         elif msg_type == 'AUDIO_DATA':
-            with self.lock:
-                client_info = self.clients.get(sock)
-                if client_info and client_info['room']:
-                    room_id = client_info['room']
-                    room = self.rooms.get(room_id)
-                    if room:
-                        # DEBUG QUAN TRỌNG: Log audio data info
-                        username = client_info['username']
-                        data_size = len(message.get('data', ''))
-                        recipient_count = len(room['sockets']) - 1
-                        
-                        logging.info(f"[AudioDebug] {username} -> Room {room_id}: {data_size} bytes to {recipient_count} recipients")
-                        
-                        payload = {
-                            'type': 'AUDIO_DATA',
-                            'from': username
-                        }
-                        
-                        data = message.get('data', '')
-                        if data and isinstance(data, str):
-                            payload['data'] = data
-                            
-                            # Forward đến tất cả clients khác trong room
-                            forwarded_count = 0
-                            for client_sock in list(room['sockets']):
-                                if client_sock != sock:
-                                    try:
-                                        target_user = self.clients.get(client_sock, {}).get('username', 'unknown')
-                                        logging.info(f"[AudioDebug] Forwarding to {target_user}")
-                                        self.send_response(client_sock, payload)
-                                        forwarded_count += 1
-                                    except Exception as e:
-                                        logging.error(f"[SignalingServer] Error forwarding audio to {target_user}: {e}")
-                                        self.remove_client(client_sock)
-                            
-                            logging.info(f"[AudioDebug] Successfully forwarded to {forwarded_count}/{recipient_count} clients")
-                        else:
-                            logging.warning(f"[AudioDebug] Invalid audio data from {username}: type={type(data)}, size={data_size}")
-                else:
-                    logging.warning(f"[AudioDebug] Client not in room, cannot forward audio")
+            # Client cũ (không dùng binary framing): audio base64 trong JSON
+            data = message.get('data', '')
+            if data and isinstance(data, str):
+                self.metrics.frames_in.inc(1, 'tcp')
+                seq = message.get('seq', 0)
+                timestamp = message.get('timestamp')
+                self._forward_audio(sock, b64=data, seq=seq if isinstance(seq, int) else 0,
+                                    timestamp=timestamp if isinstance(timestamp, int) else None,
+                                    flags=CODEC_IDS.get(message.get('codec'), CODEC_PCM))
+            else:
+                logging.warning(f"[AudioDebug] Invalid audio data from {client_info['username']}: type={type(data)}")
 
         elif msg_type == 'LEAVE_ROOM':
             self._handle_leave_room(sock)
@@ -245,60 +362,387 @@ class SignalingServer:
         else:
             logging.warning(f"[ServerDebug] Unknown message type: {msg_type}")
 
+    def _shard_for_new_room(self, message):
+        """Shard khác cần tạo phòng mới (round-robin), None nếu tạo tại worker này"""
+        if not self.shard:
+            return None
+        target = message.get('shard')
+        if not isinstance(target, int) or not 0 <= target < self.shard.count:
+            target = self.shard_router.pick_shard_for_new_room()
+        return None if target == self.shard.index else target
+
+    def _shard_for_room(self, room_id):
+        """Shard khác sở hữu phòng room_id, None nếu phòng thuộc worker này"""
+        if not self.shard:
+            return None
+        target = shard_of_room(room_id)
+        if target is None or target == self.shard.index or target >= self.shard.count:
+            return None
+        return target
+
+    def _redirect(self, sock, target_shard, retry):
+        """Báo client kết nối lại tới worker sở hữu phòng và gửi lại message"""
+        port = shard_port(self.shard, target_shard)
+        self.send_response(sock, {'type': 'REDIRECT', 'shard': target_shard, 'port': port, 'retry': retry})
+        logging.info(f"[SignalingServer] Redirect {self.clients.get(sock, {}).get('username')} "
+                     f"to shard {target_shard} (port {port}) for {retry.get('type')}")
+
+    def process_media_frame(self, sock, frame):
+        """Xử lý media frame nhị phân từ client"""
+        if frame.type == FRAME_AUDIO:
+            self.metrics.frames_in.inc(1, 'tcp')
+            self._forward_audio(sock, pcm=frame.payload, seq=frame.seq, timestamp=frame.timestamp,
+                                flags=frame.flags)
+        else:
+            logging.warning(f"[ServerDebug] Unknown frame type: {frame.type}")
+
+    def _forward_audio(self, sock, pcm=None, b64=None, seq=0, timestamp=None, flags=0):
+        """Chuyển tiếp audio đến các client khác trong phòng.
+
+        Mỗi người nhận được gửi theo framing đã thỏa thuận lúc REGISTER: media frame
+        nhị phân (PCM thô, theo phiên bản header của người nhận) hoặc JSON base64.
+        Mỗi dạng chỉ được tạo một lần. seq / timestamp / codec của người gửi được giữ
+        nguyên: server không giải mã payload, trừ phòng mix / giới hạn người nói (luôn PCM).
+        Không giữ lock nào khi gửi: chỉ đọc snapshot thành viên (tuple) của phòng.
+        """
+        client_info = self.clients.get(sock)
+        if not client_info or not client_info['room']:
+            logging.warning("[AudioDebug] Client not in room, cannot forward audio")
+            return
+        room_id = client_info['room']
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        codec_id = flags & FLAG_CODEC_MASK
+        if codec_id != CODEC_PCM and (room.mixer or room.speaker_selector):
+            # Frame nén gửi trước khi người gửi nhận ROOM_CODEC: server không đọc được mẫu, bỏ qua
+            return
+        if room.mixer:
+            # Phòng mix: chỉ đưa vào bộ trộn, việc gửi do tick 16 ms đảm nhận
+            try:
+                room.mixer.push(sock, pcm if pcm is not None else base64.b64decode(b64))
+            except Exception as e:
+                logging.error(f"[SignalingServer] Mixer input error: {e}")
+            return
+        if room.speaker_selector:
+            # Chỉ chuyển tiếp K người nói to nhất
+            if pcm is None:
+                pcm = base64.b64decode(b64)
+            forward, snapshot = room.speaker_selector.update(sock, pcm)
+            if snapshot:
+                self._broadcast_active_speakers(room, snapshot)
+            if not forward:
+                return
+        members = room.sockets
+        username = client_info['username']
+        started = time.perf_counter()
+
+        # Chia người nhận theo đường truyền; mỗi dạng dữ liệu chỉ được đóng gói một lần
+        udp_targets = []      # [(addr, version)]
+        binary_targets = {}   # version -> [sock]
+        json_targets = []
+        for client_sock in members:
+            if client_sock == sock:
+                continue
+            target_info = self.clients.get(client_sock)
+            if not target_info:
+                continue
+            version = target_info.get('framing')
+            if version:
+                udp_addr = self.media_relay.address_of(client_sock) if self.media_relay else None
+                if udp_addr:
+                    udp_targets.append((udp_addr, version))
+                else:
+                    binary_targets.setdefault(version, []).append(client_sock)
+            else:
+                json_targets.append(client_sock)
+
+        try:
+            if udp_targets or binary_targets:
+                if pcm is None:
+                    pcm = base64.b64decode(b64)
+                frames = {}
+                for version in {v for _, v in udp_targets} | binary_targets.keys():
+                    frames[version] = encode_frame(pcm, seq=seq, sender_id=client_info['user_id'],
+                                                   flags=codec_id, timestamp=timestamp, version=version)
+                for udp_addr, version in udp_targets:
+                    self.media_relay.send_to(udp_addr, frames[version])
+                for version, targets in binary_targets.items():
+                    self.broadcast_bytes(targets, frames[version], media=True)
+            if json_targets:
+                if b64 is None:
+                    b64 = base64.b64encode(pcm).decode('ascii')
+                message = {'type': 'AUDIO_DATA', 'from': username, 'data': b64, 'seq': seq}
+                if timestamp is not None:
+                    message['timestamp'] = timestamp
+                if codec_id != CODEC_PCM:
+                    message['codec'] = CODEC_NAMES.get(codec_id, codec_id)
+                self.broadcast(json_targets, message, media=True)
+        except Exception as e:
+            logging.error(f"[SignalingServer] Error forwarding audio from {username}: {e}")
+            return
+        self.metrics.fanout_seconds.observe(time.perf_counter() - started)
+
+        if TRACE_FORWARD.enabled and TRACE_FORWARD.sampled():
+            TRACE_FORWARD.emit(user=username, room=room_id, seq=seq,
+                               bytes=len(pcm) if pcm is not None else len(b64),
+                               recipients=len(members) - 1, udp=len(udp_targets),
+                               binary=sum(map(len, binary_targets.values())), json=len(json_targets))
+
+    def _parse_max_speakers(self, message):
+        """max_speakers của CREATE_ROOM (0 = chuyển tiếp mọi người nói)"""
+        try:
+            return max(0, int(message.get('max_speakers', config.ACTIVE_SPEAKERS_MAX) or 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def _speaker_names(self, socks):
+        names = []
+        for s in socks:
+            info = self.clients.get(s)
+            if info:
+                names.append(info['username'])
+        return names
+
+    def _speaker_fields(self, room):
+        """max_speakers và tập người nói hiện tại (kèm JOIN_SUCCESS)"""
+        if not room.speaker_selector:
+            return {}
+        version, socks = room.speaker_selector.snapshot()
+        return {'max_speakers': room.speaker_selector.max_speakers,
+                'active_speakers': self._speaker_names(socks), 'speakers_version': version}
+
+    def _update_room_codec(self, room):
+        """Chọn lại codec chung của phòng (và có dùng comfort noise không) theo thành viên
+        hiện tại. Trả về True nếu thay đổi."""
+        with room.lock:
+            if room.mixer or room.speaker_selector:
+                codec = CODEC_NAMES[CODEC_PCM]  # server cần đọc mẫu PCM để trộn / đo âm lượng
+                comfort_noise = False
+            else:
+                members = [self.clients.get(s) for s in room.sockets]
+                member_codecs = [info['codecs'] for info in members if info]
+                codec = negotiate_codec(member_codecs)
+                comfort_noise = all(CODEC_NAMES[CODEC_CN] in codecs for codecs in member_codecs)
+            if codec == room.codec and comfort_noise == room.comfort_noise:
+                return False
+            room.codec = codec
+            room.comfort_noise = comfort_noise
+        logging.info(f"[SignalingServer] Room {room.room_id} codec: {codec}, comfort noise: {comfort_noise}")
+        return True
+
+    def _codec_fields(self, room):
+        """codec / comfort_noise của phòng (kèm ROOM_CREATED, JOIN_SUCCESS, ROOM_CODEC)"""
+        return {'codec': room.codec, 'comfort_noise': room.comfort_noise}
+
+    def _broadcast_room_codec(self, room, exclude=None):
+        self.broadcast(room.sockets, {'type': 'ROOM_CODEC', 'room_id': room.room_id, **self._codec_fields(room)},
+                       exclude=exclude)
+
+    def _broadcast_active_speakers(self, room, snapshot):
+        """Báo tập người nói mới; client bỏ qua bản có version cũ hơn bản đã nhận"""
+        version, socks = snapshot
+        self.broadcast(room.sockets, {
+            'type': 'ACTIVE_SPEAKERS',
+            'room_id': room.room_id,
+            'speakers': self._speaker_names(socks),
+            'version': version
+        })
+
+    def _ensure_mixer_clock(self):
+        """Chạy thread nhịp trộn khi có phòng mix đầu tiên"""
+        if self.mixer_clock and not self.mixer_clock.running:
+            self.mixer_clock.start()
+
+    def _on_mix_tick(self):
+        """Mỗi 16 ms: trộn từng phòng mix và gửi một frame cho mỗi người nghe"""
+        timestamp = media_timestamp()
+        for room in list(self.mix_rooms.values()):
+            for client_sock, pcm in room.mixer.mix(room.sockets):
+                self._send_audio_to(client_sock, pcm, room.mixer.seq, MIXER_SENDER_ID, MIXER_NAME, timestamp)
+
+    def _send_audio_to(self, client_sock, pcm, seq, sender_id, from_name, timestamp=None):
+        """Gửi audio cho một người nhận theo đường truyền của họ (UDP / binary / JSON)"""
+        target_info = self.clients.get(client_sock)
+        if not target_info:
+            return
+        if timestamp is None:
+            timestamp = media_timestamp()  # frame tạo tại server (mix): thời điểm gửi
+        version = target_info.get('framing')
+        if version:
+            frame = encode_frame(pcm, seq=seq, sender_id=sender_id, timestamp=timestamp, version=version)
+            udp_addr = self.media_relay.address_of(client_sock) if self.media_relay else None
+            if udp_addr:
+                self.media_relay.send_to(udp_addr, frame)
+            else:
+                self._send_bytes(client_sock, frame, media=True)
+        else:
+            self._send_json(client_sock, {
+                'type': 'AUDIO_DATA',
+                'from': from_name,
+                'data': base64.b64encode(pcm).decode('ascii'),
+                'seq': seq,
+                'timestamp': timestamp
+            }, media=True)
+
+    def _media_session_fields(self, sock):
+        """Cấp media token UDP cho client dùng binary framing (kèm ROOM_CREATED / JOIN_SUCCESS)"""
+        client_info = self.clients.get(sock)
+        if not self.media_relay or not client_info or not client_info.get('framing'):
+            return {}
+        return {
+            'media_token': self.media_relay.issue_token(sock),
+            'media_port': self.media_relay.port
+        }
+
+    def _allocate_user_id(self):
+        """Cấp user_id chưa dùng cho client mới"""
+        with self.lock:
+            used = {info.get('user_id') for info in self.clients.values() if info}
+            for _ in range(0xFFFF):
+                user_id = self._next_user_id
+                self._next_user_id = user_id % 0xFFFF + 1
+                if user_id not in used:
+                    return user_id
+        raise RuntimeError("No free user id")
+
+    def _room_user_ids(self, room):
+        """username -> user_id của các thành viên trong phòng (để client map sender_id)"""
+        user_ids = {}
+        for s in room.sockets:
+            info = self.clients.get(s)
+            if info:
+                user_ids[info['username']] = info['user_id']
+        return user_ids
+
     def _handle_leave_room(self, sock):
         """Xử lý client rời phòng"""
-        with self.lock:
-            client_info = self.clients.get(sock)
-            if not client_info or not client_info['room']:
-                logging.debug(f"[ServerDebug] LEAVE_ROOM: Client not in any room")
-                return
-            
-            room_id = client_info['room']
-            room = self.rooms.get(room_id)
-            if room and sock in room['sockets']:
-                username = client_info['username']
-                room['sockets'].remove(sock)
-                if username in room['users']:
-                    room['users'].remove(username)
-                
-                logging.info(f"[ServerDebug] {username} left room {room_id}")
-                logging.info(f"[ServerDebug] Room {room_id} remaining users: {room['users']}")
-                
-                for client_sock in list(room['sockets']):
-                    self.send_response(client_sock, {
-                        'type': 'USER_LEFT',
-                        'room_id': room_id,
-                        'username': username,
-                        'users': room['users']
-                    })
-                
-                if not room['sockets']:
+        client_info = self.clients.get(sock)
+        if self.media_relay:
+            self.media_relay.revoke(sock)
+        if not client_info or not client_info['room']:
+            logging.debug("[ServerDebug] LEAVE_ROOM: Client not in any room")
+            return
+
+        room_id = client_info['room']
+        client_info['room'] = None
+        room = self.rooms.get(room_id)
+        username = client_info['username']
+        if not room or not room.remove(sock, username):
+            return
+        if room.mixer:
+            room.mixer.remove(sock)
+        speakers_snapshot = room.speaker_selector.remove(sock) if room.speaker_selector else None
+
+        logging.info(f"[ServerDebug] {username} left room {room_id}")
+        logging.info(f"[ServerDebug] Room {room_id} remaining users: {list(room.users)}")
+
+        if room.closed:
+            with self.lock:
+                if self.rooms.get(room_id) is room:
                     del self.rooms[room_id]
-                    logging.info(f"[ServerDebug] Room {room_id} deleted (empty)")
-                
-                self.clients[sock]['room'] = None
+                self.mix_rooms.pop(room_id, None)
+            logging.info(f"[ServerDebug] Room {room_id} deleted (empty)")
+            return
+
+        left_msg = {
+            'type': 'USER_LEFT',
+            'room_id': room_id,
+            'username': username,
+            'users': room.users,
+            'user_ids': self._room_user_ids(room)
+        }
+        self.broadcast(room.sockets, left_msg)
+        if self._update_room_codec(room):
+            self._broadcast_room_codec(room)
+        if speakers_snapshot:
+            self._broadcast_active_speakers(room, speakers_snapshot)
 
     def send_response(self, sock, message):
         """Gửi response đến client (thêm delimiter \\n)"""
+        self._send_json(sock, message)
+
+    def broadcast(self, socks, message, exclude=None, media=False):
+        """Gửi cùng một message đến nhiều client: chỉ json.dumps / encode một lần"""
         try:
-            message_str = json.dumps(message) + "\n"
-            sock.sendall(message_str.encode(config.ENCODING))
-            logging.debug(f"[ServerDebug] Sent: {message.get('type')} to socket {sock.fileno()}")
-        except Exception as e:
-            logging.error(f"[SignalingServer] Send error: {e}")
+            data = encode_json(message)
+        except (TypeError, ValueError) as e:
+            logging.error(f"[SignalingServer] Encode error: {e}")
+            return
+        self.broadcast_bytes(socks, data, exclude, media)
+
+    def broadcast_bytes(self, socks, data, exclude=None, media=False):
+        """Đưa cùng một buffer (bytes bất biến, dùng chung) vào hàng đợi của từng client"""
+        for client_sock in socks:
+            if client_sock is not exclude:
+                self._send_bytes(client_sock, data, media)
+
+    def _send_json(self, sock, message, media=False):
+        try:
+            data = encode_json(message)
+        except (TypeError, ValueError) as e:
+            logging.error(f"[SignalingServer] Encode error: {e}")
+            return
+        self._send_bytes(sock, data, media)
+        logging.debug(f"[ServerDebug] Sent: {message.get('type')}")
+
+    def _send_bytes(self, sock, data, media=False):
+        """Đưa dữ liệu đã đóng gói (JSON hoặc media frame) vào hàng đợi gửi của client.
+
+        Không gọi sendall ở đây: một người nghe mạng chậm không làm chậm thread
+        của người nói. Client tràn hàng đợi quá lâu sẽ bị ngắt kết nối.
+        """
+        send_queue = self.send_queues.get(sock)
+        if send_queue is None:
+            return
+        metrics = self.metrics
+        if media:
+            metrics.frames_out.inc(1, 'tcp')
+        else:
+            metrics.messages_out.inc()
+        metrics.bytes_out.inc(len(data), 'tcp')
+        if not send_queue.put(data, media):
+            logging.warning(f"[SignalingServer] Send queue overflow for "
+                            f"{self.clients.get(sock, {}).get('username', 'unknown')}, disconnecting")
+            metrics.overflow_disconnects.inc()
             self.remove_client(sock)
 
+    def _writer_loop(self, sock, send_queue):
+        """Thread ghi riêng của mỗi client: gom các message đang chờ vào một sendmsg.
+
+        Sau message đầu tiên, chờ thêm tối đa SEND_COALESCE_DELAY để các frame của
+        những người nói khác trong cùng tick đi chung một lần gọi hệ thống.
+        """
+        while self.running and not send_queue.closed:
+            batch = send_queue.get_batch(config.SEND_COALESCE_MAX_FRAMES, timeout=1.0,
+                                         linger=config.SEND_COALESCE_DELAY)
+            if not batch:
+                continue
+            try:
+                self.metrics.send_calls.inc(sendall_buffers(sock, batch))
+            except Exception as e:
+                if not send_queue.closed:
+                    logging.error(f"[SignalingServer] Send error: {e}")
+                    self.metrics.send_errors.inc()
+                    self.remove_client(sock)
+                break
+
     def remove_client(self, sock):
         """Xóa client khỏi hệ thống"""
+        username = self.clients.get(sock, {}).get('username', 'unknown')
+        room_id = self.clients.get(sock, {}).get('room')
+
+        self._handle_leave_room(sock)
+        self.idle_tracker.remove(sock)
         with self.lock:
-            username = self.clients.get(sock, {}).get('username', 'unknown')
-            room_id = self.clients.get(sock, {}).get('room')
-            
-            self._handle_leave_room(sock)
             self.clients.pop(sock, None)
-            self.client_timeouts.pop(sock, None)
-            
-            logging.info(f"[SignalingServer] Removed client: {username} (room: {room_id})")
+            send_queue = self.send_queues.pop(sock, None)
+        if send_queue is not None:  # SendQueue rỗng có len() == 0
+            send_queue.close()
+            self.metrics.disconnects_total.inc()
+            self.metrics.record_queue_closed(send_queue)
+
+        logging.info(f"[SignalingServer] Removed client: {username} (room: {room_id})")
         
         try:
             sock.close()
@@ -0,0 +1,118 @@
+# bench/codec_bench.py
+# Đo chi phí mã hóa / giải mã mỗi frame của các codec audio phía client.
+#
+# Tín hiệu thử là "giọng nói" tổng hợp (vài họa âm có điều biến biên độ + nhiễu),
+# cắt thành frame AUDIO_CHUNK mẫu như trên đường gửi thật. Mỗi codec báo cáo:
+# kích thước payload, tỉ lệ nén, bitrate, thời gian encode / decode mỗi frame
+# (trung vị và p99) và SNR sau một vòng encode -> decode.
+#
+# Ví dụ:
+#   python -m bench.codec_bench
+#   python -m bench.codec_bench --frames 2000 --output results/codecs.json
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from shared import config
+from Client.audio_codecs import available_codecs, create_codec
+from shared.protocol import CODEC_IDS
+from bench.load_test import _git_commit
+
+FRAME_BYTES = config.AUDIO_CHUNK * config.AUDIO_SAMPLE_WIDTH * config.AUDIO_CHANNELS
+FRAME_PERIOD = config.AUDIO_CHUNK / config.AUDIO_RATE
+
+
+def synthetic_speech(frames, seed=0):
+    """PCM int16 giống giọng nói: họa âm của 120-220 Hz, bao biên độ kiểu âm tiết, nhiễu nền"""
+    rng = np.random.default_rng(seed)
+    n = frames * config.AUDIO_CHUNK
+    t = np.arange(n) / config.AUDIO_RATE
+    pitch = 170 + 50 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / config.AUDIO_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 3.0 * t), 0, None) ** 0.5
+    signal = 6000 * envelope * voice + rng.normal(0, 150, n)
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+
+def bench_codec(name, frames):
+    encoder = create_codec(CODEC_IDS[name])
+    decoder = create_codec(CODEC_IDS[name])
+    pcm = [frame.tobytes() for frame in frames]
+
+    encode_times, decode_times, payload_bytes, decoded = [], [], 0, []
+    for chunk in pcm:
+        started = time.perf_counter()
+        payload = encoder.encode(chunk)
+        encoded_at = time.perf_counter()
+        out = decoder.decode(payload)
+        decode_times.append(time.perf_counter() - encoded_at)
+        encode_times.append(encoded_at - started)
+        payload_bytes += len(payload)
+        decoded.append(out)
+
+    original = np.concatenate(frames).astype(np.float64)
+    restored = np.frombuffer(b"".join(decoded), dtype=np.int16).astype(np.float64)
+    noise = np.sum((original - restored) ** 2)
+    snr = float('inf') if noise == 0 else 10 * np.log10(np.sum(original ** 2) / noise)
+    avg_payload = payload_bytes / len(pcm)
+
+    def _us(values, q):
+        return round(float(np.percentile(values, q)) * 1e6, 1)
+
+    return {
+        'payload_bytes': round(avg_payload, 1),
+        'compression_ratio': round(FRAME_BYTES / avg_payload, 2),
+        'bitrate_kbps': round(avg_payload * 8 / FRAME_PERIOD / 1000, 1),
+        'encode_us': {'p50': _us(encode_times, 50), 'p99': _us(encode_times, 99)},
+        'decode_us': {'p50': _us(decode_times, 50), 'p99': _us(decode_times, 99)},
+        'frame_budget_percent': round((np.median(encode_times) + np.median(decode_times)) / FRAME_PERIOD * 100, 2),
+        'snr_db': None if snr == float('inf') else round(float(snr), 1),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark encode/decode cost of the client audio codecs")
+    parser.add_argument('--frames', type=int, default=1000, help="Số frame mỗi codec")
+    parser.add_argument('--codecs', nargs='+', help="Chỉ đo các codec này (mặc định: mọi codec khả dụng)")
+    parser.add_argument('--output', help="Ghi kết quả JSON vào file này")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args(argv)
+    codecs = args.codecs or available_codecs()
+    unknown = [name for name in codecs if name not in available_codecs()]
+    if unknown:
+        raise SystemExit(f"Codec not available: {', '.join(unknown)}")
+
+    signal = synthetic_speech(args.frames)
+    frames = np.split(signal, args.frames)
+    results = {}
+    for name in codecs:
+        logging.info(f"[CodecBench] {name}: {args.frames} frames")
+        results[name] = bench_codec(name, frames)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': _git_commit(),
+        'config': {'frames': args.frames, 'audio_chunk': config.AUDIO_CHUNK, 'audio_rate': config.AUDIO_RATE},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+        logging.info(f"[CodecBench] Results written to {args.output}")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
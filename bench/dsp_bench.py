@@ -0,0 +1,250 @@
+# bench/dsp_bench.py
+# Micro-benchmark cho tầng xử lý chunk mic (Client/capture_dsp.py).
+#
+# So sánh CaptureDsp với cách xử lý cũ (float32 hóa toàn chunk, chia 32768,
+# np.correlate + hai norm, rồi nhân lại và ép về int16) trên ba trường hợp:
+# chunk im lặng, chunk có tiếng không có tham chiếu loa, chunk có tiếng kèm
+# tham chiếu (phải tính tương quan vọng âm). Báo cáo thời gian mỗi chunk
+# (trung vị, p99) và bộ nhớ tạm cấp phát đỉnh mỗi chunk (tracemalloc).
+#
+# Thêm trường hợp "aec" cho bộ khử vọng âm (Client/echo_canceller.py): vọng âm
+# mô phỏng = giọng nói tổng hợp phát ra loa, trễ --echo-delay-ms, qua một đáp ứng
+# xung tắt dần, cộng nhiễu; đoạn giữa có người gần nói cùng lúc (double-talk).
+# Báo cáo thời gian mỗi chunk, ERLE khi chỉ loa phát, SNR của giọng người gần
+# trong double-talk (trước / sau AEC) và độ trễ ước lượng.
+#
+# Trường hợp "vad" cho VAD/DTX (Client/vad.py): hội thoại mô phỏng nói 3s / nghỉ 3s
+# trên nền nhiễu, khoảng nghỉ có tiếng gõ phím. Báo cáo tỉ lệ chunk được gửi (kể
+# cả pre-roll), số chunk có tiếng nói bị bỏ, số tiếng gõ phím bị gửi và chi phí.
+#
+# Ví dụ:
+#   python -m bench.dsp_bench
+#   python -m bench.dsp_bench --chunks 20000 --output results/dsp.json
+#   python -m bench.dsp_bench --echo-delay-ms 180
+import argparse
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+from shared import config
+from Client.capture_dsp import CaptureDsp
+from Client.echo_canceller import EchoCanceller
+from Client.vad import VoiceActivityDetector
+from bench.codec_bench import synthetic_speech
+from bench.load_test import _git_commit
+
+FRAME_PERIOD = config.AUDIO_CHUNK / config.AUDIO_RATE
+
+
+class LegacyDsp:
+    """Bản sao cách xử lý cũ của AudioHandler._process_audio_chunk (để so sánh)"""
+
+    def __init__(self, echo_threshold=0.3):
+        self.echo_threshold = echo_threshold
+        self.references = []
+
+    def add_reference(self, data):
+        if len(self.references) < 3:
+            self.references.append(np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0)
+
+    def process(self, data):
+        audio_data = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        audio_data = audio_data / 32768.0
+        if np.max(np.abs(audio_data)) < config.SILENCE_THRESHOLD / 32768.0:
+            return None
+        if self.references:
+            echo_data = self.references.pop(0)
+            min_len = min(len(audio_data), len(echo_data))
+            similarity = np.correlate(audio_data[:min_len], echo_data[:min_len])[0] / (
+                np.linalg.norm(audio_data[:min_len]) * np.linalg.norm(echo_data[:min_len]) + 1e-10)
+            if similarity > self.echo_threshold:
+                return None
+        return (audio_data * 32768.0).astype(np.int16).tobytes()
+
+
+def _chunks(count, amplitude, seed):
+    rng = np.random.default_rng(seed)
+    return [rng.normal(0, amplitude, config.AUDIO_CHUNK).clip(-32768, 32767).astype(np.int16).tobytes()
+            for _ in range(count)]
+
+
+def bench_case(dsp, chunks, references):
+    """Thời gian mỗi chunk (µs) và bộ nhớ tạm đỉnh (byte) khi xử lý chunks"""
+    times = []
+    for data, reference in zip(chunks, references):
+        if reference is not None:
+            dsp.add_reference(reference)
+        started = time.perf_counter()
+        dsp.process(data)
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    peak = 0
+    for data, reference in zip(chunks[:200], references[:200]):
+        if reference is not None:
+            dsp.add_reference(reference)
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        dsp.process(data)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    median = float(np.median(times))
+    return {
+        'p50_us': round(median * 1e6, 2),
+        'p99_us': round(float(np.percentile(times, 99)) * 1e6, 2),
+        'frame_budget_percent': round(median / FRAME_PERIOD * 100, 3),
+        'peak_temp_bytes': peak,
+    }
+
+
+def _energy_db(signal):
+    return 10 * np.log10(float(np.dot(signal, signal)) + 1e-9)
+
+
+def bench_aec(chunks, echo_delay_ms, seed=4):
+    """Chi phí và chất lượng khử vọng âm trên tín hiệu mô phỏng (xem đầu file)"""
+    n = config.AUDIO_CHUNK
+    rng = np.random.default_rng(seed)
+    far = synthetic_speech(chunks, seed=seed).astype(np.float64)
+    delay = int(echo_delay_ms * config.AUDIO_RATE / 1000)
+    response = rng.normal(0, 1, 600) * np.exp(-np.arange(600) / 80.0)
+    response *= 2.0 / np.abs(response).sum()
+    echo = np.concatenate((np.zeros(delay), np.convolve(far, response)))[:len(far)]
+    # Giọng người gần: đảo chiều thời gian để không trùng cao độ với giọng phát ra loa
+    near = 0.8 * synthetic_speech(chunks, seed=seed + 1)[::-1].astype(np.float64)
+    talk = np.zeros(len(far))
+    talk[int(chunks * 0.6) * n:int(chunks * 0.7) * n] = 1
+    mic = np.clip(echo + near * talk + rng.normal(0, 20, len(far)), -32768, 32767).astype(np.int16)
+    far = far.astype(np.int16)
+
+    aec = EchoCanceller()
+    times, out = [], []
+    for i in range(chunks):
+        aec.add_reference(far[i * n:(i + 1) * n].tobytes())
+        started = time.perf_counter()
+        data = aec.process(mic[i * n:(i + 1) * n].tobytes())
+        times.append(time.perf_counter() - started)
+        out.append(np.frombuffer(data, dtype=np.int16))
+    out = np.concatenate(out).astype(np.float64)
+    mic = mic.astype(np.float64)
+
+    single = slice(int(chunks * 0.3) * n, int(chunks * 0.6) * n)   # sau khi hội tụ, chỉ loa phát
+    double = slice(int(chunks * 0.6) * n, int(chunks * 0.7) * n)
+    median = float(np.median(times))
+    return {
+        'p50_us': round(median * 1e6, 2),
+        'p99_us': round(float(np.percentile(times, 99)) * 1e6, 2),
+        'frame_budget_percent': round(median / FRAME_PERIOD * 100, 3),
+        'erle_db': round(_energy_db(mic[single]) - _energy_db(out[single]), 1),
+        'double_talk_snr_db': {
+            'before': round(_energy_db(near[double]) - _energy_db(mic[double] - near[double]), 1),
+            'after': round(_energy_db(near[double]) - _energy_db(out[double] - near[double]), 1),
+        },
+        'true_delay_ms': echo_delay_ms,
+        'aec': aec.summary(),
+    }
+
+
+def _chunk_peaks(signal, chunks):
+    return np.abs(signal[:chunks * config.AUDIO_CHUNK]).reshape(chunks, config.AUDIO_CHUNK).max(axis=1)
+
+
+def bench_vad(chunks, seed=5):
+    """Tỉ lệ gửi và độ chính xác của VAD + pre-roll trên hội thoại mô phỏng (xem đầu file)"""
+    n = config.AUDIO_CHUNK
+    rng = np.random.default_rng(seed)
+    t = np.arange(chunks * n) / config.AUDIO_RATE
+    talk = ((t // 3) % 2 == 0).astype(np.float64)
+    voice = synthetic_speech(chunks, seed=seed).astype(np.float64) * talk
+    clicks = np.zeros(len(t))
+    for c in range(0, len(t) - 40, 2700):
+        if not talk[c]:
+            clicks[c:c + 40] += rng.normal(0, 4000, 40) * np.exp(-np.arange(40) / 8.0)
+    mic = np.clip(voice + clicks + rng.normal(0, 60, len(t)), -32768, 32767).astype(np.int16)
+
+    vad = VoiceActivityDetector()
+    times, active = [], []
+    for i in range(chunks):
+        data = mic[i * n:(i + 1) * n].tobytes()
+        started = time.perf_counter()
+        active.append(vad.update(data))
+        times.append(time.perf_counter() - started)
+    active = np.array(active)
+    sent = active.copy()
+    for i in np.flatnonzero(active[1:] & ~active[:-1]) + 1:
+        sent[max(0, i - config.VAD_PREROLL_FRAMES):i] = True
+
+    speech = _chunk_peaks(voice, chunks) > config.SILENCE_THRESHOLD
+    clicked = _chunk_peaks(clicks, chunks) > 0
+    median = float(np.median(times))
+    return {
+        'p50_us': round(median * 1e6, 2),
+        'p99_us': round(float(np.percentile(times, 99)) * 1e6, 2),
+        'frame_budget_percent': round(median / FRAME_PERIOD * 100, 3),
+        'talk_fraction': round(float(talk[::n].mean()), 3),
+        'sent_fraction': round(float(sent.mean()), 3),
+        'speech_chunks_dropped': int((speech & ~sent).sum()),
+        'speech_chunks': int(speech.sum()),
+        'clicks_sent': int((clicked & sent).sum()),
+        'clicks': int(clicked.sum()),
+        'vad': dict(vad.stats),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark per-chunk cost of the capture DSP stage")
+    parser.add_argument('--chunks', type=int, default=5000, help="Số chunk mỗi trường hợp")
+    parser.add_argument('--echo-delay-ms', type=float, default=100.0, help="Độ trễ loa -> mic mô phỏng cho AEC")
+    parser.add_argument('--output', help="Ghi kết quả JSON vào file này")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args(argv)
+    silent = _chunks(args.chunks, config.SILENCE_THRESHOLD / 4, seed=1)
+    voiced = _chunks(args.chunks, 3000, seed=2)
+    far_end = _chunks(args.chunks, 3000, seed=3)
+    no_reference = [None] * args.chunks
+    cases = {
+        'silent': (silent, no_reference),
+        'voiced': (voiced, no_reference),
+        'voiced_with_reference': (voiced, far_end),
+    }
+
+    results = {}
+    for name, (chunks, references) in cases.items():
+        logging.info(f"[DspBench] {name}: {args.chunks} chunks")
+        results[name] = {
+            'legacy': bench_case(LegacyDsp(), chunks, references),
+            'capture_dsp': bench_case(CaptureDsp(), chunks, references),
+        }
+    logging.info(f"[DspBench] aec: {args.chunks} chunks, echo delay {args.echo_delay_ms} ms")
+    results['aec'] = bench_aec(args.chunks, args.echo_delay_ms)
+    logging.info(f"[DspBench] vad: {args.chunks} chunks")
+    results['vad'] = bench_vad(args.chunks)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': _git_commit(),
+        'config': {'chunks': args.chunks, 'audio_chunk': config.AUDIO_CHUNK, 'audio_rate': config.AUDIO_RATE,
+                   'aec_partitions': config.AEC_PARTITIONS},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+        logging.info(f"[DspBench] Results written to {args.output}")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,523 @@
+# bench/load_test.py
+# Bộ tạo tải cho signaling / media relay server.
+#
+# Chạy N client giả lập nói đúng giao thức thật: REGISTER, CREATE_ROOM / JOIN_ROOM
+# (kể cả REDIRECT khi server chạy nhiều worker) rồi stream AUDIO_DATA theo nhịp
+# AUDIO_CHUNK / AUDIO_RATE. Mỗi payload PCM mang một probe (client, seq, thời điểm
+# gửi) ở đầu nên bên nhận đo được độ trễ relay và số frame bị mất. Người gửi và
+# người nhận nằm trong cùng tiến trình nên không cần đồng bộ đồng hồ.
+#
+# Ví dụ:
+#   python -m bench.load_test --spawn-server eventloop --rooms 20 --clients-per-room 4 \
+#       --duration 30 --output results/eventloop.json
+#   python -m bench.load_test --host 10.0.0.5 --server-pid 1234 --transport udp
+import argparse
+import base64
+import json
+import logging
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from shared import config
+from shared.protocol import (FRAME_AUDIO, FRAME_BIND, SUPPORTED_FRAME_VERSIONS, FrameDecoder,
+                             MediaFrame, ProtocolError, decode_frame, encode_frame, encode_json)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = struct.Struct("!IIQ")  # client index | seq | perf_counter_ns lúc gửi
+FRAME_BYTES = config.AUDIO_CHUNK * config.AUDIO_SAMPLE_WIDTH * config.AUDIO_CHANNELS
+FRAME_PERIOD = config.AUDIO_CHUNK / config.AUDIO_RATE
+SETUP_TIMEOUT = 10.0
+PING_INTERVAL = 30.0
+
+
+class SyntheticClient:
+    """Một client giả lập: kết nối signaling, (tuỳ chọn) kênh UDP và thống kê nhận"""
+
+    def __init__(self, index, host, port, framing, transport):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.framing = framing        # 'binary' hoặc 'json'
+        self.transport = transport    # 'tcp' hoặc 'udp'
+        self.username = f"load{os.getpid()}_{index}"
+        self.sock = None
+        self.decoder = None
+        self.pending = []             # message đã nhận trong lúc setup nhưng chưa dùng
+        self.udp_sock = None
+        self.udp_token = None
+        self.udp_ready = False
+        self.room_id = None
+        self.send_lock = threading.Lock()
+        self.running = False
+        self.threads = []
+
+        # Thống kê (chỉ thread nhận ghi, đọc sau khi dừng)
+        self.received = 0
+        self.out_of_order = 0
+        self.latencies_ns = []
+        self.last_seq = {}            # sender index -> seq lớn nhất đã nhận
+        self.disconnected = False
+        self.measure_from_ns = None   # chỉ tính frame gửi sau thời điểm này (bỏ warm-up)
+
+    # ---- setup (đồng bộ, trước khi chạy tải) ----
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=SETUP_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.decoder = FrameDecoder()
+        self.pending = []
+        register = {'type': 'REGISTER', 'username': self.username}
+        if self.framing == 'binary':
+            register['frame_versions'] = list(SUPPORTED_FRAME_VERSIONS)
+        reply = self.request(register, ('REGISTER_SUCCESS', 'REGISTER_FAIL'))
+        if reply['type'] != 'REGISTER_SUCCESS':
+            raise RuntimeError(f"{self.username}: {reply.get('message')}")
+        if self.framing == 'binary' and not reply.get('framing'):
+            raise RuntimeError(f"{self.username}: server did not accept binary framing")
+
+    def request(self, message, expect):
+        """Gửi control message và chờ reply thuộc expect; tự xử lý REDIRECT"""
+        self.sock.sendall(encode_json(message))
+        while True:
+            reply = self._next_control()
+            if reply.get('type') == 'REDIRECT':
+                self._reconnect(int(reply['port']))
+                return self.request(reply.get('retry') or message, expect)
+            if reply.get('type') in expect:
+                return reply
+            if reply.get('type') == 'ERROR':
+                raise RuntimeError(f"{self.username}: {reply.get('message')}")
+
+    def _next_control(self):
+        deadline = time.monotonic() + SETUP_TIMEOUT
+        while True:
+            while self.pending:
+                message = self.pending.pop(0)
+                if isinstance(message, dict):
+                    return message
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{self.username}: no reply from server")
+            data = self.sock.recv(config.BUFFER_SIZE)
+            if not data:
+                raise ConnectionError(f"{self.username}: server closed connection")
+            self.pending.extend(self.decoder.feed(data))
+
+    def _reconnect(self, port):
+        try:
+            self.sock.sendall(encode_json({'type': 'GOODBYE'}))
+            self.sock.close()
+        except OSError:
+            pass
+        self.port = port
+        self.connect()
+
+    def create_room(self):
+        reply = self.request({'type': 'CREATE_ROOM'}, ('ROOM_CREATED',))
+        self._joined(reply)
+        return reply['room_id']
+
+    def join_room(self, room_id):
+        reply = self.request({'type': 'JOIN_ROOM', 'room_id': room_id}, ('JOIN_SUCCESS', 'JOIN_FAIL'))
+        if reply['type'] != 'JOIN_SUCCESS':
+            raise RuntimeError(f"{self.username}: join {room_id} failed: {reply.get('message')}")
+        self._joined(reply)
+
+    def _joined(self, reply):
+        self.room_id = reply.get('room_id')
+        if self.transport == 'udp' and reply.get('media_token'):
+            self._open_udp(reply['media_port'], reply['media_token'])
+
+    def _open_udp(self, media_port, token):
+        """Mở kênh UDP và chờ server xác nhận BIND; không được thì dùng TCP"""
+        self.udp_token = bytes.fromhex(token)
+        self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_sock.settimeout(1.0)
+        self.udp_sock.connect((self.host, int(media_port)))
+        for attempt in range(3):
+            self.send_bind(attempt)
+            try:
+                frame = decode_frame(self.udp_sock.recv(config.BUFFER_SIZE))
+            except OSError:
+                continue
+            if frame is not None and frame.type == FRAME_BIND:
+                self.udp_ready = True
+                return
+        logging.warning(f"[LoadTest] {self.username}: UDP relay did not answer, using TCP")
+
+    # ---- chạy tải ----
+
+    def start(self):
+        self.running = True
+        self.sock.settimeout(1.0)
+        targets = [self._tcp_receive_loop]
+        if self.udp_ready:
+            targets.append(self._udp_receive_loop)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+        for sock in (self.sock, self.udp_sock):
+            if sock is None:
+                continue
+            try:
+                if sock is self.sock:
+                    sock.sendall(encode_json({'type': 'GOODBYE'}))
+                sock.close()
+            except OSError:
+                pass
+
+    def send_audio(self, payload, seq):
+        if self.udp_ready:
+            self.udp_sock.send(self.udp_token + encode_frame(payload, seq=seq))
+            return
+        if self.framing == 'binary':
+            data = encode_frame(payload, seq=seq)
+        else:
+            data = encode_json({'type': 'AUDIO_DATA', 'data': base64.b64encode(payload).decode('ascii')})
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def send_bind(self, seq):
+        self.udp_sock.send(self.udp_token + encode_frame(b"", seq=seq, frame_type=FRAME_BIND))
+
+    def send_ping(self):
+        with self.send_lock:
+            self.sock.sendall(encode_json({'type': 'PING'}))
+
+    def _tcp_receive_loop(self):
+        for message in self.pending:
+            self._on_message(message)
+        self.pending = []
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not data:
+                break
+            try:
+                messages = self.decoder.feed(data)
+            except ProtocolError:
+                break
+            for message in messages:
+                self._on_message(message)
+        if self.running:
+            self.disconnected = True
+
+    def _udp_receive_loop(self):
+        while self.running:
+            try:
+                data = self.udp_sock.recv(config.BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            frame = decode_frame(data)
+            if frame is not None:
+                self._on_message(frame)
+
+    def _on_message(self, message):
+        if isinstance(message, MediaFrame):
+            if message.type == FRAME_AUDIO:
+                self._on_audio(message.payload)
+        elif message.get('type') == 'AUDIO_DATA' and 'data' in message:
+            self._on_audio(base64.b64decode(message['data']))
+
+    def _on_audio(self, payload):
+        now = time.perf_counter_ns()
+        if len(payload) < PROBE.size:
+            return
+        sender, seq, sent_ns = PROBE.unpack_from(payload)
+        if self.measure_from_ns is None or sent_ns < self.measure_from_ns:
+            return
+        self.received += 1
+        self.latencies_ns.append(now - sent_ns)
+        last = self.last_seq.get(sender)
+        if last is not None and seq <= last:
+            self.out_of_order += 1
+        else:
+            self.last_seq[sender] = seq
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def _proc_cpu_seconds(pid):
+    """CPU (user + system) của tiến trình và các tiến trình con, đọc từ /proc (Linux)"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0.0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                stack.extend(int(child) for child in f.read().split())
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def _server_cpu_seconds(pid):
+    if pid is None:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return _proc_cpu_seconds(pid) if os.path.exists(f"/proc/{pid}") else None
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+        return sum(p.cpu_times().user + p.cpu_times().system for p in processes)
+    except psutil.Error:
+        return None
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def spawn_server(args):
+    """Chạy server trong tiến trình con và chờ tới khi nhận kết nối"""
+    command = [sys.executable, '-m', 'Server.main_server', '--engine', args.spawn_server,
+               '--host', args.host, '--port', str(args.port), '--media-port', str(args.media_port),
+               '--workers', str(args.workers)]
+    log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=REPO_ROOT, stdout=log, stderr=log)
+    deadline = time.monotonic() + SETUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            socket.create_connection((args.host, args.port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start listening in time")
+
+
+def setup_clients(args):
+    """Tạo phòng và cho client tham gia; speakers_per_room client đầu mỗi phòng sẽ nói"""
+    rooms = []
+    index = 0
+    for _ in range(args.rooms):
+        members = []
+        for _ in range(args.clients_per_room):
+            client = SyntheticClient(index, args.host, args.port, args.framing, args.transport)
+            client.connect()
+            if not members:
+                room_id = client.create_room()
+            else:
+                client.join_room(room_id)
+            members.append(client)
+            index += 1
+        rooms.append(members)
+    return rooms
+
+
+def run_load(args, rooms, server_pid):
+    clients = [client for members in rooms for client in members]
+    speakers = [client for members in rooms for client in members[:args.speakers_per_room]]
+    fanout = {client.index: len(members) - 1 for members in rooms for client in members}
+    sent = {client.index: 0 for client in speakers}
+    padding = bytes(FRAME_BYTES - PROBE.size)
+
+    for client in clients:
+        client.start()
+
+    stop = threading.Event()
+    overruns = [0]
+    send_errors = [0]
+    measure = {}
+
+    def sender():
+        seq = 0
+        next_tick = time.perf_counter()
+        measure_start = next_tick + args.warmup
+        next_keepalive = next_tick + config.UDP_KEEPALIVE_INTERVAL
+        next_ping = next_tick + PING_INTERVAL
+        while not stop.is_set():
+            now = time.perf_counter()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                continue
+            if 'start_ns' not in measure and now >= measure_start:
+                measure['start_ns'] = time.perf_counter_ns()
+                measure['start'] = time.monotonic()
+                measure['cpu'] = _server_cpu_seconds(server_pid)
+                for client in clients:
+                    client.measure_from_ns = measure['start_ns']
+            seq += 1
+            for client in speakers:
+                payload = PROBE.pack(client.index, seq, time.perf_counter_ns()) + padding
+                try:
+                    client.send_audio(payload, seq)
+                except OSError:
+                    send_errors[0] += 1
+                    continue
+                if 'start_ns' in measure:
+                    sent[client.index] += 1
+            if now >= next_keepalive:
+                next_keepalive = now + config.UDP_KEEPALIVE_INTERVAL
+                for client in clients:
+                    if client.udp_ready:
+                        client.send_bind(seq)
+            if now >= next_ping:
+                next_ping = now + PING_INTERVAL
+                for client in clients:
+                    try:
+                        client.send_ping()
+                    except OSError:
+                        pass
+            next_tick += FRAME_PERIOD
+            if time.perf_counter() > next_tick:
+                # Máy tạo tải không theo kịp nhịp: đặt lại thay vì gửi dồn
+                overruns[0] += 1
+                next_tick = time.perf_counter() + FRAME_PERIOD
+
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+    time.sleep(args.warmup + args.duration)
+    stop.set()
+    thread.join()
+    elapsed = time.monotonic() - measure['start']
+    cpu_end = _server_cpu_seconds(server_pid)
+    time.sleep(args.drain)  # chờ các frame đang trên đường tới
+    for client in clients:
+        client.stop()
+
+    latencies = sorted(ns for client in clients for ns in client.latencies_ns)
+    expected = sum(sent[index] * fanout[index] for index in sent)
+    received = sum(client.received for client in clients)
+    cpu_seconds = None
+    if measure['cpu'] is not None and cpu_end is not None:
+        cpu_seconds = cpu_end - measure['cpu']
+
+    def ms(value):
+        return None if value is None else round(value / 1e6, 3)
+
+    return {
+        'duration_s': round(elapsed, 3),
+        'clients': len(clients),
+        'rooms': len(rooms),
+        'speakers': len(speakers),
+        'udp_clients': sum(1 for client in clients if client.udp_ready),
+        'frames_sent': sum(sent.values()),
+        'frames_expected': expected,
+        'frames_received': received,
+        'frames_dropped': max(0, expected - received),
+        'drop_ratio': round(1 - received / expected, 6) if expected else None,
+        'out_of_order': sum(client.out_of_order for client in clients),
+        'forwarded_frames_per_s': round(received / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': ms(_percentile(latencies, 50)),
+            'p95': ms(_percentile(latencies, 95)),
+            'p99': ms(_percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+            'mean': ms(sum(latencies) / len(latencies) if latencies else None),
+        },
+        'server_cpu_seconds': round(cpu_seconds, 3) if cpu_seconds is not None else None,
+        'server_cpu_percent': round(100.0 * cpu_seconds / elapsed, 1) if cpu_seconds is not None and elapsed else None,
+        'sender_overruns': overruns[0],
+        'send_errors': send_errors[0],
+        'disconnects': sum(1 for client in clients if client.disconnected),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="VoiceChat load generator / benchmark")
+    parser.add_argument('--host', default='127.0.0.1', help="Địa chỉ server")
+    parser.add_argument('--port', type=int, default=config.PORT_SIGNALING, help="Cổng signaling")
+    parser.add_argument('--media-port', type=int, default=config.PORT_AUDIO,
+                        help="Cổng UDP media (chỉ dùng với --spawn-server)")
+    parser.add_argument('--rooms', type=int, default=10, help="Số phòng")
+    parser.add_argument('--clients-per-room', type=int, default=4, help="Số client mỗi phòng")
+    parser.add_argument('--speakers-per-room', type=int, default=1, help="Số client nói trong mỗi phòng")
+    parser.add_argument('--duration', type=float, default=20.0, help="Thời gian đo (giây)")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Thời gian chạy trước khi bắt đầu đo (giây)")
+    parser.add_argument('--drain', type=float, default=1.0, help="Thời gian chờ frame cuối sau khi dừng gửi (giây)")
+    parser.add_argument('--framing', choices=['binary', 'json'], default='binary',
+                        help="Media frame nhị phân hoặc AUDIO_DATA JSON base64 (client cũ)")
+    parser.add_argument('--transport', choices=['tcp', 'udp'], default='tcp',
+                        help="Gửi/nhận audio qua TCP signaling hoặc UDP relay")
+    parser.add_argument('--spawn-server', choices=['threaded', 'eventloop'],
+                        help="Tự chạy server với engine này và đo CPU của nó")
+    parser.add_argument('--workers', type=int, default=1, help="Số worker khi dùng --spawn-server")
+    parser.add_argument('--server-log', help="File ghi log của server khi dùng --spawn-server")
+    parser.add_argument('--server-pid', type=int, help="PID server đang chạy sẵn (để đo CPU)")
+    parser.add_argument('--output', help="Ghi kết quả JSON vào file này")
+    args = parser.parse_args(argv)
+    if args.clients_per_room < 2:
+        parser.error("--clients-per-room must be at least 2")
+    if not 1 <= args.speakers_per_room <= args.clients_per_room:
+        parser.error("--speakers-per-room must be between 1 and --clients-per-room")
+    if args.transport == 'udp' and args.framing != 'binary':
+        parser.error("--transport udp requires --framing binary")
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args(argv)
+
+    server = spawn_server(args) if args.spawn_server else None
+    server_pid = server.pid if server else args.server_pid
+    try:
+        logging.info(f"[LoadTest] Connecting {args.rooms * args.clients_per_room} clients "
+                     f"({args.rooms} rooms x {args.clients_per_room})")
+        rooms = setup_clients(args)
+        logging.info(f"[LoadTest] Running for {args.duration}s (warm-up {args.warmup}s)")
+        results = run_load(args, rooms, server_pid)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': _git_commit(),
+        'config': {
+            'engine': args.spawn_server, 'workers': args.workers if args.spawn_server else None,
+            'rooms': args.rooms, 'clients_per_room': args.clients_per_room,
+            'speakers_per_room': args.speakers_per_room, 'framing': args.framing,
+            'transport': args.transport, 'duration_s': args.duration,
+            'audio_chunk': config.AUDIO_CHUNK, 'audio_rate': config.AUDIO_RATE,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+        logging.info(f"[LoadTest] Results written to {args.output}")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+# bench/pipeline_bench.py
+# Benchmark đầu-cuối cho pipeline audio của client.
+#
+# Chạy các AudioHandler + NetworkHandler thật (không phải client giả lập như
+# load_test) trên thiết bị ảo (Client/audio_devices.py) qua một server cục bộ:
+# mic -> _process_audio_chunk (AEC + CaptureDsp) -> VAD/DTX -> encode -> framing
+# của NetworkHandler / UDP -> server relay -> handle_audio_data (decode + jitter
+# buffer) -> next_playback_chunk (trộn) -> loa. Mỗi phòng có --speakers-per-room
+# người nói (giọng tổng hợp: 200 ms nói mỗi giây, lệch nhau 250 ms), mọi client
+# đều thu và phát như ứng dụng thật.
+#
+# Báo cáo:
+# - live: thời gian từng giai đoạn (bọc method của các instance đang chạy), độ trễ
+#   miệng-tai (chunk bắt đầu có tiếng ở mic -> chunk đó ra loa người nghe, không
+#   tính bộ đệm phần cứng), thời gian relay, CPU client / server và số luồng mỗi core.
+# - stages: chạy lại từng giai đoạn trên một thread, không mạng, để có thời gian
+#   mỗi chunk không bị nhiễu bởi GIL và bộ nhớ tạm cấp phát đỉnh mỗi chunk (tracemalloc).
+#
+# Ví dụ:
+#   python -m bench.pipeline_bench
+#   python -m bench.pipeline_bench --rooms 8 --clients-per-room 3 --duration 20 \
+#       --output results/pipeline.json
+#   python -m bench.pipeline_bench --spawn-server eventloop --transport tcp --codec pcm
+import argparse
+import json
+import logging
+import os
+import queue
+import time
+import tracemalloc
+
+import numpy as np
+
+from shared import config
+from shared.protocol import CODEC_IDS, FRAME_VERSION, encode_frame, media_timestamp
+from Client.audio_codecs import available_codecs
+from Client.audio_devices import LoopbackBackend, SyntheticBackend
+from Client.audio_handler import AudioHandler
+from Client.network_handler import NetworkHandler
+from bench.load_test import _git_commit, _percentile, _server_cpu_seconds, spawn_server
+
+FRAME_PERIOD = config.AUDIO_CHUNK / config.AUDIO_RATE
+SETUP_TIMEOUT = 10.0
+ONSET_LEVEL = 1000      # biên độ đỉnh: chunk có tiếng nói
+ONSET_QUIET_CHUNKS = 4  # số chunk yên lặng liền trước để coi là bắt đầu một đoạn nói
+BURST_TALK = 0.2        # giây nói mỗi chu kỳ của người nói tổng hợp
+BURST_CYCLE = 1.0
+SPEAKER_OFFSET = 0.25   # lệch pha giữa các người nói trong một phòng (không nói chồng)
+
+# Các giai đoạn không lồng nhau (tổng = thời gian pipeline mỗi chunk); 'decode' nằm trong 'receive'
+TOP_STAGES = ('capture_dsp', 'vad', 'encode', 'send', 'receive', 'jitter_mix', 'playback_reference')
+
+
+class ProbeDevice(SyntheticBackend):
+    """Thiết bị ảo ghi lại thời điểm bắt đầu mỗi đoạn nói ở mic và ở loa"""
+
+    def __init__(self, talking, offset=0.0, seed=None):
+        super().__init__(kind="speech", amplitude=6000.0 if talking else 0.0,
+                         talk=BURST_TALK, pause=BURST_CYCLE - BURST_TALK, seed=seed)
+        self.position = int((BURST_CYCLE - offset) * config.AUDIO_RATE) % int(BURST_CYCLE * config.AUDIO_RATE)
+        self.capture_onsets = []    # perf_counter lúc mẫu đầu của chunk có tiếng được thu
+        self.playback_onsets = []   # perf_counter lúc chunk có tiếng bắt đầu phát
+        self.quiet_in = ONSET_QUIET_CHUNKS
+        self.quiet_out = ONSET_QUIET_CHUNKS
+
+    def capture(self, frames):
+        data = super().capture(frames)
+        now = time.perf_counter()
+        if np.abs(np.frombuffer(data, dtype=np.int16)).max() > ONSET_LEVEL:
+            if self.quiet_in >= ONSET_QUIET_CHUNKS:
+                self.capture_onsets.append(now - frames / config.AUDIO_RATE)
+            self.quiet_in = 0
+        else:
+            self.quiet_in += 1
+        return data
+
+    def playback(self, data):
+        super().playback(data)
+        if np.abs(np.frombuffer(data, dtype=np.int16)).max() > ONSET_LEVEL:
+            if self.quiet_out >= ONSET_QUIET_CHUNKS:
+                self.playback_onsets.append(time.perf_counter())
+            self.quiet_out = 0
+        else:
+            self.quiet_out += 1
+
+
+class StageTimer:
+    """Bọc method của các instance đang chạy để đo thời gian mỗi lần gọi (theo giai đoạn)"""
+
+    def __init__(self):
+        self.samples = {}    # giai đoạn -> [ns]
+        self.patched = []
+        self.sent_at = {}    # (người gửi, seq) -> perf_counter_ns lúc gửi xong
+        self.relay_ns = []
+
+    def _record(self, stage, elapsed):
+        self.samples.setdefault(stage, []).append(elapsed)
+
+    def wrap(self, obj, attr, stage):
+        original = getattr(obj, attr)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter_ns()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self._record(stage(*args, **kwargs) if callable(stage) else stage,
+                             time.perf_counter_ns() - started)
+
+        setattr(obj, attr, timed)
+        self.patched.append((obj, attr))
+
+    def instrument(self, handler):
+        self.wrap(handler, '_process_audio_chunk',
+                  lambda data, is_input=True: 'capture_dsp' if is_input else 'playback_reference')
+        if handler.vad:
+            self.wrap(handler.vad, 'update', 'vad')
+        self.wrap(handler.encoder, 'encode', 'encode')
+        self.wrap(handler, '_decode_payload', 'decode')
+        self.wrap(handler, 'next_playback_chunk', 'jitter_mix')
+        self._wrap_send(handler)
+        self._wrap_receive(handler)
+
+    def _wrap_send(self, handler):
+        original = handler._send_payload
+        network = handler.network_handler
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter_ns()
+            result = original(*args, **kwargs)
+            done = time.perf_counter_ns()
+            self._record('send', done - started)
+            self.sent_at[(network.username, network.audio_seq)] = done
+            return result
+
+        handler._send_payload = timed
+        self.patched.append((handler, '_send_payload'))
+
+    def _wrap_receive(self, handler):
+        original = handler.handle_audio_data
+
+        def timed(message):
+            started = time.perf_counter_ns()
+            sent = self.sent_at.get((message.get('from'), message.get('seq')))
+            if sent is not None:
+                self.relay_ns.append(started - sent)
+            original(message)
+            self._record('receive', time.perf_counter_ns() - started)
+
+        handler.handle_audio_data = timed
+        self.patched.append((handler, 'handle_audio_data'))
+
+    def clear(self):
+        self.samples = {}
+        self.relay_ns = []
+
+    def restore(self):
+        for obj, attr in self.patched:
+            delattr(obj, attr)
+        self.patched = []
+
+
+def _ms(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        'p50': round(_percentile(values, 50) * 1000, 2),
+        'p95': round(_percentile(values, 95) * 1000, 2),
+        'max': round(values[-1] * 1000, 2),
+        'mean': round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+class PipelineClient:
+    """Một client thật (NetworkHandler + AudioHandler) trên ProbeDevice"""
+
+    def __init__(self, index, args, talking, offset):
+        self.username = f"pipe{os.getpid()}_{index}"
+        self.talking = talking
+        self.device = ProbeDevice(talking, offset, seed=index)
+        self.network = NetworkHandler(args.host, args.port)
+        self.audio = AudioHandler(self.network, callback_mode=not args.blocking, backend=self.device)
+        self.network.set_audio_handler(self.audio)
+        self.messages = queue.Queue()
+        self.network.set_callback(self.messages.put)
+
+    def connect(self):
+        success, status = self.network.connect(self.username)
+        if not success:
+            raise RuntimeError(f"{self.username}: {status}")
+
+    def request(self, message, expect):
+        self.network.send_message(message)
+        deadline = time.monotonic() + SETUP_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                reply = self.messages.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if reply.get('type') in expect:
+                return reply
+        raise TimeoutError(f"{self.username}: no {'/'.join(expect)} from server")
+
+    def start(self):
+        self.audio.start_playback()
+        self.audio.start_recording()
+
+    def stop(self):
+        self.audio.stop_recording()
+        self.audio.stop_playback()
+
+    def close(self):
+        self.audio.cleanup()
+        self.network.disconnect()
+
+
+def setup_clients(args):
+    rooms = []
+    index = 0
+    for _ in range(args.rooms):
+        members = []
+        for i in range(args.clients_per_room):
+            client = PipelineClient(index, args, talking=i < args.speakers_per_room,
+                                    offset=i * SPEAKER_OFFSET)
+            client.connect()
+            if not members:
+                room_id = client.request({'type': 'CREATE_ROOM'}, ('ROOM_CREATED',))['room_id']
+            else:
+                reply = client.request({'type': 'JOIN_ROOM', 'room_id': room_id}, ('JOIN_SUCCESS', 'JOIN_FAIL'))
+                if reply['type'] != 'JOIN_SUCCESS':
+                    raise RuntimeError(f"{client.username}: join failed: {reply.get('message')}")
+            members.append(client)
+            index += 1
+        rooms.append(members)
+    time.sleep(0.5)   # ROOM_CODEC / BIND UDP của người vào sau cùng
+    return rooms
+
+
+def _mouth_to_ear(rooms, since):
+    """Mỗi đoạn nói bắt đầu ở loa người nghe được ghép với đoạn bắt đầu gần nhất trước đó
+    ở mic của những người nói khác cùng phòng"""
+    latencies = []
+    for members in rooms:
+        for client in members:
+            onsets = sorted(t for other in members if other.talking and other is not client
+                            for t in other.device.capture_onsets)
+            for heard in client.device.playback_onsets:
+                spoken = [t for t in onsets if t <= heard]
+                if spoken and spoken[-1] >= since and heard - spoken[-1] < SPEAKER_OFFSET:
+                    latencies.append(heard - spoken[-1])
+    return latencies
+
+
+def run_pipeline(args, rooms, server_pid):
+    clients = [client for members in rooms for client in members]
+    timer = StageTimer()
+    if args.codec:
+        for client in clients:
+            client.audio.set_send_codec(args.codec)
+    for client in clients:
+        timer.instrument(client.audio)
+    for client in clients:
+        client.start()
+
+    time.sleep(args.warmup)
+    timer.clear()
+    started = time.perf_counter()
+    cpu_start = time.process_time()
+    server_cpu_start = _server_cpu_seconds(server_pid)
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_start
+    server_cpu_end = _server_cpu_seconds(server_pid)
+    # Thống kê jitter buffer phải lấy trước khi dừng phát (stop_playback xóa các buffer)
+    client_stats = [client.audio.get_audio_stats() for client in clients]
+    for client in clients:
+        client.stop()
+    timer.restore()
+
+    chunks = len(clients) * elapsed / FRAME_PERIOD   # chu kỳ chunk của mọi client
+    stages = {}
+    for stage, samples in timer.samples.items():
+        samples.sort()
+        stages[stage] = {
+            'calls': len(samples),
+            'p50_us': round(_percentile(samples, 50) / 1e3, 2),
+            'p99_us': round(_percentile(samples, 99) / 1e3, 2),
+            'per_chunk_us': round(sum(samples) / 1e3 / chunks, 2),
+        }
+    pipeline_us = sum(stages[s]['per_chunk_us'] for s in TOP_STAGES if s in stages)
+
+    totals = {key: 0 for key in ('sent', 'suppressed', 'comfort_noise', 'received', 'dropped')}
+    buffers = {key: 0 for key in ('concealed', 'late', 'underruns', 'comfort_noise')}
+    targets = []
+    for stats in client_stats:
+        for key in totals:
+            totals[key] += stats.get(key, 0)
+        for stream in stats['streams'].values():
+            buffer = stream.get('buffer', {})
+            for key in buffers:
+                buffers[key] += buffer.get(key, 0)
+            if 'target_frames' in buffer:
+                targets.append(buffer['target_frames'])
+
+    server_cpu = None
+    if server_cpu_start is not None and server_cpu_end is not None:
+        server_cpu = server_cpu_end - server_cpu_start
+    speakers = sum(1 for client in clients if client.talking)
+    return {
+        'duration_s': round(elapsed, 3),
+        'clients': len(clients),
+        'speakers': speakers,
+        'udp_clients': sum(1 for c in clients if c.audio.udp_channel and c.audio.udp_channel.is_ready()),
+        'send_codec': clients[0].audio.encoder.name,
+        'stages': stages,
+        # Thời gian thực (wall) trong các thread đang tranh GIL: gồm cả thời gian chờ, không phải CPU
+        'pipeline_wall_us_per_chunk': round(pipeline_us, 2),
+        'mouth_to_ear_ms': _ms(_mouth_to_ear(rooms, started)),
+        'relay_ms': _ms([ns / 1e9 for ns in timer.relay_ns]),
+        'jitter_target_frames_mean': round(sum(targets) / len(targets), 2) if targets else None,
+        'client_cpu_percent': round(100.0 * cpu / elapsed, 1),
+        'client_cpu_percent_per_client': round(100.0 * cpu / elapsed / len(clients), 2),
+        'clients_per_core': round(elapsed * len(clients) / cpu, 1) if cpu else None,
+        'server_cpu_percent': round(100.0 * server_cpu / elapsed, 1) if server_cpu is not None else None,
+        'server_streams_per_core': (round(elapsed * speakers / server_cpu, 1)
+                                    if server_cpu and speakers else None),
+        'frames': totals,
+        'jitter_buffers': buffers,
+        'capture_overruns': sum(c.audio.capture_ring.overruns for c in clients if c.audio.capture_ring),
+    }
+
+
+def bench_stages(args, chunks):
+    """Từng giai đoạn trên một thread, không mạng: thời gian (µs) và bộ nhớ tạm đỉnh (byte) mỗi chunk"""
+    speaker = AudioHandler(backend=LoopbackBackend(realtime=False))
+    listener = AudioHandler(backend=LoopbackBackend(realtime=False))
+    # Mặc định: codec server sẽ chọn khi mọi client đều là client này
+    speaker.set_send_codec(args.codec or next(c for c in config.AUDIO_CODECS if c in available_codecs()))
+    encoder = speaker.encoder
+    mic = SyntheticBackend(kind="speech", seed=1, realtime=False)
+    far = SyntheticBackend(kind="speech", amplitude=3000.0, seed=2, realtime=False)
+    state = {'seq': 0, 'timestamp': media_timestamp()}
+
+    def run_chunk(measure):
+        # Tham chiếu loa cho AEC của người nói (không đo): để bộ lọc chạy như khi có người nghe nói
+        speaker._process_audio_chunk(far.capture(config.AUDIO_CHUNK), is_input=False)
+        state['seq'] += 1
+        state['timestamp'] = (state['timestamp'] + config.AUDIO_CHUNK) & 0xFFFFFFFF
+        data = mic.capture(config.AUDIO_CHUNK)
+        data = measure('capture_dsp', speaker._process_audio_chunk, data) or data
+        if speaker.vad:
+            measure('vad', speaker.vad.update, data)
+        payload = measure('encode', encoder.encode, data)
+        measure('framing', encode_frame, payload, seq=state['seq'], flags=encoder.codec_id,
+                timestamp=state['timestamp'], version=FRAME_VERSION)
+        measure('receive', listener.handle_audio_data,
+                {'type': 'AUDIO_DATA', 'from': 'speaker', 'seq': state['seq'],
+                 'timestamp': state['timestamp'], 'codec': encoder.codec_id, 'pcm': payload})
+        out = measure('jitter_mix', listener.next_playback_chunk) or listener.silence
+        measure('playback_reference', listener._process_audio_chunk, out, is_input=False)
+
+    times = {}
+
+    def timed(stage, func, *a, **kw):
+        started = time.perf_counter()
+        result = func(*a, **kw)
+        times.setdefault(stage, []).append(time.perf_counter() - started)
+        return result
+
+    for _ in range(chunks):
+        run_chunk(timed)
+
+    peaks = {}
+
+    def traced(stage, func, *a, **kw):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        result = func(*a, **kw)
+        peaks[stage] = max(peaks.get(stage, 0), tracemalloc.get_traced_memory()[1] - base)
+        return result
+
+    tracemalloc.start()
+    for _ in range(min(chunks, 200)):
+        run_chunk(traced)
+    tracemalloc.stop()
+    speaker.cleanup()
+    listener.cleanup()
+
+    stages = {}
+    for stage, samples in times.items():
+        median = float(np.median(samples))
+        stages[stage] = {
+            'p50_us': round(median * 1e6, 2),
+            'p99_us': round(float(np.percentile(samples, 99)) * 1e6, 2),
+            'frame_budget_percent': round(median / FRAME_PERIOD * 100, 3),
+            'peak_temp_bytes': peaks.get(stage, 0),
+        }
+    total = sum(s['p50_us'] for s in stages.values())
+    return {
+        'codec': encoder.name,
+        'stages': stages,
+        'total_p50_us': round(total, 2),
+        'peak_temp_bytes_per_chunk': sum(s['peak_temp_bytes'] for s in stages.values()),
+        'streams_per_core': round(FRAME_PERIOD * 1e6 / total, 1) if total else None,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end client audio pipeline benchmark")
+    parser.add_argument('--host', default='127.0.0.1', help="Địa chỉ server")
+    parser.add_argument('--port', type=int, default=config.PORT_SIGNALING, help="Cổng signaling")
+    parser.add_argument('--media-port', type=int, default=config.PORT_AUDIO,
+                        help="Cổng UDP media (chỉ dùng khi tự chạy server)")
+    parser.add_argument('--spawn-server', choices=['threaded', 'eventloop', 'none'], default='threaded',
+                        help="Tự chạy server với engine này ('none' = dùng server đang chạy ở --host/--port)")
+    parser.add_argument('--workers', type=int, default=1, help="Số worker khi tự chạy server")
+    parser.add_argument('--server-log', help="File ghi log của server khi tự chạy server")
+    parser.add_argument('--server-pid', type=int, help="PID server đang chạy sẵn (để đo CPU)")
+    parser.add_argument('--rooms', type=int, default=1, help="Số phòng")
+    parser.add_argument('--clients-per-room', type=int, default=2, help="Số client mỗi phòng")
+    parser.add_argument('--speakers-per-room', type=int, default=1, help="Số client nói trong mỗi phòng")
+    parser.add_argument('--duration', type=float, default=10.0, help="Thời gian đo (giây)")
+    parser.add_argument('--warmup', type=float, default=3.0,
+                        help="Thời gian chạy trước khi đo (giây): jitter buffer, AEC, nền nhiễu VAD ổn định")
+    parser.add_argument('--transport', choices=['udp', 'tcp'], default='udp', help="Đường gửi audio")
+    parser.add_argument('--codec', choices=sorted(CODEC_IDS), help="Ép codec gửi (mặc định: codec server chọn)")
+    parser.add_argument('--blocking', action='store_true', help="Dùng read()/write() chặn thay cho chế độ callback")
+    parser.add_argument('--no-aec', action='store_true', help="Tắt khử vọng âm")
+    parser.add_argument('--no-vad', action='store_true', help="Tắt VAD/DTX")
+    parser.add_argument('--stage-chunks', type=int, default=2000, help="Số chunk cho phần đo từng giai đoạn")
+    parser.add_argument('--output', help="Ghi kết quả JSON vào file này")
+    args = parser.parse_args(argv)
+    if args.clients_per_room < 2:
+        parser.error("--clients-per-room must be at least 2")
+    if not 1 <= args.speakers_per_room <= min(args.clients_per_room, int(BURST_CYCLE / SPEAKER_OFFSET)):
+        parser.error(f"--speakers-per-room must be between 1 and min(--clients-per-room, "
+                     f"{int(BURST_CYCLE / SPEAKER_OFFSET)})")
+    if args.codec == 'cn':
+        parser.error("--codec cn is not an audio codec")
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args(argv)
+    config.AEC_ENABLED = not args.no_aec
+    config.VAD_ENABLED = not args.no_vad
+    config.UDP_MEDIA_ENABLED = args.transport == 'udp'
+
+    logging.info(f"[PipelineBench] stages: {args.stage_chunks} chunks")
+    stage_results = bench_stages(args, args.stage_chunks)
+
+    server = spawn_server(args) if args.spawn_server != 'none' else None
+    server_pid = server.pid if server else args.server_pid
+    rooms = []
+    try:
+        logging.info(f"[PipelineBench] Connecting {args.rooms * args.clients_per_room} clients "
+                    f"({args.rooms} rooms x {args.clients_per_room})")
+        rooms = setup_clients(args)
+        logging.info(f"[PipelineBench] Running for {args.duration}s (warm-up {args.warmup}s)")
+        live = run_pipeline(args, rooms, server_pid)
+    finally:
+        for client in (c for members in rooms for c in members):
+            client.close()
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': _git_commit(),
+        'config': {
+            'engine': None if args.spawn_server == 'none' else args.spawn_server,
+            'rooms': args.rooms, 'clients_per_room': args.clients_per_room,
+            'speakers_per_room': args.speakers_per_room, 'transport': args.transport,
+            'callback_mode': not args.blocking, 'aec': config.AEC_ENABLED, 'vad': config.VAD_ENABLED,
+            'duration_s': args.duration, 'audio_chunk': config.AUDIO_CHUNK, 'audio_rate': config.AUDIO_RATE,
+        },
+        'results': {'stages': stage_results, 'live': live},
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+        logging.info(f"[PipelineBench] Results written to {args.output}")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
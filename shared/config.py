@@ -19,7 +19,90 @@ AUDIO_FORMAT = 2       # pyaudio.paInt16
 # Socket/timeouts
 SOCKET_TIMEOUT = 5.0
 CONNECTION_TIMEOUT = 10.0
+CLIENT_IDLE_TIMEOUT = 120.0   # server xóa client không hoạt động quá N giây
+IDLE_CHECK_INTERVAL = 1.0     # độ phân giải (tick) của timing wheel
+QUEUE_STATS_LOG_INTERVAL = 30.0
+
+# Trace đường nóng (mỗi gói audio), tắt mặc định - xem shared/tracing.py
+# Ví dụ: "server.forward=100,client.*=5/s" (ghi đè bằng biến môi trường VOICECHAT_TRACE)
+TRACE = ""
+
+# Server engine: "threaded" (1 thread / client) hoặc "eventloop" (selectors, 1 thread)
+SERVER_ENGINE = "threaded"
+EVENT_LOOP_BACKLOG = 1024
+SERVER_WORKERS = 1   # >1: supervisor chạy N tiến trình, mỗi phòng thuộc một tiến trình
+
+# Endpoint metrics (Prometheus text format) - tắt khi METRICS_PORT = None
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+
+# Hàng đợi gửi của mỗi client trên server
+SEND_QUEUE_MAX_MEDIA = 25              # ~400ms audio; đầy thì bỏ frame cũ nhất
+SEND_QUEUE_MAX_CONTROL = 1000          # control message không bao giờ bị bỏ
+SEND_QUEUE_OVERFLOW_DISCONNECT = 5.0   # tràn liên tục quá N giây -> ngắt kết nối
+SEND_COALESCE_DELAY = 0.002            # chờ tối đa N giây để gom nhiều frame vào một sendmsg (0 = không chờ)
+SEND_COALESCE_MAX_FRAMES = 64          # số buffer tối đa trong một sendmsg (< IOV_MAX)
+
+# Phòng chế độ "mix": server trộn âm (cần numpy trên server)
+MIXER_MAX_BUFFERED = 4   # số frame tối đa đệm cho mỗi người nói
+
+# Phòng chế độ "forward" có max_speakers: chỉ chuyển tiếp K người nói to nhất
+ACTIVE_SPEAKERS_MAX = 0              # mặc định khi CREATE_ROOM không ghi max_speakers (0 = tắt)
+ACTIVE_SPEAKER_SMOOTHING = 0.3       # hệ số EMA của mức năng lượng mỗi frame
+ACTIVE_SPEAKER_HYSTERESIS = 1.5      # người mới phải to hơn N lần người nhỏ nhất mới thay được
+ACTIVE_SPEAKER_HOLD = 0.5            # giây tối thiểu giữ chỗ trước khi bị thay
+ACTIVE_SPEAKER_HANGOVER = 1.0        # im lặng quá N giây thì bị bỏ khỏi tập người nói
+
+# Codec audio theo thứ tự ưu tiên: server chọn codec đầu tiên mà mọi người trong phòng hỗ trợ
+# (phòng mix / giới hạn người nói luôn dùng pcm vì server phải đọc mẫu âm thanh)
+AUDIO_CODECS = ("opus", "adpcm", "ulaw", "pcm")
+OPUS_BITRATE = 24000
+
+# Thiết bị âm thanh của client (Client/audio_devices.py): "pyaudio" (card âm thanh thật),
+# "wav", "loopback" hoặc "synthetic" (máy headless / CI, đo tải). Không có PyAudio -> loopback
+AUDIO_BACKEND = "pyaudio"
+
+# Chế độ callback của PyAudio (độ trễ thấp); False = read()/write() chặn trên thread riêng
+AUDIO_CALLBACK_MODE = True
+CAPTURE_RING_FRAMES = 8    # chunk mic chờ xử lý tối đa (đầy thì bỏ chunk cũ nhất)
+PLAYBACK_RING_FRAMES = 2   # chunk chuẩn bị sẵn cho loa (~32 ms)
+
+# Khử vọng âm (AEC) phía client: bộ lọc NLMS miền tần số, tham chiếu là âm thanh phát ra loa
+AEC_ENABLED = True                 # False = dùng lại cổng tương quan cũ (bỏ cả chunk khi giống loa)
+AEC_PARTITIONS = 4                 # độ dài bộ lọc = N x AUDIO_CHUNK mẫu (~64 ms đuôi vọng)
+AEC_STEP_SIZE = 0.5                # bước NLMS (0..1): lớn hội tụ nhanh hơn nhưng nhiễu hơn
+AEC_MAX_DELAY = 0.25               # độ trễ loa -> mic tối đa được dò (giây)
+AEC_DELAY_INTERVAL = 1.0           # ước lượng lại độ trễ mỗi N giây
+AEC_DELAY_CONFIDENCE = 8.0         # đỉnh GCC-PHAT phải gấp N lần trung bình mới nhận độ trễ
+AEC_DOUBLE_TALK_THRESHOLD = 0.5    # Geigel: mic > N x đỉnh loa gần đây -> người gần đang nói
+
+# Jitter buffer phía client (mỗi người gửi một buffer, đơn vị: frame AUDIO_CHUNK = 16 ms)
+JITTER_MIN_FRAMES = 1
+JITTER_MAX_FRAMES = 10       # ~160 ms
+JITTER_INITIAL_FRAMES = 3    # độ sâu khi chưa đo được jitter
+JITTER_FACTOR = 4.0          # độ sâu mục tiêu = JITTER_FACTOR x jitter ước lượng
+JITTER_DRAIN_MARGIN = 3      # đệm dư quá N frame so với mục tiêu thì bỏ frame cũ để giảm trễ
+JITTER_STREAM_TIMEOUT = 5.0  # xóa buffer của người gửi im lặng quá N giây
+PLC_MAX_FRAMES = 3           # số frame mất liên tiếp tối đa được che bằng frame trước
+PLC_FADE = 0.5               # hệ số âm lượng cho mỗi frame che liên tiếp
+
+# VAD + DTX phía client: không gửi khi không nói, thỉnh thoảng gửi gói comfort noise (CN)
+VAD_ENABLED = True                 # False = dùng lại cổng im lặng theo biên độ đỉnh (SILENCE_THRESHOLD)
+VAD_ENERGY_MARGIN_DB = 9.0         # chunk phải cao hơn nền nhiễu N dB mới có thể là giọng nói
+VAD_FLATNESS_MAX = 0.3             # độ phẳng phổ dưới mức này = có họa âm (giọng hữu thanh)
+VAD_ONSET_FRAMES = 2               # số chunk liên tiếp để bắt đầu nói (tiếng click một chunk bị bỏ)
+VAD_ONSET_UNVOICED_FRAMES = 4      # ... hoặc N chunk liên tiếp không cần họa âm (phụ âm xát "s", "x")
+VAD_PREROLL_FRAMES = 4             # số chunk ngay trước lúc xác nhận được gửi bù (không cắt đầu từ)
+VAD_HANGOVER_FRAMES = 15           # giữ trạng thái nói thêm N chunk (~240 ms, không cắt cuối từ)
+VAD_NOISE_WINDOW = 125             # nền nhiễu = năng lượng nhỏ nhất trong N chunk gần nhất (~2 s)
+VAD_MIN_NOISE_DB = -75.0           # sàn nền nhiễu (dBFS) khi mic gần như im lặng tuyệt đối
+DTX_SID_INTERVAL = 25              # khi im lặng: một gói comfort noise mỗi N chunk (~400 ms)
 
 #  Thêm cấu hình mới cho audio processing
 AUDIO_SAMPLE_WIDTH = 2  # 16-bit = 2 bytes
-SILENCE_THRESHOLD = 100  # Ngưỡng silence detection
\ No newline at end of file
+SILENCE_THRESHOLD = 100  # Ngưỡng silence detection
+
+# UDP media relay (PORT_AUDIO) - TCP signaling vẫn là đường dự phòng
+UDP_MEDIA_ENABLED = True
+UDP_KEEPALIVE_INTERVAL = 2.0   # client gửi BIND định kỳ để giữ NAT mapping
+UDP_SESSION_TIMEOUT = 10.0     # không nhận gì qua UDP trong khoảng này -> quay về TCP
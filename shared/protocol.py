@@ -0,0 +1,268 @@
+# shared/protocol.py
+# Framing dùng chung cho client & server.
+#
+# Trên cùng một kết nối TCP có hai loại message:
+#   - Control: JSON một dòng, kết thúc bằng "\n" (REGISTER, JOIN_ROOM, PING...)
+#   - Media:   frame nhị phân, byte đầu tiên là FRAME_MAGIC (không thể là đầu
+#              của một dòng JSON), payload là PCM thô - không base64.
+#
+# Header media frame (network byte order):
+#   v1: magic:u8 | version:u8 | type:u8 | flags:u8 | sender_id:u16 | sequence:u32 | length:u16
+#   v2: magic:u8 | version:u8 | type:u8 | flags:u8 | sender_id:u16 | sequence:u32 | timestamp:u32 | length:u16
+# Client gửi sender_id = 0, server ghi user_id của người gửi trước khi chuyển tiếp.
+# sequence tăng 1 mỗi frame của một người gửi; timestamp (v2) là đồng hồ mẫu
+# (đơn vị: mẫu AUDIO_RATE) lúc thu, gốc là giờ hệ thống nên bên nhận ước lượng
+# được độ trễ đầu-cuối khi đồng hồ các máy đã đồng bộ (NTP).
+# 4 bit thấp của flags (frame audio) là codec của payload (0 = PCM int16 thô);
+# AUDIO_DATA JSON dùng field "codec" (tên codec, bỏ trống = PCM). Codec "cn" (13,
+# như payload type CN của RFC 3389) là gói comfort noise khi người gửi đang DTX.
+import json
+import logging
+import struct
+import time
+from collections import namedtuple
+
+from shared import config
+
+FRAME_MAGIC = 0xA5
+FRAME_VERSION = 2
+SUPPORTED_FRAME_VERSIONS = (1, 2)
+
+FRAME_AUDIO = 1
+FRAME_BIND = 2   # UDP: client đăng ký / keep-alive địa chỉ, server trả lại để xác nhận
+
+# Codec audio (id trong flags & FLAG_CODEC_MASK). Client khai báo codec hỗ trợ khi
+# REGISTER, server chọn codec chung cho từng phòng (ROOM_CODEC) - xem negotiate_codec
+CODEC_PCM = 0
+CODEC_ULAW = 1
+CODEC_ADPCM = 2
+CODEC_OPUS = 3
+CODEC_CN = 13   # comfort noise (DTX): không bao giờ được chọn làm codec của phòng
+CODEC_NAMES = {CODEC_PCM: "pcm", CODEC_ULAW: "ulaw", CODEC_ADPCM: "adpcm", CODEC_OPUS: "opus", CODEC_CN: "cn"}
+CODEC_IDS = {name: codec_id for codec_id, name in CODEC_NAMES.items()}
+FLAG_CODEC_MASK = 0x0F
+
+FRAME_HEADERS = {
+    1: struct.Struct("!BBBBHIH"),
+    2: struct.Struct("!BBBBHIIH"),
+}
+MIN_HEADER_SIZE = min(header.size for header in FRAME_HEADERS.values())
+MAX_PAYLOAD = 0xFFFF
+MAX_LINE_LENGTH = 1 << 20  # giới hạn một dòng JSON để tránh buffer phình vô hạn
+RECV_BUFFER_SIZE = 1 << 14  # buffer nhận dùng lại của mỗi kết nối (tự nới khi gặp message lớn hơn)
+
+MIXER_SENDER_ID = 0   # frame do server trộn (phòng chế độ mix)
+MIXER_NAME = "mix"
+
+MEDIA_TOKEN_SIZE = 8  # datagram UDP client -> server: token | media frame
+
+# timestamp = None với frame v1 (không có đồng hồ mẫu)
+MediaFrame = namedtuple('MediaFrame', ['type', 'flags', 'sender_id', 'seq', 'payload', 'timestamp'],
+                        defaults=(None,))
+
+
+class ProtocolError(ValueError):
+    """Dữ liệu nhận được không đúng định dạng, không thể đồng bộ lại stream"""
+
+
+def negotiate_frame_version(offered):
+    """Chọn phiên bản framing cao nhất mà cả hai bên cùng hỗ trợ (None = chỉ dùng JSON)"""
+    try:
+        common = set(offered or ()) & set(SUPPORTED_FRAME_VERSIONS)
+    except TypeError:
+        return None
+    return max(common) if common else None
+
+
+def parse_codecs(offered):
+    """Danh sách codec client khai báo -> frozenset tên hợp lệ (luôn có 'pcm')"""
+    try:
+        names = {name for name in offered or () if name in CODEC_IDS}
+    except TypeError:
+        names = set()
+    names.add(CODEC_NAMES[CODEC_PCM])
+    return frozenset(names)
+
+
+def negotiate_codec(member_codecs, preference=config.AUDIO_CODECS):
+    """Codec đầu tiên (theo thứ tự ưu tiên) mà mọi thành viên đều hỗ trợ"""
+    common = frozenset.intersection(*member_codecs) if member_codecs else frozenset()
+    for name in preference:
+        if name in common:
+            return name
+    return CODEC_NAMES[CODEC_PCM]
+
+
+def media_timestamp(now=None):
+    """Timestamp media (số mẫu AUDIO_RATE kể từ epoch, modulo 2^32) cho thời điểm now.
+
+    Neo vào đồng hồ thực nên bên nhận ước lượng được độ trễ đầu-cuối
+    (chính xác khi hai máy đồng bộ giờ, vd. NTP).
+    """
+    return int((time.time() if now is None else now) * config.AUDIO_RATE) & 0xFFFFFFFF
+
+
+SEQ_MOD = 1 << 32   # seq và timestamp media là số 32 bit, quay vòng
+
+
+def seq_delta(seq, ref):
+    """Khoảng cách seq - ref có dấu (theo modulo 2^32)"""
+    delta = (seq - ref) % SEQ_MOD
+    return delta - SEQ_MOD if delta >= SEQ_MOD // 2 else delta
+
+
+def signed32(value):
+    """Hiệu hai timestamp 32 bit (đã quay vòng) về số nguyên có dấu"""
+    value &= 0xFFFFFFFF
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+def encode_frame(payload, seq=0, sender_id=0, frame_type=FRAME_AUDIO, flags=0, timestamp=None,
+                 version=FRAME_VERSION):
+    """Đóng gói payload thành media frame theo phiên bản framing của người nhận.
+
+    payload có thể là bytes hoặc memoryview (vd. một lát của buffer nhận):
+    chỉ có một lần cấp phát cho frame kết quả, payload không bị sao chép trung gian.
+    timestamp bị bỏ qua với v1.
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload too large: {len(payload)} bytes")
+    if version == 1:
+        header = FRAME_HEADERS[1].pack(FRAME_MAGIC, 1, frame_type, flags,
+                                       sender_id & 0xFFFF, seq & 0xFFFFFFFF, len(payload))
+    else:
+        header = FRAME_HEADERS[2].pack(FRAME_MAGIC, 2, frame_type, flags, sender_id & 0xFFFF,
+                                       seq & 0xFFFFFFFF, (timestamp or 0) & 0xFFFFFFFF, len(payload))
+    return b"".join((header, payload))
+
+
+def _unpack_header(header, data, pos):
+    """-> (frame_type, flags, sender_id, seq, timestamp, length)"""
+    fields = header.unpack_from(data, pos)
+    if len(fields) == 7:
+        _, _, frame_type, flags, sender_id, seq, length = fields
+        return frame_type, flags, sender_id, seq, None, length
+    _, _, frame_type, flags, sender_id, seq, timestamp, length = fields
+    return frame_type, flags, sender_id, seq, timestamp, length
+
+
+def encode_json(message):
+    """Đóng gói control message thành một dòng JSON"""
+    return (json.dumps(message) + "\n").encode(config.ENCODING)
+
+
+def decode_frame(data, copy=True):
+    """Giải mã đúng một media frame (ví dụ một datagram UDP), trả về None nếu không hợp lệ.
+
+    copy=False: payload là memoryview trỏ vào data (chỉ dùng được khi data còn nguyên).
+    """
+    if len(data) < MIN_HEADER_SIZE or data[0] != FRAME_MAGIC:
+        return None
+    header = FRAME_HEADERS.get(data[1])
+    if header is None or len(data) < header.size:
+        return None
+    frame_type, flags, sender_id, seq, timestamp, length = _unpack_header(header, data, 0)
+    if len(data) - header.size < length:
+        return None
+    payload = memoryview(data)[header.size:header.size + length]
+    return MediaFrame(frame_type, flags, sender_id, seq, bytes(payload) if copy else payload, timestamp)
+
+
+class FrameDecoder:
+    """Tách stream TCP thành control message (dict) và media frame (MediaFrame).
+
+    Dữ liệu được đọc thẳng vào một bytearray dùng lại (recv_into), không nối
+    chuỗi. Với copy_payload=False, payload của MediaFrame là memoryview trỏ vào
+    buffer đó: chỉ hợp lệ tới lần recv_into() / feed() tiếp theo, người dùng
+    phải xử lý (hoặc tự sao chép) ngay.
+    """
+
+    def __init__(self, copy_payload=True, capacity=RECV_BUFFER_SIZE):
+        self.copy_payload = copy_payload
+        self._set_buffer(bytearray(capacity))
+        self.start = 0   # đầu phần dữ liệu chưa xử lý
+        self.end = 0     # cuối phần dữ liệu đã nhận
+
+    def _set_buffer(self, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+
+    def _make_room(self, needed=1):
+        """Dồn phần chưa xử lý về đầu buffer (và nới buffer nếu vẫn không đủ chỗ)"""
+        if len(self.buffer) - self.end >= needed:
+            return
+        pending = self.end - self.start
+        if pending + needed > len(self.buffer):
+            if pending + needed > MAX_LINE_LENGTH + RECV_BUFFER_SIZE:
+                self.start = self.end = 0
+                raise ProtocolError("Control message too long")
+            grown = bytearray(max(len(self.buffer) * 2, pending + needed))
+            grown[:pending] = self.view[self.start:self.end]
+            self._set_buffer(grown)
+        elif pending:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def recv_into(self, sock):
+        """Đọc từ socket vào buffer dùng lại. Trả về số byte (0 = kết nối đã đóng)."""
+        self._make_room(config.BUFFER_SIZE)
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data):
+        """Thêm dữ liệu mới, trả về danh sách message đã hoàn chỉnh"""
+        self._make_room(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        return self.messages()
+
+    def messages(self):
+        """Trả về danh sách message hoàn chỉnh trong buffer"""
+        messages = []
+        buf = self.buffer
+        view = self.view
+        pos = self.start
+        end = self.end
+
+        while pos < end:
+            if buf[pos] == FRAME_MAGIC:
+                if end - pos < 2:
+                    break
+                header = FRAME_HEADERS.get(buf[pos + 1])
+                if header is None:
+                    self.start = self.end = 0
+                    raise ProtocolError(f"Unsupported frame version: {buf[pos + 1]}")
+                if end - pos < header.size:
+                    break
+                frame_type, flags, sender_id, seq, timestamp, length = _unpack_header(header, buf, pos)
+                start = pos + header.size
+                if end - start < length:
+                    break
+                payload = view[start:start + length]
+                messages.append(MediaFrame(frame_type, flags, sender_id, seq,
+                                           bytes(payload) if self.copy_payload else payload, timestamp))
+                pos = start + length
+                continue
+
+            newline = buf.find(b"\n", pos, end)
+            if newline < 0:
+                if end - pos > MAX_LINE_LENGTH:
+                    self.start = self.end = 0
+                    raise ProtocolError("Control message too long")
+                break
+            line = bytes(view[pos:newline]).strip()
+            pos = newline + 1
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line.decode(config.ENCODING)))
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                logging.warning(f"[Protocol] Invalid JSON: {e}, data: {line[:200]!r}")
+
+        if pos >= end:
+            pos = end = 0  # đã xử lý hết: lần nhận sau ghi từ đầu buffer
+        self.start = pos
+        self.end = end
+        return messages
@@ -0,0 +1,139 @@
+# shared/tracing.py
+# Tracing cho đường nóng (mỗi gói audio) của client & server.
+#
+# Mỗi điểm trace là một Tracepoint tạo sẵn ở mức module. Khi tắt, chi phí tại
+# chỗ gọi chỉ là đọc một thuộc tính:
+#
+#     TRACE_FORWARD = tracing.tracepoint("server.forward")
+#     ...
+#     if TRACE_FORWARD.enabled and TRACE_FORWARD.sampled():
+#         TRACE_FORWARD.emit(user=username, bytes=len(pcm))
+#
+# Các field chỉ được tạo / format khi sự kiện thực sự được ghi.
+#
+# Bật bằng config.TRACE, biến môi trường VOICECHAT_TRACE hoặc --trace của server.
+# Cú pháp: danh sách cách nhau bởi dấu phẩy, tên có thể dùng wildcard:
+#     server.forward          ghi mọi sự kiện
+#     server.forward=100      lấy mẫu 1/100
+#     client.*=5/s            tối đa 5 sự kiện mỗi giây cho mỗi điểm trace
+import fnmatch
+import logging
+import os
+import threading
+import time
+
+from shared import config
+
+ENV_VAR = "VOICECHAT_TRACE"
+
+_registry = {}   # name -> Tracepoint
+_rules = []      # [(pattern, every, rate)]
+_lock = threading.Lock()
+
+
+class Tracepoint:
+    """Một điểm trace có tên, lấy mẫu 1/N hoặc giới hạn số sự kiện mỗi giây"""
+
+    __slots__ = ('name', 'enabled', 'every', 'interval', '_count', '_skipped', '_next_emit')
+
+    def __init__(self, name):
+        self.name = name
+        self.enabled = False
+        self.every = 1
+        self.interval = 0.0   # > 0: giới hạn theo thời gian (1 / rate)
+        self._count = 0
+        self._skipped = 0
+        self._next_emit = 0.0
+
+    def _set(self, every, rate):
+        self.every = max(1, int(every or 1))
+        self.interval = 1.0 / rate if rate else 0.0
+        self._count = 0
+        self._skipped = 0
+        self._next_emit = 0.0
+        self.enabled = True
+
+    def _disable(self):
+        self.enabled = False
+
+    def sampled(self):
+        """True nếu sự kiện hiện tại cần được ghi (đếm không lock, sai số nhỏ chấp nhận được)"""
+        self._count += 1
+        if self.interval:
+            now = time.monotonic()
+            if now < self._next_emit:
+                self._skipped += 1
+                return False
+            self._next_emit = now + self.interval
+            return True
+        if self._count % self.every:
+            self._skipped += 1
+            return False
+        return True
+
+    def emit(self, **fields):
+        """Ghi một sự kiện với các field có cấu trúc (key=value)"""
+        skipped, self._skipped = self._skipped, 0
+        text = " ".join(f"{key}={value}" for key, value in fields.items())
+        if skipped:
+            text += f" skipped={skipped}"
+        logging.info(f"[Trace] {self.name} {text}")
+
+
+def tracepoint(name):
+    """Lấy (hoặc tạo) tracepoint theo tên, áp dụng cấu hình trace hiện tại"""
+    with _lock:
+        point = _registry.get(name)
+        if point is None:
+            point = _registry[name] = Tracepoint(name)
+            _apply(point)
+        return point
+
+
+def parse_spec(spec):
+    """'server.forward=100,client.*=5/s' -> [(pattern, every, rate)]"""
+    rules = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        pattern, _, sampling = item.partition("=")
+        every, rate = 1, None
+        sampling = sampling.strip()
+        if sampling.endswith("/s"):
+            rate = float(sampling[:-2])
+            if rate <= 0:
+                raise ValueError(f"Invalid trace rate: {item}")
+        elif sampling:
+            every = int(sampling)
+            if every < 1:
+                raise ValueError(f"Invalid trace sampling: {item}")
+        rules.append((pattern.strip(), every, rate))
+    return rules
+
+
+def configure(spec=None):
+    """Đặt lại cấu hình trace. spec=None: lấy từ VOICECHAT_TRACE hoặc config.TRACE"""
+    global _rules
+    if spec is None:
+        spec = os.environ.get(ENV_VAR, config.TRACE)
+    rules = parse_spec(spec)
+    with _lock:
+        _rules = rules
+        for point in _registry.values():
+            _apply(point)
+
+
+def _apply(point):
+    # Luật khớp sau cùng được ưu tiên (vd "*=100,server.forward" bật đầy đủ server.forward)
+    for pattern, every, rate in reversed(_rules):
+        if fnmatch.fnmatchcase(point.name, pattern):
+            point._set(every, rate)
+            return
+    point._disable()
+
+
+try:
+    configure()
+except ValueError as e:
+    logging.warning(f"[Trace] Invalid trace configuration ignored: {e}")
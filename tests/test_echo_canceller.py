@@ -0,0 +1,54 @@
+import threading
+import unittest
+
+import numpy as np
+
+from Client.echo_canceller import EchoCanceller
+
+BLOCK = 256
+
+
+def _ramp(start, count):
+    return (np.arange(start, start + count) % 30000).astype(np.int16).tobytes()
+
+
+class FarHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.aec = EchoCanceller(block=BLOCK)
+        self.size = len(self.aec.far)
+
+    def test_add_reference_does_not_take_lock(self):
+        # Thread thu giữ lock khi ước lượng độ trễ: callback phát không được chờ
+        done = threading.Event()
+        with self.aec.lock:
+            writer = threading.Thread(target=lambda: (self.aec.add_reference(_ramp(0, BLOCK)), done.set()))
+            writer.start()
+            self.assertTrue(done.wait(1.0))
+        writer.join()
+        self.assertEqual(self.aec.far_pos, BLOCK)
+
+    def test_read_far_across_wraparound(self):
+        total = self.size + 3 * BLOCK + 17
+        self.aec.add_reference(_ramp(0, total))   # chunk lớn được ghi thành nhiều phần
+        self.assertEqual(self.aec.far_pos, total)
+        out = np.empty(4 * BLOCK)
+        start = total - len(out)
+        self.aec._read_far(start, out)
+        np.testing.assert_array_equal(out, np.frombuffer(_ramp(start, len(out)), dtype=np.int16))
+
+    def test_read_far_outside_history_is_zero(self):
+        total = self.size + BLOCK
+        self.aec.add_reference(_ramp(0, total))
+        out = np.empty(2 * BLOCK)
+        start = total - self.size   # mẫu cũ nhất: nằm trong vùng có thể đang bị ghi đè
+        self.aec._read_far(start, out)
+        guard = self.aec.far_guard
+        self.assertFalse(out[:guard].any())
+        np.testing.assert_array_equal(out[guard:],
+                                      np.frombuffer(_ramp(start + guard, len(out) - guard), dtype=np.int16))
+        self.aec._read_far(total - BLOCK, out)   # mẫu chưa ghi
+        self.assertFalse(out[BLOCK:].any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from unittest import mock
+
+from Server import idle_tracker
+from Server.idle_tracker import IdleTracker
+
+
+class IdleTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(idle_tracker.time, 'monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tracker = IdleTracker(timeout=5.0, tick=1.0)
+
+    def test_expires_after_timeout(self):
+        self.tracker.add('a')
+        self.assertEqual(self.tracker.expire(1004.5), [])
+        self.assertEqual(self.tracker.expire(1006.0), ['a'])
+        self.assertEqual(self.tracker.expire(1020.0), [])   # chỉ báo một lần
+
+    def test_touch_postpones_expiry(self):
+        self.tracker.add('a')
+        self.now = 1003.0
+        self.tracker.touch('a')
+        self.assertEqual(self.tracker.expire(1006.0), [])
+        self.assertEqual(self.tracker.expire(1007.5), [])
+        self.assertEqual(self.tracker.expire(1009.0), ['a'])
+
+    def test_removed_key_never_expires(self):
+        self.tracker.add('a')
+        self.tracker.remove('a')
+        self.tracker.touch('a')   # touch sau remove không thêm lại
+        self.assertEqual(self.tracker.expire(1100.0), [])
+        self.assertEqual(len(self.tracker), 0)
+
+    def test_only_idle_keys_expire(self):
+        self.tracker.add('a')
+        self.tracker.add('b')
+        for second in range(1, 8):
+            self.now = 1000.0 + second
+            self.tracker.touch('b')
+            expired = self.tracker.expire()
+            if expired:
+                self.assertEqual((second, expired), (5, ['a']))
+        self.assertEqual(len(self.tracker), 2)   # expire() không tự xóa key
+
+    def test_late_check_after_wheel_rollover(self):
+        # Kiểm tra trễ hơn nhiều vòng bánh xe: mỗi ô chỉ duyệt một lần, không mất key
+        self.tracker.add('a')
+        self.now = 1002.0
+        self.tracker.add('b')
+        self.assertEqual(sorted(self.tracker.expire(1100.0)), ['a', 'b'])
+
+    def test_touched_key_survives_many_wheel_turns(self):
+        self.tracker.add('a')
+        for second in range(1, 40):
+            self.now = 1000.0 + second
+            self.tracker.touch('a')
+            self.assertEqual(self.tracker.expire(), [])
+        self.assertEqual(self.tracker.expire(1000.0 + 39 + 6), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
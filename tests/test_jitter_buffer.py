@@ -0,0 +1,88 @@
+import unittest
+
+import numpy as np
+
+from shared import config
+from Client.jitter_buffer import JitterBuffer
+
+FRAME = config.AUDIO_CHUNK
+BASE = 10 ** 6   # mẫu, gốc đồng hồ giả lập
+
+
+def _pcm(value):
+    return np.full(FRAME, value, dtype=np.int16).tobytes()
+
+
+def _push(buffer, seq, value=None, position=None):
+    """Frame seq (vị trí position trong luồng, mặc định = seq) đến đúng hạn:
+    thời gian truyền không đổi -> jitter 0"""
+    position = seq if position is None else position
+    timestamp = (BASE + position * FRAME) & 0xFFFFFFFF
+    now = (BASE + position * FRAME + 0.5) / config.AUDIO_RATE
+    return buffer.push(seq, _pcm(seq % 1000 if value is None else value), timestamp=timestamp, now=now)
+
+
+def _value(pcm):
+    return None if pcm is None else int(np.frombuffer(pcm, dtype=np.int16)[0])
+
+
+class JitterBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = JitterBuffer(min_frames=1, max_frames=10, initial_frames=2)
+
+    def test_reordered_frames_play_in_seq_order(self):
+        for seq in (3, 1, 2):
+            self.assertTrue(_push(self.buffer, seq))
+        self.assertEqual([_value(self.buffer.pop()) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(self.buffer.stats['played'], 3)
+
+    def test_seq_wraparound(self):
+        # Đến lệch thứ tự quanh điểm quay vòng 2^32
+        for seq, position in ((0, 0), (1, 1), (0xFFFFFFFF, -1), (0xFFFFFFFE, -2)):
+            _push(self.buffer, seq, position + 3, position)
+        self.assertEqual([_value(self.buffer.pop()) for _ in range(4)], [1, 2, 3, 4])
+        self.assertEqual(self.buffer.stats['late'], 0)
+
+    def test_late_and_duplicate_frames_are_dropped(self):
+        _push(self.buffer, 1)
+        _push(self.buffer, 2)
+        self.assertEqual(_value(self.buffer.pop()), 1)
+        self.assertFalse(_push(self.buffer, 2))   # vẫn đang chờ phát
+        self.assertFalse(_push(self.buffer, 1))   # đã qua thời điểm phát
+        self.assertEqual(self.buffer.stats['duplicates'], 1)
+        self.assertEqual(self.buffer.stats['late'], 1)
+        self.assertEqual(_value(self.buffer.pop()), 2)
+
+    def test_missing_frame_is_concealed(self):
+        _push(self.buffer, 1, 1000)
+        _push(self.buffer, 3, 3000)
+        self.assertEqual(_value(self.buffer.pop()), 1000)
+        self.assertEqual(_value(self.buffer.pop()), int(1000 * config.PLC_FADE))
+        self.assertEqual(_value(self.buffer.pop()), 3000)
+        self.assertEqual(self.buffer.stats['concealed'], 1)
+
+    def test_concealment_fades_then_goes_silent(self):
+        _push(self.buffer, 1, 1000)
+        self.assertEqual(_value(self.buffer.pop()), 1000)
+        concealed = [_value(self.buffer.pop()) for _ in range(config.PLC_MAX_FRAMES + 1)]
+        expected = [int(1000 * config.PLC_FADE ** n) for n in range(1, config.PLC_MAX_FRAMES + 1)]
+        self.assertEqual(concealed, expected + [None])
+        self.assertEqual(self.buffer.stats['underruns'], 1)
+
+    def test_buffers_to_target_depth_before_playing(self):
+        buffer = JitterBuffer(min_frames=3, max_frames=10, initial_frames=3)
+        _push(buffer, 1)
+        _push(buffer, 2)
+        self.assertIsNone(buffer.pop())
+        _push(buffer, 3)
+        self.assertEqual(_value(buffer.pop()), 1)
+
+    def test_sender_restart_resyncs(self):
+        _push(self.buffer, 500)
+        self.assertEqual(_value(self.buffer.pop()), 500)
+        self.assertTrue(_push(self.buffer, 1))   # seq lùi rất xa: người gửi khởi động lại
+        self.assertEqual(_value(self.buffer.pop()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
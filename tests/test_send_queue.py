@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+from Server import send_queue
+from Server.send_queue import SendQueue
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(send_queue.time, 'time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = SendQueue(max_media=4, max_control=3, overflow_disconnect=2.0)
+
+    def _drain(self):
+        items = []
+        while True:
+            item = self.queue.get_nowait()
+            if item is None:
+                return items
+            items.append(item)
+
+    def test_media_overflow_drops_oldest(self):
+        for i in range(6):
+            self.assertTrue(self.queue.put(f"m{i}", media=True))
+        self.assertEqual(self.queue.dropped, 2)
+        self.assertEqual(self._drain(), ["m2", "m3", "m4", "m5"])
+
+    def test_control_is_never_dropped_and_sent_first(self):
+        self.queue.put("m0", media=True)
+        self.queue.put("c0")
+        for i in range(1, 7):
+            self.queue.put(f"m{i}", media=True)
+        self.queue.put("c1")
+        self.assertEqual(self._drain(), ["c0", "c1", "m3", "m4", "m5", "m6"])
+        self.assertEqual(self.queue.dropped, 3)
+
+    def test_control_over_limit_disconnects(self):
+        for i in range(3):
+            self.assertTrue(self.queue.put(f"c{i}"))
+        self.assertFalse(self.queue.put("c3"))
+        self.assertEqual(self._drain(), ["c0", "c1", "c2"])
+
+    def test_sustained_overflow_disconnects(self):
+        for i in range(5):
+            self.assertTrue(self.queue.put(f"m{i}", media=True))   # lần bỏ đầu tiên: bắt đầu đợt tràn
+        self.now += 1.0
+        self.assertTrue(self.queue.put("m5", media=True))
+        self.now += 1.5
+        self.assertFalse(self.queue.put("m6", media=True))
+
+    def test_draining_ends_overflow(self):
+        for i in range(5):
+            self.queue.put(f"m{i}", media=True)
+        self.assertTrue(self.queue.stats()['overflowing'])
+        self.queue.get_nowait()
+        self.queue.get_nowait()   # còn 2 <= max_media // 2
+        self.assertFalse(self.queue.stats()['overflowing'])
+        self.now += 10.0
+        for i in range(5, 8):
+            self.assertTrue(self.queue.put(f"m{i}", media=True))
+
+    def test_batch_prefers_control_and_respects_limit(self):
+        for i in range(3):
+            self.queue.put(f"m{i}", media=True)
+        self.queue.put("c0")
+        self.assertEqual(self.queue.get_batch_nowait(3), ["c0", "m0", "m1"])
+        self.assertEqual(self.queue.get_batch_nowait(3), ["m2"])
+        self.assertEqual(self.queue.get_batch_nowait(3), [])
+
+    def test_close_discards_and_accepts_silently(self):
+        self.queue.put("m0", media=True)
+        self.queue.close()
+        self.assertTrue(self.queue.put("m1", media=True))
+        self.assertIsNone(self.queue.get(timeout=0.01))
+        self.assertEqual(self.queue.stats()['queue_depth'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
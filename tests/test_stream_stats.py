@@ -0,0 +1,77 @@
+import unittest
+
+from shared import config
+from Client.stream_stats import StreamStats
+
+FRAME = config.AUDIO_CHUNK
+BASE = 10 ** 6   # mẫu, gốc đồng hồ giả lập
+
+
+def _arrival(samples):
+    """Thời điểm (giây) mà media_timestamp() trả về đúng samples"""
+    return (BASE + samples + 0.5) / config.AUDIO_RATE
+
+
+class StreamStatsLossTest(unittest.TestCase):
+    """Đếm mất gói theo RFC 3550 phụ lục A.3: expected = max_seq - base_seq + 1"""
+
+    def _summary(self, seqs):
+        stats = StreamStats()
+        for seq in seqs:
+            stats.update(seq)
+        return stats.summary()
+
+    def test_gap_is_counted_as_loss(self):
+        summary = self._summary([1, 2, 4, 5])
+        self.assertEqual((summary['expected'], summary['received'], summary['lost']), (5, 4, 1))
+        self.assertEqual(summary['loss_rate'], 0.2)
+
+    def test_reordered_frame_is_not_lost(self):
+        summary = self._summary([1, 3, 2, 4])
+        self.assertEqual((summary['lost'], summary['reordered']), (0, 1))
+
+    def test_duplicates_are_not_counted_as_received(self):
+        summary = self._summary([1, 2, 2, 3])
+        self.assertEqual((summary['received'], summary['duplicates'], summary['lost']), (3, 1, 0))
+
+    def test_seq_wraparound(self):
+        summary = self._summary([0xFFFFFFFE, 0xFFFFFFFF, 1, 2])
+        self.assertEqual((summary['expected'], summary['lost'], summary['resets']), (5, 1, 0))
+
+    def test_large_jump_restarts_counting(self):
+        summary = self._summary([1, 2, 3, 100000, 100001])
+        self.assertEqual((summary['expected'], summary['lost'], summary['resets']), (2, 0, 1))
+
+
+class StreamStatsJitterTest(unittest.TestCase):
+    """Jitter theo RFC 3550 phụ lục A.8: J += (|D(i-1, i)| - J) / 16"""
+
+    def test_constant_transit_has_no_jitter(self):
+        stats = StreamStats()
+        for i in range(50):
+            stats.update(i, (BASE + i * FRAME) & 0xFFFFFFFF, now=_arrival(i * FRAME + 320))
+        self.assertEqual(stats.jitter, 0.0)
+        self.assertEqual(stats.summary()['delay_ms'], 20.0)
+
+    def test_alternating_delay_converges_to_estimator(self):
+        # Frame lẻ đến trễ thêm 160 mẫu (10 ms): |D| = 160 cho mọi cặp liên tiếp
+        stats = StreamStats()
+        expected = 0.0
+        for i in range(40):
+            stats.update(i, i * FRAME, now=_arrival(i * FRAME - BASE + 160 * (i % 2)))
+            if i:
+                expected += (160 - expected) / 16.0
+        self.assertAlmostEqual(stats.jitter, expected)
+        self.assertAlmostEqual(stats.jitter, 160 * (1 - (15 / 16) ** 39))
+
+    def test_timestamp_wraparound_is_not_jitter(self):
+        # Timestamp người gửi và đồng hồ người nhận cùng quay vòng qua 2^32
+        stats = StreamStats()
+        for i in range(-3, 3):
+            stats.update(i & 0xFFFFFFFF, (i * FRAME) & 0xFFFFFFFF, now=_arrival((1 << 32) + i * FRAME - BASE))
+        self.assertEqual(stats.jitter, 0.0)
+        self.assertEqual(stats.summary()['lost'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()